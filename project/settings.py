@@ -42,6 +42,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.middleware.StatsMiddleware',
+    'shop.middleware.ReplicaPinningMiddleware',
+    # Before the middlewares reading or changing the body of the responses
+    'shop.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,13 +79,27 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Production profile: persistent connections, write transactions taking the lock at BEGIN,
+# and the PRAGMAs of shop/sqlite.py (WAL journal, page cache, busy timeout...)
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'shop.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 60,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    # Local read replica, a copy of the primary made by manage.py replicate
+    'replica': {
+        'ENGINE': 'shop.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.replica.sqlite3',
+        'CONN_MAX_AGE': 60,
+    },
 }
 
+DATABASE_ROUTERS = ['shop.replicas.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -132,6 +150,71 @@ REST_FRAMEWORK = {
     # 'DEFAULT_PERMISSION_CLASSES': [
     #     'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     # ]
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
-    'PAGE_SIZE': 6
+    'DEFAULT_PAGINATION_CLASS': 'shop.pagination.ShopPagination',
+    'PAGE_SIZE': 6,
+    # MessagePack through "Accept: application/msgpack" / "Content-Type: application/msgpack",
+    # left out of the negotiation when msgpack is not installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'shop.renderers.FastJSONRenderer',
+        'shop.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'shop.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_CONTENT_NEGOTIATION_CLASS': 'shop.negotiation.ShopContentNegotiation',
+}
+
+# Compression of the API responses, see shop/compression.py for the available keys.
+# Brotli is used when the brotli package is installed, gzip otherwise
+COMPRESSION = {
+    'PATHS': ['/api/'],
+    'MIN_SIZE': 1024,
+    'STREAMING': True,
+}
+
+# Ecoscore cache, see shop/ecoscore.py for the available keys (durations are in seconds)
+ECOSCORE = {
+    'TTL': 24 * 60 * 60,
+    'NEGATIVE_TTL': 5 * 60,
+    'STALE_TTL': 60 * 60,
+}
+
+# Local memory is per process: use a shared backend (Redis, Memcached) when running several workers,
+# so that they all see the version bumps of the response cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Response cache of the public endpoints, see shop/cache.py for the available keys
+RESPONSE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 5 * 60,
+}
+
+# Serve the public article endpoints from the product and category names copied on the articles
+DENORMALIZED_ARTICLES = True
+
+# Serve the summaries from the per product rollups instead of aggregating the articles, see shop/summary.py
+CATALOG_ROLLUP = False
+
+# Serve the category details from the pre-rendered snapshots, see shop/snapshots.py for the available keys.
+# Run manage.py refresh_snapshots after enabling it on an existing catalog
+CATEGORY_SNAPSHOTS = {
+    'ENABLED': False,
+    'BACKGROUND': True,
+    'DELAY': 0.1,
+}
+
+# Read replicas of the public endpoints, see shop/replicas.py for the available keys.
+# Add 'replica' to ALIASES to serve the reads from the copy made by manage.py replicate
+REPLICAS = {
+    'ALIASES': [],
+    'STRATEGY': 'round_robin',
+    'MAX_LAG': 5,
 }
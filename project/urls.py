@@ -2,7 +2,9 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
 
-from shop.views import CategoryViewSet, ProductViewSet, ArticleViewSet, AdminCategoryViewSet, AdminArticleViewSet
+from shop.async_views import async_view
+
+from shop.views import CategoryViewSet, ProductViewSet, ArticleViewSet, AdminCategoryViewSet, AdminArticleViewSet, AdminStatsViewSet
 
 router = routers.SimpleRouter()
 router.register('category', CategoryViewSet, basename='category')
@@ -10,9 +12,22 @@ router.register('product', ProductViewSet, basename='product')
 router.register('article', ArticleViewSet, basename='article')
 router.register('admin/category', AdminCategoryViewSet, basename='admin-category')
 router.register('admin/article', AdminArticleViewSet, basename='admin-article')
+router.register('admin/stats', AdminStatsViewSet, basename='admin-stats')
+
+# The read-only endpoints again, for ASGI deployments
+async_urls = []
+for prefix, viewset in (('category', CategoryViewSet), ('product', ProductViewSet), ('article', ArticleViewSet)):
+    basename = f'async-{prefix}'
+    async_urls += [
+        path(f'{prefix}/', async_view(viewset, {'get': 'list'}, basename=basename, detail=False),
+             name=f'{basename}-list'),
+        path(f'{prefix}/<str:pk>/', async_view(viewset, {'get': 'retrieve'}, basename=basename, detail=True),
+             name=f'{basename}-detail'),
+    ]
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
+    path('api/async/', include(async_urls)),
     path('api/', include(router.urls))
 ]
@@ -2,14 +2,28 @@ from django.contrib import admin
 from shop.models import Category, Product, Article
 
 
+def report_disabled(modeladmin, request, counts):
+    modeladmin.message_user(request, 'Disabled ' + ', '.join(f'{count} {label}' for label, count in counts.items()))
+
+
 class CategoryAdmin(admin.ModelAdmin):
 
     list_display = ('name', 'active')
+    actions = ['disable']
+
+    @admin.action(description='Disable selected categories with their products and articles')
+    def disable(self, request, queryset):
+        report_disabled(self, request, queryset.disable())
 
 
 class ProductAdmin(admin.ModelAdmin):
 
     list_display = ('name', 'category', 'active')
+    actions = ['disable']
+
+    @admin.action(description='Disable selected products with their articles')
+    def disable(self, request, queryset):
+        report_disabled(self, request, queryset.disable())
 
 
 class ArticleAdmin(admin.ModelAdmin):
@@ -0,0 +1,35 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.test.signals import setting_changed
+
+
+class ShopConfig(AppConfig):
+    name = 'shop'
+
+    def ready(self):
+        from shop.cache import bump_sender_version
+        from shop.snapshots import configure_queue, stale_article_snapshots, stale_category_snapshot, \
+            stale_product_snapshots
+        from shop.sqlite import configure_connection
+        from shop.stats import install_sql_wrapper
+        from shop.summary import create_product_rollup, stale_article_rollups
+        from shop.models import Category, Product, Article
+
+        for model in (Category, Product, Article):
+            post_save.connect(bump_sender_version, sender=model, dispatch_uid=f'shop_cache_{model.__name__}_save')
+            post_delete.connect(bump_sender_version, sender=model, dispatch_uid=f'shop_cache_{model.__name__}_delete')
+
+        post_save.connect(create_product_rollup, sender=Product, dispatch_uid='shop_rollup_product_save')
+        post_save.connect(stale_article_rollups, sender=Article, dispatch_uid='shop_rollup_article_save')
+        post_delete.connect(stale_article_rollups, sender=Article, dispatch_uid='shop_rollup_article_delete')
+
+        post_save.connect(stale_category_snapshot, sender=Category, dispatch_uid='shop_snapshot_category_save')
+        for model, receiver in ((Product, stale_product_snapshots), (Article, stale_article_snapshots)):
+            post_save.connect(receiver, sender=model, dispatch_uid=f'shop_snapshot_{model.__name__}_save')
+            post_delete.connect(receiver, sender=model, dispatch_uid=f'shop_snapshot_{model.__name__}_delete')
+        configure_queue()
+        setting_changed.connect(configure_queue, dispatch_uid='shop_snapshot_settings')
+
+        connection_created.connect(install_sql_wrapper, dispatch_uid='shop_stats_sql_wrapper')
+        connection_created.connect(configure_connection, dispatch_uid='shop_sqlite_pragmas')
@@ -0,0 +1,33 @@
+"""
+The SQLite backend of Django, with the ``transaction_mode`` option of Django 5.1.
+
+``OPTIONS = {'transaction_mode': 'IMMEDIATE'}`` opens the transactions with
+``BEGIN IMMEDIATE``: a write transaction takes the write lock when it starts,
+waiting for it under ``busy_timeout``, instead of reading under a deferred
+lock and failing with "database is locked" when it upgrades it. Readers are
+never blocked in WAL mode, see ``shop.sqlite``.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    @property
+    def transaction_mode(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        if mode is not None and mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}")
+        return mode and mode.upper()
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # Not an argument of sqlite3.connect()
+        params.pop('transaction_mode', None)
+        return params
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.transaction_mode
+        self.cursor().execute(f'BEGIN {mode}' if mode else 'BEGIN')
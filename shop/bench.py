@@ -0,0 +1,200 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+"""
+import json
+import math
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from shop.mock import ECOSCORE_GRADE
+
+
+class FakeUpstream:
+    """
+    Local stand-in for the OpenFoodFacts API, answering every GET after
+    ``latency`` seconds with ``status``. Both can be changed while it runs,
+    to inject slowness and errors.
+    """
+
+    def __init__(self, latency=0.1, status=200):
+        self.latency = latency
+        self.status = status
+        self.calls = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/api/v0/product/3229820787015.json'
+
+    def _handler(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                upstream.calls += 1
+                time.sleep(upstream.latency)
+                body = json.dumps({'product': {'ecoscore_grade': ECOSCORE_GRADE}}).encode()
+                try:
+                    self.send_response(upstream.status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except ConnectionError:
+                    # The client gave up on this call, e.g. past the batch deadline
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+@contextmanager
+def scratch_database(verbosity=0, name=None):
+    """
+    Run the benchmark against a freshly migrated test database, dropped afterwards.
+    ``name`` puts it in a file, which threads can write concurrently, instead of the SQLite memory default.
+    """
+    old_name = connection.settings_dict['NAME']
+    old_test = connection.settings_dict['TEST']
+    if name:
+        connection.settings_dict['TEST'] = {**old_test, 'NAME': name}
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        connection.settings_dict['TEST'] = old_test
+
+
+@contextmanager
+def timer(results, key):
+    start = time.perf_counter()
+    yield
+    results[key] = time.perf_counter() - start
+
+
+class Scenario:
+    """
+    One benchmarked route: ``call(client, index)`` sends the ``index``-th request,
+    so that successive requests can walk different pages or rows. ``setup(index)``,
+    when given, runs before each request and outside of its timing, to restore
+    the rows a previous request consumed.
+    """
+
+    def __init__(self, name, method, path, data=None, format='json', admin=False, setup=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.format = format
+        self.admin = admin
+        self.setup = setup
+
+    def call(self, client, index):
+        if self.setup is not None:
+            self.setup(index)
+        return self.check(self.send(client, index), index)
+
+    def check(self, response, index):
+        # A failed request is no measure of the route
+        if response.status_code >= 400:
+            raise ValueError(f'{self.name}: HTTP {response.status_code} on request {index}')
+        return response
+
+    def send(self, client, index):
+        path = self.path(index) if callable(self.path) else self.path
+        data = self.data(index) if callable(self.data) else self.data
+        send = getattr(client, self.method)
+        response = send(path, data, format=self.format) if self.method != 'get' else send(path, data)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+
+def percentile(values, quantile):
+    """Nearest-rank percentile of the sorted ``values``."""
+    return values[max(0, math.ceil(quantile * len(values)) - 1)]
+
+
+def measure(client, scenario, requests):
+    """Send ``requests`` requests of ``scenario``, return its throughput, latencies, queries and peak memory."""
+    # The first request warms the caches up and gives the query count
+    with CaptureQueriesContext(connection) as queries:
+        scenario.call(client, 0)
+    # Read now, the next requests empty the query log
+    query_count = len(queries)
+
+    latencies = []
+    for index in range(1, requests + 1):
+        if scenario.setup is not None:
+            scenario.setup(index)
+        start = time.perf_counter()
+        response = scenario.send(client, index)
+        latencies.append(time.perf_counter() - start)
+        scenario.check(response, index)
+    latencies.sort()
+
+    # Apart, tracemalloc slows everything down
+    tracemalloc.start()
+    try:
+        scenario.call(client, requests + 1)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'requests': requests,
+        'throughput': requests / sum(latencies),
+        'latency_ms': {
+            'mean': 1000 * sum(latencies) / requests,
+            'p50': 1000 * percentile(latencies, 0.50),
+            'p95': 1000 * percentile(latencies, 0.95),
+            'p99': 1000 * percentile(latencies, 0.99),
+            'max': 1000 * latencies[-1],
+        },
+        'queries': query_count,
+        'peak_memory_kib': peak / 1024,
+    }
+
+
+def compare(baseline, results, threshold):
+    """
+    Compare two ``{scenario: measure()}`` dicts. Return ``{scenario: (p95 change,
+    throughput change, query change, regressed)}`` for the scenarios of both,
+    changes being ratios and regressions slowdowns beyond ``threshold`` or extra queries.
+    """
+    changes = {}
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        p95 = result['latency_ms']['p95'] / before['latency_ms']['p95'] - 1
+        throughput = result['throughput'] / before['throughput'] - 1
+        queries = result['queries'] - before['queries']
+        changes[name] = (p95, throughput, queries, p95 > threshold or queries > 0)
+    return changes
@@ -0,0 +1,168 @@
+"""
+Bulk write endpoints for the admin viewsets.
+
+Payloads are JSON or MessagePack arrays, or NDJSON streams. Rows are validated and written
+batch by batch: ``get_bulk_context`` preloads what a whole batch needs for
+validation, valid rows are written with ``bulk_create`` / ``bulk_update`` in
+one transaction per batch, and invalid rows are reported by index without
+failing the others. A batch breaking a unique constraint, because a
+concurrent writer took a value since its validation, is written again row by
+row so that only the conflicting rows are reported.
+"""
+from collections.abc import Iterator
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.response import Response
+
+from shop.parsers import MessagePackParser, NDJSONParser
+
+
+class BulkModelMixin:
+    bulk_batch_size = 1000
+
+    def get_bulk_context(self, rows):
+        """Serializer context shared by a batch of rows, e.g. objects preloaded for their validation."""
+        return self.get_serializer_context()
+
+    def iter_bulk_batches(self, request):
+        # A list, or the generator of an NDJSON stream
+        if not isinstance(request.data, (list, Iterator)):
+            raise ValidationError('Expected a list.')
+        rows = iter(request.data)
+        index = 0
+        while True:
+            batch = list(islice(rows, self.bulk_batch_size))
+            if not batch:
+                return
+            yield index, batch
+            index += len(batch)
+
+    def bulk_response(self, written, key, errors):
+        response_status = status.HTTP_400_BAD_REQUEST if errors and not written else status.HTTP_200_OK
+        return Response({key: written, 'errors': errors}, status=response_status)
+
+    @staticmethod
+    def write_batch(objects, write, errors):
+        """Write the ``(index, object)`` pairs with ``write``, return the number of written rows."""
+        try:
+            with transaction.atomic():
+                write([obj for _, obj in objects])
+            return len(objects)
+        except IntegrityError:
+            pass
+        written = 0
+        for index, obj in objects:
+            try:
+                with transaction.atomic():
+                    write([obj])
+                written += 1
+            except IntegrityError:
+                errors.append({'index': index, 'errors': {'non_field_errors': ['Conflicts with an existing row.']}})
+        return written
+
+    @staticmethod
+    def row_error(index, row):
+        if isinstance(row, ParseError):
+            return {'index': index, 'errors': {'non_field_errors': [str(row.detail)]}}
+        if not isinstance(row, dict):
+            return {'index': index, 'errors': {'non_field_errors': ['Expected an object.']}}
+        return None
+
+    @staticmethod
+    def parse_id(value):
+        """``value`` as a primary key, ``None`` unless it is an integer or the string of one."""
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            return None
+
+    def id_error(self, index, pk):
+        if isinstance(pk, ParseError):
+            return {'index': index, 'errors': {'non_field_errors': [str(pk.detail)]}}
+        if self.parse_id(pk) is None:
+            return {'index': index, 'errors': {'non_field_errors': ['A valid integer is required.']}}
+        return None
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser, MessagePackParser])
+    def bulk(self, request):
+        model = self.get_queryset().model
+        serializer_class = self.get_serializer_class()
+        created, errors = 0, []
+        for start, batch in self.iter_bulk_batches(request):
+            context = self.get_bulk_context(batch)
+            objects = []
+            for index, row in enumerate(batch, start=start):
+                error = self.row_error(index, row)
+                if error:
+                    errors.append(error)
+                    continue
+                serializer = serializer_class(data=row, context=context)
+                if serializer.is_valid():
+                    objects.append((index, model(**serializer.validated_data)))
+                else:
+                    errors.append({'index': index, 'errors': serializer.errors})
+            created += self.write_batch(objects, model.objects.bulk_create, errors)
+        return self.bulk_response(created, 'created', errors)
+
+    @bulk.mapping.patch
+    def bulk_update(self, request):
+        model = self.get_queryset().model
+        serializer_class = self.get_serializer_class()
+        updated, errors = 0, []
+        for start, batch in self.iter_bulk_batches(request):
+            context = self.get_bulk_context(batch)
+            instances = self.get_queryset().in_bulk(
+                [self.parse_id(row.get('id')) for row in batch if isinstance(row, dict)]
+            )
+            objects, fields = [], {'date_updated'}
+            now = timezone.now()
+            for index, row in enumerate(batch, start=start):
+                error = self.row_error(index, row)
+                if error:
+                    errors.append(error)
+                    continue
+                pk = self.parse_id(row.get('id'))
+                if pk is None:
+                    errors.append({'index': index, 'errors': {'id': ['A valid integer is required.']}})
+                    continue
+                instance = instances.get(pk)
+                if instance is None:
+                    errors.append({'index': index, 'errors': {'id': ['Not found.']}})
+                    continue
+                serializer = serializer_class(instance, data=row, partial=True, context=context)
+                if not serializer.is_valid():
+                    errors.append({'index': index, 'errors': serializer.errors})
+                    continue
+                for attr, value in serializer.validated_data.items():
+                    setattr(instance, attr, value)
+                    fields.add(attr)
+                # bulk_update() does not apply auto_now
+                instance.date_updated = now
+                objects.append((index, instance))
+            updated += self.write_batch(objects, lambda batch: model.objects.bulk_update(batch, sorted(fields)), errors)
+        return self.bulk_response(updated, 'updated', errors)
+
+    @action(detail=False, methods=['post'], url_path='bulk/disable', parser_classes=[JSONParser, NDJSONParser, MessagePackParser])
+    def bulk_disable(self, request):
+        disabled, errors = {}, []
+        for start, batch in self.iter_bulk_batches(request):
+            ids = []
+            for index, pk in enumerate(batch, start=start):
+                error = self.id_error(index, pk)
+                if error:
+                    errors.append(error)
+                else:
+                    ids.append(self.parse_id(pk))
+            if not ids:
+                continue
+            for label, count in self.get_queryset().filter(pk__in=ids).disable().items():
+                disabled[label] = disabled.get(label, 0) + count
+        return self.bulk_response(disabled, 'disabled', errors)
@@ -0,0 +1,155 @@
+"""
+Versioned cache of the rendered responses of the read-only viewsets.
+
+Every model has a version counter stored in the cache backend. A cached
+response is keyed by its route, its query string, its negotiated media type
+and the current versions of the models it is built from, so a write never has
+to find the entries it invalidates: bumping the version of its model is
+enough, and the stale entries simply expire.
+
+Versions are bumped by the ``post_save`` / ``post_delete`` signals and by
+``VersionedQuerySet``, whose ``update()`` and ``bulk_create()`` do not send
+signals (``disable()`` and ``bulk_update()`` go through them). Updates of the
+model's ``cache_ignored_fields`` only, like the ecoscores stored while a
+response renders, keep the version: the entry of that very response would
+be stale before it is stored. Inside a transaction the version is bumped
+again on commit, so that a response rendered from the old rows in the
+meantime is not served afterwards.
+
+With read replicas, responses rendered from a replica are only kept for the
+replication lag, and the clients pinned to the primary after a write bypass
+the cache, see ``shop.replicas``.
+
+The backend is the Django cache named by ``RESPONSE_CACHE['ALIAS']``: the
+default local memory cache is enough for a single process, deployments with
+several workers need a shared one (Redis, Memcached) so that they see each
+other's bumps.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models, transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from shop import replicas
+
+DEFAULTS = {
+    'ALIAS': 'default',
+    'TIMEOUT': 5 * 60,
+    'ENABLED': True,
+}
+
+VERSION_PREFIX = 'shop:version:'
+RESPONSE_PREFIX = 'shop:response:'
+CACHED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Vary')
+
+
+def get_setting(name):
+    return getattr(settings, 'RESPONSE_CACHE', {}).get(name, DEFAULTS[name])
+
+
+def get_cache():
+    return caches[get_setting('ALIAS')]
+
+
+def version_key(model):
+    return VERSION_PREFIX + model._meta.label
+
+
+def _incr(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted or never read, any fresh value is newer than the old ones
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def bump_version(model):
+    key = version_key(model)
+    _incr(key)
+    transaction.on_commit(lambda: _incr(key))
+
+
+def get_versions(models):
+    cache = get_cache()
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Starting from the clock keeps versions increasing across evictions
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_sender_version(sender, **kwargs):
+    bump_version(sender)
+
+
+class VersionedQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        if not set(kwargs) <= getattr(self.model, 'cache_ignored_fields', set()):
+            bump_version(self.model)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        bump_version(self.model)
+        return objs
+
+
+class ResponseCacheMixin:
+    # Per action, the models the representation is built from
+    cache_dependencies = {}
+
+    def get_cache_key(self, request):
+        if not get_setting('ENABLED') or request.accepted_renderer.format == 'api':
+            # The browsable API renders the user and a CSRF token
+            return None
+        if replicas.get_setting('ALIASES') and replicas.is_pinned(request):
+            # Must read its own writes, which an entry rendered from a replica may lack
+            return None
+        dependencies = self.cache_dependencies.get(self.action, (self.get_queryset().model,))
+        # The paginated bodies hold absolute links
+        key = repr((request.scheme, request.get_host(), self.basename, self.action, sorted(self.kwargs.items()),
+                    sorted(request.GET.lists()), request.accepted_media_type, get_versions(dependencies)))
+        return RESPONSE_PREFIX + hashlib.md5(key.encode()).hexdigest()
+
+    def cached_response(self, view, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        if key is None:
+            return view(request, *args, **kwargs)
+        cached = get_cache().get(key)
+        if cached is not None:
+            content, headers = cached
+            response = HttpResponse(content)
+            for header, value in headers.items():
+                response[header] = value
+            # Still answer conditional requests without touching the database
+            return get_conditional_response(request, etag=response.get('ETag'), response=response,
+                                            last_modified=parse_http_date_safe(response.get('Last-Modified')))
+
+        timeout = get_setting('TIMEOUT')
+        if replicas.current() is not None:
+            # The replica may predate the versions of the key
+            timeout = min(timeout, replicas.get_setting('MAX_LAG'))
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            def store(response):
+                headers = {header: response[header] for header in CACHED_HEADERS if header in response}
+                get_cache().set(key, (response.content, headers), timeout)
+            response.add_post_render_callback(store)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,140 @@
+"""
+Negotiated compression of the API responses.
+
+``shop.middleware.CompressionMiddleware`` compresses the responses of the
+routes under ``PATHS`` with the best coding of the client's
+``Accept-Encoding``: brotli when the brotli package is installed, gzip
+otherwise. Bodies under ``MIN_SIZE`` bytes are sent as they are, as are the
+ones compression would not make smaller. Streaming responses (the exports)
+are compressed chunk by chunk and flushed after each one, so that the
+client still receives them as they are produced; ``STREAMING`` turns that
+off.
+
+Every setting can be overridden through the ``COMPRESSION`` dict in the
+project settings.
+"""
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULTS = {
+    'ENABLED': True,
+    'PATHS': ['/api/'],
+    # Smaller bodies cost more to compress than they save on the wire
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+    'STREAMING': True,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'COMPRESSION', {}).get(name, DEFAULTS[name])
+
+
+def codings():
+    """The supported codings, preferred first."""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate(accept_encoding):
+    """The coding to answer ``Accept-Encoding: accept_encoding`` with, ``None`` for the identity."""
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0
+        weights[coding.strip().lower()] = weight
+    best, best_weight = None, 0
+    for coding in codings():
+        weight = weights.get(coding, weights.get('*', 0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+class Compressor:
+
+    def __init__(self, coding):
+        self.coding = coding
+        if coding == 'br':
+            self.compressor = brotli.Compressor(quality=get_setting('BROTLI_QUALITY'))
+        else:
+            # gzip container
+            self.compressor = zlib.compressobj(get_setting('GZIP_LEVEL'), zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        if self.coding == 'br':
+            return self.compressor.process(data)
+        return self.compressor.compress(data)
+
+    def flush(self):
+        """The compressed bytes of everything given so far, the stream staying open."""
+        if self.coding == 'br':
+            return self.compressor.flush()
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.coding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+def compress(data, coding):
+    compressor = Compressor(coding)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks, coding):
+    compressor = Compressor(coding)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress_response(request, response):
+    if not get_setting('ENABLED') or not request.path.startswith(tuple(get_setting('PATHS'))):
+        return response
+    if response.has_header('Content-Encoding') or response.status_code in (204, 304):
+        return response
+    if response.streaming:
+        if not get_setting('STREAMING'):
+            return response
+    elif len(response.content) < get_setting('MIN_SIZE'):
+        return response
+
+    patch_vary_headers(response, ['Accept-Encoding'])
+    coding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if coding is None:
+        return response
+    if response.streaming:
+        response.streaming_content = compress_stream(response.streaming_content, coding)
+        # Unknown until streamed
+        if response.has_header('Content-Length'):
+            del response['Content-Length']
+    else:
+        content = compress(response.content, coding)
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response['Content-Length'] = str(len(content))
+    # The compressed body is another representation: a strong ETag becomes weak
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = f'W/{etag}'
+    response['Content-Encoding'] = coding
+    return response
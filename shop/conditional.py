@@ -0,0 +1,80 @@
+"""
+Conditional GET for the read-only viewsets.
+
+The validators of a response are computed with a single aggregate query over
+the filtered queryset: ``MAX(date_updated)`` of the rows and of every nested
+relation the representation includes, and the number of rows of each, so that
+deletions are detected too. A client presenting a matching ``If-None-Match``
+or ``If-Modified-Since`` gets a ``304 Not Modified`` before anything is
+fetched or serialized.
+
+Lists have no ``Last-Modified``: the rows disabled out of a list, or deleted,
+do not move the ``MAX(date_updated)`` of those left, only the count of their
+ETag tells. Keyset pages (``?pagination=cursor``) get no validators at all:
+they exist to skip the scan of the whole filtered queryset.
+"""
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    # Per action, the timestamps and the relations whose rows are part of the representation
+    last_modified_fields = {}
+    count_fields = {}
+
+    def get_validators(self, queryset):
+        """Return ``(etag, last modified timestamp)`` for ``queryset``, or ``None`` when it is empty."""
+        aggregates = {'count': Count('pk')}
+        for index, field in enumerate(self.last_modified_fields.get(self.action, ('date_updated',))):
+            aggregates[f'max_{index}'] = Max(field)
+        for index, field in enumerate(self.count_fields.get(self.action, ())):
+            aggregates[f'count_{index}'] = Count(field, distinct=True)
+        values = queryset.order_by().aggregate(**aggregates)
+        # Spares the paginator its own COUNT(*)
+        self.conditional_count = values['count']
+        timestamps = [value for key, value in values.items() if key.startswith('max_') and value is not None]
+        if not values['count'] or not timestamps:
+            return None
+
+        # The same rows give a different representation for another page, filter or format
+        key = repr((self.action, self.request.get_full_path(), self.request.accepted_media_type, sorted(values.items())))
+        etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+        return etag, int(max(timestamps).timestamp())
+
+    def conditional_response(self, queryset, view, request, *args, **kwargs):
+        validators = self.get_validators(queryset)
+        if validators is None:
+            return view(request, *args, **kwargs)
+
+        etag, last_modified = validators
+        if self.action == 'list':
+            last_modified = None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = view(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ['Accept'])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        use_cursor = getattr(self.paginator, 'use_cursor', None)
+        if use_cursor is not None and use_cursor(request):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.conditional_response(queryset, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        except (TypeError, ValueError, ValidationError):
+            # Malformed lookup, let the view answer with its usual 404
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional_response(queryset, super().retrieve, request, *args, **kwargs)
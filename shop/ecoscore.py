@@ -0,0 +1,285 @@
+"""
+Cached access to the OpenFoodFacts ecoscore of products.
+
+A lookup goes through an in-process LRU first, then through the
+``ecoscore_grade`` / ``ecoscore_fetched_at`` columns stored on the product,
+and only calls the upstream API when both are missing or expired. Values that
+expired less than ``STALE_TTL`` seconds ago are still served while a refresh
+runs in the background, and non-200 answers are cached as ``None`` for
+``NEGATIVE_TTL`` seconds.
+
+List pages call ``resolve_many`` beforehand so that every cache miss of the
+page is fetched concurrently, within ``BATCH_DEADLINE`` seconds overall.
+The async views call ``aresolve_many`` instead, which fetches the misses on
+the event loop and hands the grades over to the serializers through the
+``preresolved`` context variable.
+
+Every setting can be overridden through the ``ECOSCORE`` dict in the project
+settings.
+"""
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextvars import ContextVar
+from datetime import timedelta
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+DEFAULTS = {
+    'URL': 'https://world.openfoodfacts.org/api/v0/product/3229820787015.json',
+    'TTL': 24 * 60 * 60,
+    'NEGATIVE_TTL': 5 * 60,
+    'STALE_TTL': 60 * 60,
+    'LRU_SIZE': 4096,
+    'BACKGROUND_REFRESH': True,
+    'BATCH_WORKERS': 8,
+    'BATCH_DEADLINE': 2,
+}
+
+# Attribute set on products by resolve_many(), read back by get_ecoscore()
+RESOLVED_ATTR = '_resolved_ecoscore'
+
+# {product pk: grade} resolved by aresolve_many() for the current request
+preresolved = ContextVar('ecoscore_preresolved', default=None)
+
+
+def get_setting(name):
+    return getattr(settings, 'ECOSCORE', {}).get(name, DEFAULTS[name])
+
+
+class LRUCache:
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return None
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > get_setting('LRU_SIZE'):
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+lru = LRUCache()
+
+_refresh_executor = None
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def expires_at(grade, fetched_at):
+    ttl = get_setting('TTL') if grade is not None else get_setting('NEGATIVE_TTL')
+    return fetched_at + timedelta(seconds=ttl)
+
+
+def cached_entry(product):
+    """Return the most recent known ``(grade, fetched_at)`` pair, or ``None``."""
+    entry = lru.get(product.pk)
+    if product.ecoscore_fetched_at is not None:
+        if entry is None or entry[1] < product.ecoscore_fetched_at:
+            entry = (product.ecoscore_grade, product.ecoscore_fetched_at)
+    return entry
+
+
+def parse(response):
+    if response.status_code == 200:
+        return response.json()['product']['ecoscore_grade']
+    return None
+
+
+def fetch(product):
+    return parse(product.call_external_api('GET', get_setting('URL')))
+
+
+async def afetch(product):
+    return parse(await product.acall_external_api('GET', get_setting('URL')))
+
+
+def store_many(grades):
+    """Save ``{product: grade}`` with one UPDATE per distinct grade."""
+    fetched_at = timezone.now()
+    by_grade = {}
+    for product, grade in grades.items():
+        by_grade.setdefault(grade, []).append(product)
+    for grade, products in by_grade.items():
+        # update() keeps date_updated untouched: the ecoscore is not an edit of the product
+        manager = type(products[0])._default_manager
+        manager.filter(pk__in=[product.pk for product in products]).update(ecoscore_grade=grade,
+                                                                            ecoscore_fetched_at=fetched_at)
+        for product in products:
+            product.ecoscore_grade = grade
+            product.ecoscore_fetched_at = fetched_at
+            lru.set(product.pk, (grade, fetched_at))
+
+
+def store(product, grade):
+    store_many({product: grade})
+
+
+def refresh(product):
+    try:
+        grade = fetch(product)
+    except requests.RequestException:
+        # Upstream unreachable: keep serving what we know, but do not cache the failure
+        entry = cached_entry(product)
+        return entry[0] if entry else None
+    store(product, grade)
+    return grade
+
+
+def _background_refresh(product):
+    try:
+        refresh(product)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(product.pk)
+        connections.close_all()
+
+
+def schedule_refresh(product):
+    global _refresh_executor
+    if not get_setting('BACKGROUND_REFRESH'):
+        refresh(product)
+        return
+    with _refreshing_lock:
+        if product.pk in _refreshing:
+            return
+        _refreshing.add(product.pk)
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='ecoscore')
+    _refresh_executor.submit(_background_refresh, product)
+
+
+def cached_grade(product):
+    """
+    Return ``(True, grade)`` when the cache can answer, ``(False, None)`` otherwise.
+    A stale answer schedules a refresh of the product.
+    """
+    entry = cached_entry(product)
+    if entry is not None:
+        grade, fetched_at = entry
+        now = timezone.now()
+        expiry = expires_at(grade, fetched_at)
+        if now < expiry:
+            return True, grade
+        if now < expiry + timedelta(seconds=get_setting('STALE_TTL')):
+            schedule_refresh(product)
+            return True, grade
+    return False, None
+
+
+def get_ecoscore(product):
+    if RESOLVED_ATTR in product.__dict__:
+        return product.__dict__[RESOLVED_ATTR]
+    known = preresolved.get()
+    if known is not None and product.pk in known:
+        return known[product.pk]
+    found, grade = cached_grade(product)
+    if found:
+        return grade
+    return refresh(product)
+
+
+def cache_misses(products):
+    """Resolve the products the caches can answer, return the others."""
+    known = preresolved.get() or {}
+    missing = []
+    for product in products:
+        if RESOLVED_ATTR in product.__dict__:
+            continue
+        if product.pk in known:
+            setattr(product, RESOLVED_ATTR, known[product.pk])
+            continue
+        found, grade = cached_grade(product)
+        if found:
+            setattr(product, RESOLVED_ATTR, grade)
+        else:
+            missing.append(product)
+    return missing
+
+
+def fallback_grade(product):
+    # Failed or late: fall back on whatever the cache still knows
+    entry = cached_entry(product)
+    return entry[0] if entry else None
+
+
+def resolve_many(products):
+    """
+    Resolve the ecoscore of all ``products`` at once.
+
+    Cache misses are fetched concurrently through ``Product.call_external_api``;
+    a product whose fetch fails or does not finish before ``BATCH_DEADLINE``
+    resolves to ``None`` instead of failing the caller. Only the network calls
+    run in worker threads, results are saved from the calling thread.
+    """
+    missing = cache_misses(products)
+    if not missing:
+        return
+
+    # One executor per batch, so that calls still running past the deadline
+    # (bounded by the upstream timeouts) never delay the next page
+    executor = ThreadPoolExecutor(max_workers=min(len(missing), get_setting('BATCH_WORKERS')),
+                                  thread_name_prefix='ecoscore-batch')
+    futures = {executor.submit(fetch, product): product for product in missing}
+    done, _ = wait(futures, timeout=get_setting('BATCH_DEADLINE'))
+    executor.shutdown(wait=False)
+
+    fetched = {}
+    for future, product in futures.items():
+        if future in done and future.exception() is None:
+            grade = fetched[product] = future.result()
+        else:
+            grade = fallback_grade(product)
+        setattr(product, RESOLVED_ATTR, grade)
+    if fetched:
+        store_many(fetched)
+
+
+async def aresolve_many(products):
+    """
+    Async variant of ``resolve_many``: the cache misses are fetched through
+    ``Product.acall_external_api`` on the running event loop, so that no
+    thread waits on the network. Return ``{product pk: grade}``.
+    """
+    # The caches may read or refresh through the ORM
+    missing = await sync_to_async(cache_misses)(products)
+    grades = {product.pk: product.__dict__[RESOLVED_ATTR] for product in products
+              if RESOLVED_ATTR in product.__dict__}
+    if not missing:
+        return grades
+
+    tasks = {asyncio.ensure_future(afetch(product)): product for product in missing}
+    done, pending = await asyncio.wait(tasks, timeout=get_setting('BATCH_DEADLINE'))
+    for task in pending:
+        task.cancel()
+
+    fetched = {}
+    for task, product in tasks.items():
+        if task in done and task.exception() is None:
+            grade = fetched[product] = task.result()
+        else:
+            grade = fallback_grade(product)
+        setattr(product, RESOLVED_ATTR, grade)
+        grades[product.pk] = grade
+    if fetched:
+        await sync_to_async(store_many)(fetched)
+    return grades
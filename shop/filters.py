@@ -0,0 +1,65 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import OuterRef, Subquery
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from shop.models import Article
+from shop.search import search
+
+
+class PriceRangeFilter(BaseFilterBackend):
+    """Keep the rows whose ``price`` lies between the ``min_price`` and ``max_price`` query parameters."""
+    bounds = (('min_price', 'gte'), ('max_price', 'lte'))
+
+    def get_bounds(self, request):
+        bounds = {}
+        for param, lookup in self.bounds:
+            value = request.query_params.get(param)
+            if value in (None, ''):
+                continue
+            try:
+                bounds[f'price__{lookup}'] = Decimal(value)
+            except InvalidOperation:
+                raise ValidationError({param: ['A valid number is required.']})
+        return bounds
+
+    def filter_queryset(self, request, queryset, view):
+        bounds = self.get_bounds(request)
+        return queryset.filter(**bounds) if bounds else queryset
+
+
+class LowestPriceFilter(PriceRangeFilter):
+    """
+    Price range on products, whose ``price`` is the lowest price of their
+    active articles. It is only annotated when filtered or sorted on.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        bounds = self.get_bounds(request)
+        ordering = request.query_params.get(OrderingFilter.ordering_param, '')
+        if not bounds and 'price' not in ordering:
+            return queryset
+        articles = Article.objects.filter(product=OuterRef('pk'), active=True).order_by('price')
+        queryset = queryset.annotate(price=Subquery(articles.values('price')[:1]))
+        return queryset.filter(**bounds) if bounds else queryset
+
+
+class TextSearchFilter(BaseFilterBackend):
+    """Full-text search on the words of the ``search`` query parameter, see ``shop.search``."""
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '').strip()
+        return search(queryset, text) if text else queryset
+
+
+class ShopOrderingFilter(OrderingFilter):
+    """``?ordering=`` on the view's ``ordering_fields``, ties broken by primary key for a stable pagination."""
+
+    def get_ordering(self, request, queryset, view):
+        # Also read by the cursor pagination, which sorts the page again
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering and not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering = [*ordering, 'id']
+        return ordering
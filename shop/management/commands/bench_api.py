@@ -0,0 +1,164 @@
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+from unittest import mock
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from shop.bench import Scenario, compare, measure, scratch_database
+from shop.mock import mock_openfoodfact_success, mock_openfoodfact_success_async
+from shop.models import Category, Product, Article
+from shop.seeding import CatalogSeeder
+
+
+def cycle(values):
+    return lambda index: values[index % len(values)]
+
+
+def scenarios(categories, products, articles):
+    """The routes of project/urls.py, reads first: writes change the catalog the next scenarios read."""
+    category, product, article = cycle(categories), cycle(products), cycle(articles)
+
+    def detail(name, pick):
+        return lambda index: reverse(name, args=[pick(index)])
+
+    def article_row(index):
+        return {'name': f'Bench {index}', 'price': '2.50', 'product': product(index), 'active': True}
+
+    return [
+        Scenario('category-list', 'get', reverse('category-list')),
+        Scenario('category-detail', 'get', detail('category-detail', category)),
+        Scenario('category-summary', 'get', reverse('category-summary')),
+        Scenario('product-list', 'get', reverse('product-list')),
+        Scenario('product-list-price', 'get', reverse('product-list'), {'min_price': '20', 'ordering': 'price'}),
+        Scenario('product-search', 'get', reverse('product-list'), {'search': 'product 1'}),
+        Scenario('product-detail', 'get', detail('product-detail', product)),
+        Scenario('product-summary', 'get', reverse('product-summary')),
+        Scenario('article-list', 'get', lambda index: f"{reverse('article-list')}?offset={index * 6 % 1000}"),
+        Scenario('article-list-cursor', 'get', reverse('article-list'), {'pagination': 'cursor', 'limit': 100}),
+        Scenario('article-list-price', 'get', reverse('article-list'), {'min_price': '10', 'max_price': '20'}),
+        Scenario('article-search', 'get', reverse('article-list'), {'search': 'lot'}),
+        Scenario('article-detail', 'get', detail('article-detail', article)),
+        Scenario('article-export', 'get', reverse('article-export'), {'format': 'csv'}),
+        Scenario('async-product-list', 'get', reverse('async-product-list')),
+        Scenario('async-article-list', 'get', reverse('async-article-list')),
+        Scenario('admin-category-detail', 'get', detail('admin-category-detail', category), admin=True),
+        Scenario('admin-stats', 'get', reverse('admin-stats-list'), admin=True),
+        Scenario('admin-article-create', 'post', reverse('admin-article-list'), article_row, admin=True),
+        Scenario('admin-article-update', 'patch', detail('admin-article-detail', article),
+                 lambda index: {'price': f'{1 + index % 98}.50'}, admin=True),
+        Scenario('admin-article-bulk', 'post', reverse('admin-article-bulk'),
+                 lambda index: [article_row(index * 100 + row) for row in range(100)], admin=True),
+        Scenario('admin-category-bulk', 'post', reverse('admin-category-bulk'),
+                 lambda index: [{'name': f'Bench {index}-{row}', 'description': f'Bench {index}-{row}'}
+                                for row in range(100)], admin=True),
+        # The ids cycle: each row is enabled again before it is disabled
+        Scenario('product-disable', 'post', detail('product-disable', product),
+                 setup=lambda index: Product.objects.filter(pk=product(index)).update(active=True)),
+        Scenario('category-disable', 'post', detail('category-disable', category),
+                 setup=lambda index: Category.objects.filter(pk=category(index)).update(active=True)),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+
+    help = ('Measure the throughput, latency percentiles, query count and peak memory of every route '
+            'against a seeded catalog')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products-per', type=int, default=20)
+        parser.add_argument('--articles-per', type=int, default=10)
+        parser.add_argument('--requests', type=int, default=50, help='Requests per route')
+        parser.add_argument('--only', default='', help='Comma separated prefixes of the routes to run')
+        parser.add_argument('--cache', action='store_true', help='Keep the response cache enabled')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='JSON file of a previous run to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='p95 slowdown counted as a regression, as a ratio')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        only = [prefix for prefix in options['only'].split(',') if prefix]
+
+        settings = {'ALLOWED_HOSTS': ['testserver'], 'ECOSCORE': {'BACKGROUND_REFRESH': False}}
+        if not options['cache']:
+            settings['RESPONSE_CACHE'] = {'ENABLED': False}
+
+        # The ecoscore upstream is mocked like in the tests
+        with scratch_database(), override_settings(**settings), \
+                mock.patch('shop.models.Product.call_external_api', mock_openfoodfact_success), \
+                mock.patch('shop.models.Product.acall_external_api', mock_openfoodfact_success_async):
+            seeder = CatalogSeeder(options['categories'], options['products_per'], options['articles_per'], seed=0)
+            rows, seconds = seeder.run()
+            self.stdout.write(f'Seeded {rows} rows in {seconds:.1f}s')
+
+            anonymous, admin = APIClient(), APIClient()
+            admin.force_authenticate(get_user_model().objects.create_superuser('bench', 'bench@oc.drf', 'bench'))
+            ids = [list(model.objects.filter(active=True).order_by('id').values_list('id', flat=True)[:1000])
+                   for model in (Category, Product, Article)]
+
+            results = {}
+            self.stdout.write(f"{'route':>22} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                              f"{'queries':>8} {'peak KiB':>9}")
+            for scenario in scenarios(*ids):
+                if only and not any(scenario.name.startswith(prefix) for prefix in only):
+                    continue
+                try:
+                    result = measure(admin if scenario.admin else anonymous, scenario, options['requests'])
+                except ValueError as exc:
+                    raise CommandError(str(exc))
+                results[scenario.name] = result
+                latency = result['latency_ms']
+                self.stdout.write(f"{scenario.name:>22} {result['throughput']:>8.1f} {latency['p50']:>8.2f} "
+                                  f"{latency['p95']:>8.2f} {latency['p99']:>8.2f} {result['queries']:>8} "
+                                  f"{result['peak_memory_kib']:>9.0f}")
+
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'date': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'rows': rows,
+                **{option: options[option] for option in ('categories', 'products_per', 'articles_per',
+                                                          'requests', 'cache')},
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options['compare']:
+            self.compare(options['compare'], results, options['threshold'], options['fail_on_regression'])
+        self.stdout.write(self.style.SUCCESS("All Done !"))
+
+    def compare(self, path, results, threshold, fail):
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)
+        self.stdout.write(f"Compared with {baseline['meta'].get('commit') or path}")
+        self.stdout.write(f"{'route':>22} {'p95':>8} {'req/s':>8} {'queries':>8}")
+        regressions = []
+        for name, (p95, throughput, queries, regressed) in compare(baseline['results'], results, threshold).items():
+            line = f'{name:>22} {p95:>+8.0%} {throughput:>+8.0%} {queries:>+8}'
+            self.stdout.write(self.style.ERROR(line) if regressed else line)
+            if regressed:
+                regressions.append(name)
+        if regressions and fail:
+            raise CommandError(f"Regressions: {', '.join(regressions)}")
@@ -0,0 +1,60 @@
+import time
+from contextlib import nullcontext
+from itertools import product
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIRequestFactory
+from rest_framework.viewsets import ReadOnlyModelViewSet
+
+from shop.bench import scratch_database
+from shop.rows import RowListMixin
+from shop.seeding import CatalogSeeder
+from shop.views import ArticleViewSet
+
+
+class Command(BaseCommand):
+
+    help = ('Compare the article list throughput with joined and with denormalized product and category names, '
+            'rendered through the serializers or from rows')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=100)
+        parser.add_argument('--products-per', type=int, default=100)
+        parser.add_argument('--articles-per', type=int, default=10)
+        parser.add_argument('--limit', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        view = ArticleViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+
+        with scratch_database():
+            rows, seconds = CatalogSeeder(options['categories'], options['products_per'],
+                                          options['articles_per']).run()
+            self.stdout.write(f'Seeded {rows} rows in {seconds:.1f}s')
+            self.stdout.write(f"{'mode':>13} {'path':>10} {'req/s':>8} {'ms/req':>8} {'queries':>8} {'joins':>6}")
+
+            for (mode, denormalized), path in product((('joined', False), ('denormalized', True)),
+                                                      ('serializer', 'rows')):
+                serializers = mock.patch.object(RowListMixin, 'list', ReadOnlyModelViewSet.list)
+                # The response cache would answer every request but the first
+                with override_settings(DENORMALIZED_ARTICLES=denormalized, RESPONSE_CACHE={'ENABLED': False},
+                                       ALLOWED_HOSTS=['testserver']), \
+                        (serializers if path == 'serializer' else nullcontext()):
+                    with CaptureQueriesContext(connection) as queries:
+                        view(factory.get('/api/article/', {'limit': options['limit']})).render()
+                    joins = sum(query['sql'].count(' JOIN ') for query in queries)
+
+                    start = time.perf_counter()
+                    for index in range(options['requests']):
+                        offset = index * options['limit'] % (rows // 2)
+                        view(factory.get('/api/article/', {'limit': options['limit'], 'offset': offset})).render()
+                    elapsed = time.perf_counter() - start
+                self.stdout.write(f"{mode:>13} {path:>10} {options['requests'] / elapsed:>8.1f} "
+                                  f"{1000 * elapsed / options['requests']:>8.2f} {len(queries):>8} {joins:>6}")
+
+        self.stdout.write(self.style.SUCCESS("All Done !"))
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from shop.bench import FakeUpstream, scratch_database
+from shop.models import Category, Product
+
+
+class Command(BaseCommand):
+
+    help = 'Compare WSGI and ASGI product list throughput at fixed concurrency against a slow fake upstream'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=0.1, help='Upstream latency in seconds')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--products', type=int, default=600)
+
+    def urls(self, prefix, count):
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        pages = max(1, self.products // page_size)
+        return [f'{prefix}?offset={index % pages * page_size}' for index in range(count)]
+
+    def run_wsgi(self, urls, concurrency):
+        def get(url):
+            start = time.perf_counter()
+            try:
+                Client().get(url)
+                return time.perf_counter() - start
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(get, urls))
+
+    def run_asgi(self, urls, concurrency):
+        async def main():
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def get(url):
+                async with semaphore:
+                    start = time.perf_counter()
+                    await client.get(url)
+                    return time.perf_counter() - start
+            return await asyncio.gather(*(get(url) for url in urls))
+        return asyncio.run(main())
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        self.products = options['products']
+
+        with tempfile.TemporaryDirectory() as directory, FakeUpstream(options['latency']) as upstream, \
+                scratch_database(name=os.path.join(directory, 'bench.sqlite3')):
+            category = Category.objects.create(name='Bench', active=True)
+            Product.objects.bulk_create(Product(name=f'Product {index}', active=True, category=category)
+                                        for index in range(self.products))
+            connections.close_all()
+            # Every page misses the ecoscore cache and calls the upstream
+            ecoscore_settings = {'URL': upstream.url, 'TTL': 0, 'NEGATIVE_TTL': 0, 'STALE_TTL': 0,
+                                 'BACKGROUND_REFRESH': False}
+            with override_settings(ECOSCORE=ecoscore_settings, RESPONSE_CACHE={'ENABLED': False},
+                                   ALLOWED_HOSTS=['testserver']):
+                self.stdout.write(f"{'server':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'upstream':>9}")
+                for server, prefix, run in (('wsgi', '/api/product/', self.run_wsgi),
+                                            ('asgi', '/api/async/product/', self.run_asgi)):
+                    calls = upstream.calls
+                    start = time.perf_counter()
+                    latencies = sorted(run(self.urls(prefix, options['requests']), options['concurrency']))
+                    elapsed = time.perf_counter() - start
+                    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+                    self.stdout.write(f"{server:>6} {len(latencies) / elapsed:>8.1f} "
+                                      f"{1000 * statistics.median(latencies):>8.1f} {1000 * p99:>8.1f} "
+                                      f"{upstream.calls - calls:>9}")
+
+        self.stdout.write(self.style.SUCCESS("All Done !"))
@@ -0,0 +1,134 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from shop.bench import percentile, scratch_database
+from shop.mock import mock_openfoodfact_success
+from shop.models import Article, Product
+from shop.seeding import CatalogSeeder
+
+# Django defaults: rollback journal, deferred transactions, SQLite's own cache and no memory map
+PROFILES = {
+    'default': ({'journal_mode': 'delete', 'synchronous': 'full', 'cache_size': None, 'mmap_size': None,
+                 'busy_timeout': None}, None),
+    'production': ({}, 'IMMEDIATE'),
+}
+
+READS = ('category-list', 'product-list', 'article-list')
+
+
+def reader(deadline, results):
+    # Forked with the random state of the parent
+    random.seed()
+    client = APIClient()
+    latencies, locked = [], 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            client.get(reverse(random.choice(READS)))
+        except OperationalError:
+            locked += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    results.put(('read', latencies, locked))
+
+
+def writer(deadline, products, results):
+    random.seed()
+    latencies, locked = [], 0
+    for index in range(1_000_000):
+        if time.monotonic() >= deadline:
+            break
+        pk = random.choice(products)
+        start = time.perf_counter()
+        try:
+            # An import batch, then the read-then-write rename and the cascade of disable()
+            with transaction.atomic():
+                Article.objects.bulk_create(
+                    Article(name=f'Contention {os.getpid()}-{index}-{row}', price=Decimal('2.50'),
+                            product_id=pk, active=True)
+                    for row in range(20))
+            Product.objects.filter(pk=pk).update(name=f'Contention {os.getpid()}-{index}')
+            Product.objects.filter(pk=pk).disable()
+            Product.objects.filter(pk=pk).update(active=True)
+        except OperationalError:
+            locked += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    results.put(('write', latencies, locked))
+
+
+class Command(BaseCommand):
+
+    help = ('Measure concurrent reads and writes of worker processes on a SQLite file, '
+            'with the default and the production profile')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--products-per', type=int, default=20)
+        parser.add_argument('--articles-per', type=int, default=10)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--duration', type=float, default=5, help='Seconds per profile')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        if connection.vendor != 'sqlite':
+            raise CommandError('The default database is not SQLite')
+        # Workers inherit the seeded database, the settings and the mocks
+        context = multiprocessing.get_context('fork')
+
+        self.stdout.write(f"{'profile':>10} {'reads/s':>8} {'read p95 ms':>12} {'writes/s':>9} "
+                          f"{'write p95 ms':>13} {'locked':>7}")
+        settings = {'ALLOWED_HOSTS': ['testserver'], 'RESPONSE_CACHE': {'ENABLED': False},
+                    'ECOSCORE': {'BACKGROUND_REFRESH': False}}
+        old_options = connection.settings_dict['OPTIONS']
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch('shop.models.Product.call_external_api', mock_openfoodfact_success):
+            for profile, (pragmas, transaction_mode) in PROFILES.items():
+                connection.settings_dict['OPTIONS'] = {**old_options, 'transaction_mode': transaction_mode}
+                try:
+                    with override_settings(SQLITE_PRAGMAS=pragmas, **settings), \
+                            scratch_database(name=os.path.join(directory, f'{profile}.sqlite3')):
+                        CatalogSeeder(options['categories'], options['products_per'], options['articles_per'],
+                                      seed=0).run()
+                        products = list(Product.objects.values_list('pk', flat=True))
+                        self.run_profile(context, profile, products, options)
+                finally:
+                    connection.settings_dict['OPTIONS'] = old_options
+
+        self.stdout.write(self.style.SUCCESS("All Done !"))
+
+    def run_profile(self, context, profile, products, options):
+        # A connection must not cross a fork
+        connections.close_all()
+        results = context.Queue()
+        deadline = time.monotonic() + options['duration']
+        workers = [context.Process(target=reader, args=(deadline, results)) for _ in range(options['readers'])]
+        workers += [context.Process(target=writer, args=(deadline, products, results))
+                    for _ in range(options['writers'])]
+        for worker in workers:
+            worker.start()
+        latencies, locked = {'read': [], 'write': []}, 0
+        for _ in workers:
+            role, worker_latencies, worker_locked = results.get()
+            latencies[role] += worker_latencies
+            locked += worker_locked
+        for worker in workers:
+            worker.join()
+
+        reads, writes = sorted(latencies['read']), sorted(latencies['write'])
+        read_p95 = 1000 * percentile(reads, 0.95) if reads else float('nan')
+        write_p95 = 1000 * percentile(writes, 0.95) if writes else float('nan')
+        self.stdout.write(f"{profile:>10} {len(reads) / options['duration']:>8.1f} {read_p95:>12.2f} "
+                          f"{len(writes) / options['duration']:>9.1f} {write_p95:>13.2f} {locked:>7}")
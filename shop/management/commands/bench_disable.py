@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from shop.bench import scratch_database
+from shop.models import Category
+from shop.seeding import CatalogSeeder, truncate_catalog
+
+
+def naive_disable(category):
+    # What the commented-out cascade in Category.disable would have done
+    with transaction.atomic():
+        category.active = False
+        category.save()
+        category.products.update(active=False)
+        for product in category.products.all():
+            product.articles.update(active=False)
+
+
+class Command(BaseCommand):
+
+    help = 'Measure Category.disable as the number of products per category grows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products-per', type=int, nargs='+', default=[10, 100, 1000, 10000])
+        parser.add_argument('--articles-per', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        self.stdout.write(f"{'products':>9} {'articles':>9} {'mode':>8} {'queries':>8} {'ms':>9}")
+
+        with scratch_database():
+            for products_per in options['products_per']:
+                for mode in ('naive', 'set'):
+                    truncate_catalog()
+                    CatalogSeeder(1, products_per, options['articles_per'], active_ratio=1).run()
+                    category = Category.objects.get()
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.perf_counter()
+                        if mode == 'naive':
+                            naive_disable(category)
+                        else:
+                            category.disable()
+                        elapsed = 1000 * (time.perf_counter() - start)
+                    self.stdout.write(f"{products_per:>9} {products_per * options['articles_per']:>9} {mode:>8} "
+                                      f"{len(queries):>8} {elapsed:>9.2f}")
+
+        self.stdout.write(self.style.SUCCESS("All Done !"))
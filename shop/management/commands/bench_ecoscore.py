@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from shop import ecoscore
+from shop.bench import FakeUpstream, scratch_database
+from shop.models import Category, Product
+from shop.serializers import ProductListSerializer
+
+
+class Command(BaseCommand):
+
+    help = 'Compare serial and batched ecoscore resolution of product list pages against a slow fake upstream'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=0.1, help='Upstream latency in seconds')
+        parser.add_argument('--page-size', type=int, default=settings.REST_FRAMEWORK['PAGE_SIZE'])
+        parser.add_argument('--pages', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        page_size = options['page_size']
+
+        with scratch_database(), FakeUpstream(options['latency']) as upstream:
+            category = Category.objects.create(name='Bench', active=True)
+            Product.objects.bulk_create(
+                Product(name=f'Product {index}', active=True, category=category)
+                for index in range(page_size * options['pages'])
+            )
+            ecoscore_settings = {**getattr(settings, 'ECOSCORE', {}), 'URL': upstream.url,
+                                 'BACKGROUND_REFRESH': False}
+
+            with override_settings(ECOSCORE=ecoscore_settings):
+                for mode in ('serial', 'batched', 'cached'):
+                    if mode != 'cached':
+                        ecoscore.lru.clear()
+                        Product.objects.update(ecoscore_grade=None, ecoscore_fetched_at=None)
+                    calls = upstream.calls
+                    latencies = []
+                    for page in range(options['pages']):
+                        products = list(Product.objects.order_by('id')[page * page_size:(page + 1) * page_size])
+                        start = time.perf_counter()
+                        if mode == 'serial':
+                            [ProductListSerializer(product).data for product in products]
+                        else:
+                            ProductListSerializer(products, many=True).data
+                        latencies.append(time.perf_counter() - start)
+                    self.stdout.write(
+                        f'{mode:>8}: {1000 * sum(latencies) / len(latencies):8.1f} ms/page, '
+                        f'{upstream.calls - calls} upstream calls'
+                    )
+
+        self.stdout.write(self.style.SUCCESS("All Done !"))
@@ -0,0 +1,86 @@
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from shop.bench import Scenario, measure, scratch_database
+from shop.mock import mock_openfoodfact_success
+from shop.models import Category, Product, Article
+from shop.seeding import CatalogSeeder
+
+# (route, parameters of each variant, the first one rendering everything)
+VARIANTS = [
+    ('category-detail', [
+        {},
+        {'fields': 'id,name,products.id,products.name,products.articles.id,products.articles.name,'
+                   'products.articles.price'},
+        {'expand': 'products'},
+        {'depth': 0},
+    ]),
+    ('product-detail', [
+        {},
+        {'fields': 'id,name,articles.id,articles.name,articles.price'},
+        {'depth': 0},
+    ]),
+    ('product-list', [
+        {'limit': 100},
+        {'limit': 100, 'fields': 'id,name'},
+    ]),
+    ('article-list', [
+        {'limit': 100},
+        {'limit': 100, 'fields': 'id,name,price'},
+    ]),
+    ('article-detail', [
+        {},
+        {'fields': 'id,name,price'},
+    ]),
+]
+
+
+class Command(BaseCommand):
+
+    help = 'Measure the payload size, latency and queries of the sparse fieldsets against the full representations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--products-per', type=int, default=20)
+        parser.add_argument('--articles-per', type=int, default=10)
+        parser.add_argument('--requests', type=int, default=50, help='Requests per variant')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+
+        settings = {'ALLOWED_HOSTS': ['testserver'], 'RESPONSE_CACHE': {'ENABLED': False},
+                    'ECOSCORE': {'BACKGROUND_REFRESH': False}}
+        with scratch_database(), override_settings(**settings), \
+                mock.patch('shop.models.Product.call_external_api', mock_openfoodfact_success):
+            CatalogSeeder(options['categories'], options['products_per'], options['articles_per'], seed=0,
+                          active_ratio=1).run()
+            ids = {name: model.objects.order_by('id').values_list('id', flat=True).first()
+                   for name, model in (('category', Category), ('product', Product), ('article', Article))}
+            client = APIClient()
+
+            self.stdout.write(f"{'route':>16} {'parameters':<40} {'bytes':>8} {'saved':>7} {'p50 ms':>8} "
+                              f"{'p95 ms':>8} {'queries':>8}")
+            for route, variants in VARIANTS:
+                model, _, kind = route.partition('-')
+                path = reverse(route, args=[ids[model]]) if kind == 'detail' else reverse(route)
+                full_size = None
+                for params in variants:
+                    scenario = Scenario(route, 'get', path, params)
+                    size = len(scenario.call(client, 0).content)
+                    full_size = full_size or size
+                    try:
+                        result = measure(client, scenario, options['requests'])
+                    except ValueError as exc:
+                        raise CommandError(str(exc))
+                    label = '&'.join(f'{key}={value}' for key, value in params.items() if key != 'limit') or 'full'
+                    if len(label) > 40:
+                        label = label[:37] + '...'
+                    latency = result['latency_ms']
+                    self.stdout.write(f"{route:>16} {label:<40} {size:>8} {1 - size / full_size:>7.0%} "
+                                      f"{latency['p50']:>8.2f} {latency['p95']:>8.2f} {result['queries']:>8}")
+
+        self.stdout.write(self.style.SUCCESS("All Done !"))
@@ -0,0 +1,87 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+
+from shop.bench import scratch_database
+from shop.models import Category, Product, Article
+from shop.seeding import CatalogSeeder
+
+
+def access_paths(articles, products, categories):
+    """The queries run by the viewsets and the serializers, on rows in the middle of the tables."""
+    product_id, category_id = products // 2, categories // 2
+    return {
+        'article list page': Article.objects.filter(active=True)[articles // 4:articles // 4 + 6],
+        'article list count': Article.objects.filter(active=True).values('active').annotate(total=Count('id')),
+        'article cursor page': Article.objects.filter(active=True, id__gt=articles // 2).order_by('id')[:6],
+        'articles of product': Article.objects.filter(active=True, product_id=product_id),
+        'product cursor page': Article.objects.filter(active=True, product_id=product_id,
+                                                      id__gt=articles // 2).order_by('id')[:6],
+        'products of category': Product.objects.filter(active=True, category_id=category_id),
+        'category cursor page': Product.objects.filter(active=True, category_id=category_id,
+                                                       id__gt=products // 2).order_by('id')[:6],
+        'product name exists': Product.objects.filter(name=f'Product {product_id}')[:1],
+        'category name exists': Category.objects.filter(name=f'Category {category_id}')[:1],
+    }
+
+
+class Command(BaseCommand):
+
+    help = 'Seed a large catalog and compare query plans and timings without and with the tuned indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=1000)
+        parser.add_argument('--products-per', type=int, default=100)
+        parser.add_argument('--articles-per', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def analyze(self):
+        # Refresh the planner statistics after the schema changes
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def measure(self, label, queries, repeat):
+        self.stdout.write(self.style.MIGRATE_LABEL(f'{label}:'))
+        for name, queryset in queries.items():
+            start = time.perf_counter()
+            for _ in range(repeat):
+                list(queryset.all())
+            elapsed = 1000 * (time.perf_counter() - start) / repeat
+            plan = ' / '.join(line.strip() for line in queryset.explain().splitlines())
+            self.stdout.write(f'  {name:<22} {elapsed:9.3f} ms  {plan}')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        tuned = [(model, index) for model in (Category, Product, Article) for index in model._meta.indexes]
+        # The single column foreign key indexes the tuned indexes replaced
+        foreign_keys = [(Product, 'category_id'), (Article, 'product_id')]
+
+        with scratch_database():
+            categories = options['categories']
+            products = categories * options['products_per']
+            articles = products * options['articles_per']
+            rows, seconds = CatalogSeeder(categories, options['products_per'], options['articles_per']).run()
+            self.stdout.write(f'Seeded {articles} articles, {products} products and {categories} categories '
+                              f'in {seconds:.1f}s')
+            queries = access_paths(articles, products, categories)
+
+            with connection.schema_editor() as editor:
+                for model, index in tuned:
+                    editor.remove_index(model, index)
+                for model, column in foreign_keys:
+                    editor.execute(f'CREATE INDEX bench_{column} ON {model._meta.db_table} ({column})')
+            self.analyze()
+            self.measure('Before', queries, options['repeat'])
+
+            with connection.schema_editor() as editor:
+                for model, column in foreign_keys:
+                    editor.execute(f'DROP INDEX bench_{column}')
+                for model, index in tuned:
+                    editor.add_index(model, index)
+            self.analyze()
+            self.measure('After', queries, options['repeat'])
+
+        self.stdout.write(self.style.SUCCESS("All Done !"))
@@ -0,0 +1,80 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from rest_framework.renderers import JSONRenderer
+
+from shop import compression
+from shop.bench import scratch_database
+from shop.models import Category, Article
+from shop.renderers import FastJSONRenderer, MessagePackRenderer
+from shop.rows import CATEGORY_ROW, DENORMALIZED_ARTICLE_ROW
+from shop.seeding import CatalogSeeder
+from shop.serializers import CategoryDetailSerializer
+
+
+def cpu_ms(function, repeat):
+    """Mean CPU time of ``function()`` in milliseconds, and its last result."""
+    start = time.process_time()
+    for _ in range(repeat):
+        result = function()
+    return 1000 * (time.process_time() - start) / repeat, result
+
+
+class Command(BaseCommand):
+
+    help = ('Measure the payload size and the CPU cost of the renderers and of the response compression '
+            'against the default JSONRenderer')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products-per', type=int, default=50)
+        parser.add_argument('--articles-per', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=1000, help='Rows of the article list page')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        renderers = [JSONRenderer(), FastJSONRenderer()]
+        if MessagePackRenderer.available:
+            renderers.append(MessagePackRenderer())
+        else:
+            self.stdout.write(self.style.WARNING('msgpack is not installed, MessagePack is left out'))
+        if compression.brotli is None:
+            self.stdout.write(self.style.WARNING('brotli is not installed, only gzip is measured'))
+
+        with scratch_database():
+            rows, seconds = CatalogSeeder(options['categories'], options['products_per'], options['articles_per'],
+                                          seed=0).run()
+            self.stdout.write(f'Seeded {rows} rows in {seconds:.1f}s')
+            # The serializers run once, only the rendering of their output is measured
+            largest = Category.objects.annotate(size=Count('products__articles')).order_by('-size', 'pk')[:1]
+            articles = Article.objects.order_by('pk').values(*DENORMALIZED_ARTICLE_ROW.columns)
+            payloads = {
+                'category-detail': CategoryDetailSerializer(Category.objects.filter(pk__in=largest)
+                                                            .with_active_tree().get()).data,
+                'category-list': [CATEGORY_ROW.from_dict(values)
+                                  for values in Category.objects.values(*CATEGORY_ROW.columns)],
+                'article-list': [DENORMALIZED_ARTICLE_ROW.from_dict(values)
+                                 for values in articles[:options['page_size']]],
+            }
+
+        repeat = options['repeat']
+        codings = compression.codings()
+        header = f"{'payload':>16} {'renderer':>20} {'bytes':>9} {'size':>6} {'render ms':>10}"
+        for coding in codings:
+            header += f" {coding + ' bytes':>10} {coding + ' ms':>8}"
+        self.stdout.write(header)
+        for name, data in payloads.items():
+            json_size = None
+            for renderer in renderers:
+                render_ms, content = cpu_ms(lambda: renderer.render(data, renderer.media_type, {}), repeat)
+                json_size = json_size or len(content)
+                line = (f"{name:>16} {type(renderer).__name__:>20} {len(content):>9} "
+                        f"{len(content) / json_size:>6.0%} {render_ms:>10.2f}")
+                for coding in codings:
+                    compress_ms, compressed = cpu_ms(lambda: compression.compress(content, coding), repeat)
+                    line += f' {len(compressed):>10} {compress_ms:>8.2f}'
+                self.stdout.write(line)
+
+        self.stdout.write(self.style.SUCCESS("All Done !"))
@@ -0,0 +1,70 @@
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from shop.bench import scratch_database
+from shop.models import Product, Article
+from shop.search import search
+from shop.seeding import CatalogSeeder
+
+PRICE_INDEX = 'article_active_price_idx'
+
+
+class Command(BaseCommand):
+
+    help = 'Time text search and price ranges on a large synthetic catalog, with and without their indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=1000)
+        parser.add_argument('--products-per', type=int, default=100)
+        parser.add_argument('--articles-per', type=int, default=9)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def queries(self, categories, products_per):
+        category = categories // 2
+        product = category * products_per
+        articles = Article.objects.filter(active=True)
+        return {
+            'article search, rare word': lambda: search(articles, f'Product {product}'),
+            'article search, category': lambda: search(articles, f'Category {category}'),
+            'article search, common word': lambda: search(articles, 'lot'),
+            'product search': lambda: search(Product.objects.filter(active=True), f'Product {product}'),
+            'price range page': lambda: articles.filter(price__gte=Decimal('10.00'),
+                                                         price__lte=Decimal('10.50')).order_by('price', 'id'),
+            'cheapest page': lambda: articles.order_by('price', 'id'),
+        }
+
+    def measure(self, label, queries, repeat):
+        self.stdout.write(self.style.MIGRATE_LABEL(f'{label}:'))
+        for name, build in queries.items():
+            queryset = build()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                count = queryset.count()
+                list(queryset[:6])
+            elapsed = 1000 * (time.perf_counter() - start) / repeat
+            self.stdout.write(f'  {name:<28} {elapsed:10.2f} ms  {count:>8} rows')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+
+        with scratch_database():
+            seeder = CatalogSeeder(options['categories'], options['products_per'], options['articles_per'])
+            rows, seconds = seeder.run()
+            self.stdout.write(f'Seeded {rows} rows, FTS triggers included, in {seconds:.1f}s')
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            queries = self.queries(options['categories'], options['products_per'])
+
+            self.measure('Indexed', queries, options['repeat'])
+
+            index = next(index for index in Article._meta.indexes if index.name == PRICE_INDEX)
+            with connection.schema_editor() as editor:
+                editor.remove_index(Article, index)
+            with mock.patch('shop.search.fts_available', return_value=False):
+                self.measure('Without FTS and price index (icontains)', queries, options['repeat'])
+
+        self.stdout.write(self.style.SUCCESS("All Done !"))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.models import Article
+
+
+class Command(BaseCommand):
+
+    help = 'Check that the product and category columns copied on the articles match their product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Copy the current values on the inconsistent articles')
+        parser.add_argument('--show', type=int, default=10, help='Number of inconsistent articles to list')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+
+        inconsistent = Article.objects.inconsistent()
+        count = inconsistent.count()
+        if not count:
+            self.stdout.write(self.style.SUCCESS("All Done !"))
+            return
+
+        rows = inconsistent.order_by('id').values_list('id', 'product_name', 'category_id', 'category_name',
+                                                       'product__name', 'product__category_id',
+                                                       'product__category__name')
+        for pk, *values in rows[:options['show']]:
+            self.stdout.write(f'  article {pk}: {tuple(values[:3])} instead of {tuple(values[3:])}')
+
+        if not options['fix']:
+            raise CommandError(f'{count} inconsistent articles, run with --fix to repair them')
+        Article.objects.filter(pk__in=inconsistent.values('pk')).sync_denormalized()
+        self.stdout.write(f'Fixed {count} articles')
+        self.stdout.write(self.style.SUCCESS("All Done !"))
@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 
 from shop.models import Category
+from shop.seeding import CatalogSeeder, truncate_catalog
 
 UserModel = get_user_model()
 
@@ -109,11 +110,41 @@ class Command(BaseCommand):
 
     help = 'Initialize project for local development'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int,
+                            help='Generate a synthetic catalog of this many categories instead of the fixture')
+        parser.add_argument('--products-per', type=int, default=10)
+        parser.add_argument('--articles-per', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
     def handle(self, *args, **options):
         self.stdout.write(self.style.MIGRATE_HEADING(self.help))
 
-        Category.objects.all().delete()
+        truncate_catalog()
+
+        if options['categories']:
+            self.seed_catalog(options)
+        else:
+            self.load_fixture()
+
+        UserModel.objects.filter(username=ADMIN_ID).delete()
+        UserModel.objects.create_superuser(ADMIN_ID, 'admin@oc.drf', ADMIN_PASSWORD)
+
+        self.stdout.write(self.style.SUCCESS("All Done !"))
+
+    def seed_catalog(self, options):
+        seeder = CatalogSeeder(options['categories'], options['products_per'], options['articles_per'],
+                               seed=options['seed'], chunk_size=options['chunk_size'])
 
+        def progress(rows, seconds):
+            self.stdout.write(f'\r  {rows}/{seeder.total} rows, {rows / seconds:.0f} rows/s', ending='')
+            self.stdout.flush()
+
+        rows, seconds = seeder.run(progress)
+        self.stdout.write(f'\r  {rows} rows in {seconds:.1f}s, {rows / seconds:.0f} rows/s')
+
+    def load_fixture(self):
         for data_category in CATEGORIES:
             category = Category.objects.create(name=data_category['name'],
                                                active=data_category['active'])
@@ -124,7 +155,3 @@ class Command(BaseCommand):
                     product.articles.create(name=data_article['name'],
                                             active=data_article['active'],
                                             price=data_article['price'])
-
-        UserModel.objects.create_superuser(ADMIN_ID, 'admin@oc.drf', ADMIN_PASSWORD)
-
-        self.stdout.write(self.style.SUCCESS("All Done !"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import ProductRollup
+
+
+class Command(BaseCommand):
+
+    help = 'Create the missing product rollups and recompute the stale ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every rollup, not only the stale ones')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+
+        with transaction.atomic():
+            if options['full']:
+                ProductRollup.objects.update(stale=True)
+            created = ProductRollup.objects.create_missing()
+            refreshed = ProductRollup.objects.refresh_stale()
+        self.stdout.write(f'Created {created} rollups, refreshed {refreshed}')
+        self.stdout.write(self.style.SUCCESS("All Done !"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from shop.models import CategorySnapshot
+from shop.snapshots import rebuild
+
+
+class Command(BaseCommand):
+
+    help = 'Create the missing category snapshots and rebuild the stale ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every snapshot, not only the stale ones')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+
+        if options['full']:
+            CategorySnapshot.objects.update(stale=True, version=F('version') + 1)
+        created = CategorySnapshot.objects.create_missing()
+        rebuilt = rebuild()
+        self.stdout.write(f'Created {created} snapshots, rebuilt {rebuilt}')
+        self.stdout.write(self.style.SUCCESS("All Done !"))
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from shop import replicas
+
+
+class Command(BaseCommand):
+
+    help = 'Copy the primary SQLite database over the read replicas, optionally late and repeatedly'
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*', help='Replicas to copy to, REPLICAS["ALIASES"] by default')
+        parser.add_argument('--lag', type=float, default=0, help='Seconds between the snapshot and its copy')
+        parser.add_argument('--interval', type=float, default=0, help='Copy again every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.MIGRATE_HEADING(self.help))
+        aliases = options['aliases'] or replicas.get_setting('ALIASES')
+        if not aliases:
+            raise CommandError('No replica, list them in REPLICAS["ALIASES"] or on the command line')
+        for alias in aliases:
+            if alias == DEFAULT_DB_ALIAS or alias not in settings.DATABASES:
+                raise CommandError(f'{alias} is not a replica')
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(f'{alias} is not a SQLite database, use the replication of its server')
+
+        while True:
+            start = time.perf_counter()
+            for alias in aliases:
+                replicas.replicate(alias, lag=options['lag'])
+                self.stdout.write(f'Copied {DEFAULT_DB_ALIAS} to {alias}')
+            if not options['interval']:
+                break
+            time.sleep(max(0, options['interval'] - (time.perf_counter() - start)))
+        self.stdout.write(self.style.SUCCESS("All Done !"))
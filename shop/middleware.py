@@ -0,0 +1,89 @@
+import asyncio
+import math
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import markcoroutinefunction
+
+from shop import compression, replicas, stats
+
+
+class StatsMiddleware:
+    """Record per-route latency, SQL and serializer statistics in ``shop.stats.registry``."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Keeps async views on the event loop under ASGI
+            markcoroutinefunction(self)
+
+    @contextmanager
+    def recording(self, request):
+        # Queries are counted by stats.sql_wrapper, installed on every connection
+        metrics = stats.start_request()
+        start = time.perf_counter()
+        try:
+            yield
+            duration = time.perf_counter() - start
+            match = request.resolver_match
+            stats.registry.record(match.view_name if match else 'unresolved', duration, metrics)
+        finally:
+            stats.end_request()
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.recording(request):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with self.recording(request):
+            return await self.get_response(request)
+
+
+class ReplicaPinningMiddleware:
+    """After a successful write, pin the reads of the client to the primary, see ``shop.replicas``."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def pin(self, request, response):
+        if (replicas.get_setting('ALIASES') and request.method not in replicas.SAFE_METHODS
+                and response.status_code < 400):
+            max_lag = replicas.get_setting('MAX_LAG')
+            response.set_cookie(replicas.PIN_COOKIE, f'{time.time() + max_lag:.3f}', max_age=math.ceil(max_lag),
+                                httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.pin(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.pin(request, await self.get_response(request))
+
+
+class CompressionMiddleware:
+    """Compress the API responses with the coding negotiated by ``Accept-Encoding``, see ``shop.compression``."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        return compression.compress_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return compression.compress_response(request, await self.get_response(request))
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.5 on 2026-10-18 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='ecoscore_fetched_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='ecoscore_grade',
+            field=models.CharField(blank=True, editable=False, max_length=8, null=True),
+        ),
+    ]
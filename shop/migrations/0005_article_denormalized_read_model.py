@@ -0,0 +1,41 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def sync_articles(apps, schema_editor):
+    Article = apps.get_model('shop', 'Article')
+    Product = apps.get_model('shop', 'Product')
+    products = Product.objects.filter(pk=models.OuterRef('product_id'))
+    Article.objects.update(
+        product_name=models.Subquery(products.values('name')[:1]),
+        category_id=models.Subquery(products.values('category_id')[:1]),
+        category_name=models.Subquery(products.values('category__name')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_filter_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='category',
+            field=models.ForeignKey(db_constraint=False, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='shop.category'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='category_name',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='product_name',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(sync_articles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:20
+
+from django.db import migrations, models
+
+# Table: (content table, indexed columns)
+FTS_TABLES = {
+    'shop_article_fts': ('shop_article', ('name', 'description', 'product_name', 'category_name')),
+    'shop_product_fts': ('shop_product', ('name', 'description')),
+}
+
+
+def fts5_enabled(schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def create_fts_tables(apps, schema_editor):
+    # Without FTS5, shop.search falls back on icontains
+    if not fts5_enabled(schema_editor):
+        return
+    for table, (content, columns) in FTS_TABLES.items():
+        names = ', '.join(columns)
+        new = ', '.join(f'new.{column}' for column in columns)
+        old = ', '.join(f'old.{column}' for column in columns)
+        for statement in (
+            f"CREATE VIRTUAL TABLE {table} USING fts5({names}, content='{content}', content_rowid='id', "
+            f"tokenize='unicode61 remove_diacritics 2')",
+            f"CREATE TRIGGER {table}_insert AFTER INSERT ON {content} BEGIN "
+            f"INSERT INTO {table}(rowid, {names}) VALUES (new.id, {new}); END",
+            f"CREATE TRIGGER {table}_delete AFTER DELETE ON {content} BEGIN "
+            f"INSERT INTO {table}({table}, rowid, {names}) VALUES ('delete', old.id, {old}); END",
+            # Only when an indexed column changes, not on disable() or price updates
+            f"CREATE TRIGGER {table}_update AFTER UPDATE OF {names} ON {content} BEGIN "
+            f"INSERT INTO {table}({table}, rowid, {names}) VALUES ('delete', old.id, {old}); "
+            f"INSERT INTO {table}(rowid, {names}) VALUES (new.id, {new}); END",
+            f"INSERT INTO {table}({table}) VALUES ('rebuild')",
+        ):
+            schema_editor.execute(statement)
+
+
+def drop_fts_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in FTS_TABLES:
+        for trigger in ('insert', 'delete', 'update'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_{trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_article_denormalized_read_model'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(condition=models.Q(('active', True)), fields=['price', 'id'], name='article_active_price_idx'),
+        ),
+        migrations.RunPython(create_fts_tables, drop_fts_tables),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRollup',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rollup', serialize=False, to='shop.product')),
+                ('articles', models.PositiveIntegerField(default=0)),
+                ('active_articles', models.PositiveIntegerField(default=0)),
+                ('price_min', models.DecimalField(decimal_places=2, max_digits=4, null=True)),
+                ('price_max', models.DecimalField(decimal_places=2, max_digits=4, null=True)),
+                ('price_sum', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('stale', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productrollup',
+            index=models.Index(condition=models.Q(('stale', True)), fields=['product'], name='rollup_stale_idx'),
+        ),
+    ]
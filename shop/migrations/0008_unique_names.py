@@ -0,0 +1,83 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+NAME_LENGTH = 255
+FTS_TABLE = 'shop_product_fts'
+FTS_COLUMNS = ('name', 'description')
+
+
+def rename_duplicates(apps, schema_editor):
+    """
+    The constraints below need unique names: keep the name on the oldest row
+    of each duplicated one, the others get their id appended, `Pomme (12)`.
+    """
+    Article = apps.get_model('shop', 'Article')
+    for model_name, article_field in (('Category', 'category'), ('Product', 'product')):
+        manager = apps.get_model('shop', model_name).objects.using(schema_editor.connection.alias)
+        taken = set(manager.values_list('name', flat=True))
+        duplicated = (manager.values('name').annotate(count=models.Count('pk')).filter(count__gt=1)
+                      .values_list('name', flat=True))
+        for name in sorted(duplicated):
+            for pk in manager.filter(name=name).order_by('pk').values_list('pk', flat=True)[1:]:
+                suffix, attempt = f' ({pk})', 1
+                while name[:NAME_LENGTH - len(suffix)] + suffix in taken:
+                    attempt += 1
+                    suffix = f' ({pk}-{attempt})'
+                renamed = name[:NAME_LENGTH - len(suffix)] + suffix
+                taken.add(renamed)
+                manager.filter(pk=pk).update(name=renamed)
+                # The copies of the denormalized read model
+                Article.objects.using(schema_editor.connection.alias).filter(**{f'{article_field}_id': pk}).update(
+                    **{f'{article_field}_name': renamed})
+
+
+def restore_fts_triggers(apps, schema_editor):
+    # SQLite adds the constraints by rebuilding shop_product, which drops its full-text triggers
+    if FTS_TABLE not in schema_editor.connection.introspection.table_names():
+        return
+    names = ', '.join(FTS_COLUMNS)
+    new = ', '.join(f'new.{column}' for column in FTS_COLUMNS)
+    old = ', '.join(f'old.{column}' for column in FTS_COLUMNS)
+    for trigger in ('insert', 'delete', 'update'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}')
+    for statement in (
+        f"CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON shop_product BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, {names}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON shop_product BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {names}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF {names} ON shop_product BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {names}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {FTS_TABLE}(rowid, {names}) VALUES (new.id, {new}); END",
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+    ):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_product_rollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+        migrations.RunPython(migrations.RunPython.noop, restore_fts_triggers),
+        migrations.RemoveIndex(
+            model_name='category',
+            name='category_name_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_name_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='category',
+            constraint=models.UniqueConstraint(fields=('name',), name='category_name_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('name',), name='product_name_unique'),
+        ),
+        migrations.RunPython(restore_fts_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_unique_names'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategorySnapshot',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='shop.category')),
+                ('document', models.TextField(blank=True)),
+                ('etag', models.CharField(blank=True, max_length=32)),
+                ('last_modified', models.DateTimeField(null=True)),
+                ('active', models.BooleanField(default=False)),
+                ('stale', models.BooleanField(default=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='categorysnapshot',
+            index=models.Index(condition=models.Q(('stale', True)), fields=['category'], name='snapshot_stale_idx'),
+        ),
+    ]
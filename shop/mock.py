@@ -22,4 +22,16 @@ def mock_openfoodfact_success(self, method, url):
     # Nous monkey patchons response.json
     # Attention à ne pas mettre les (), nous n'appelons pas la méthode mais la remplaçons
     response.json = monkey_json
-    return response
\ No newline at end of file
+    return response
+
+
+def mock_openfoodfact_not_found(self, method, url):
+    # Le produit est inconnu d'OpenFoodFacts : aucun ecoscore ne doit être renvoyé
+    response = requests.Response()
+    response.status_code = 404
+    return response
+
+
+async def mock_openfoodfact_success_async(self, method, url):
+    # La variante asynchrone renvoie la même réponse, sans attendre le réseau
+    return mock_openfoodfact_success(self, method, url)
@@ -1,6 +1,73 @@
+from django.conf import settings
 from django.db import models, transaction
+from django.db.models import Count, F, Max, Min, OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-import requests
+from shop import upstream
+from shop.cache import VersionedQuerySet
+from shop.ecoscore import get_ecoscore
+from shop.workqueue import CoalescingQueue
+
+
+def denormalized_values(instance):
+    # Deferred fields are left alone rather than loaded
+    return tuple(instance.__dict__.get(field) for field in instance.denormalized_fields)
+
+
+def rollup_enabled():
+    return getattr(settings, 'CATALOG_ROLLUP', False)
+
+
+def snapshots_enabled():
+    return getattr(settings, 'CATEGORY_SNAPSHOTS', {}).get('ENABLED', False)
+
+
+# Rebuilds the category snapshots, configured by shop.snapshots
+snapshot_queue = CoalescingQueue('category-snapshots')
+
+
+class CategoryQuerySet(VersionedQuerySet):
+
+    def with_active_tree(self):
+        """Prefetch active products and their active articles as ``active_products``."""
+        return self.with_active_products(Product.objects.with_active_articles())
+
+    def with_active_products(self, products=None):
+        """Prefetch active products as ``active_products``, from the ``products`` queryset when given."""
+        products = (Product.objects.all() if products is None else products).filter(active=True)
+        return self.prefetch_related(Prefetch('products', queryset=products, to_attr='active_products'))
+
+    @transaction.atomic
+    def disable(self):
+        """
+        Disable the active categories of the queryset with their products and
+        articles, in three UPDATE statements whatever the number of rows.
+        Return the number of disabled rows per model.
+        """
+        now = timezone.now()
+        categories = self.filter(active=True)
+        # Children first, while their categories are still active
+        articles = Article.objects.filter(active=True, product__category__in=categories)
+        products = Product.objects.filter(active=True, category__in=categories)
+        return {
+            Article._meta.label: articles.update(active=False, date_updated=now),
+            Product._meta.label: products.update(active=False, date_updated=now),
+            Category._meta.label: categories.update(active=False, date_updated=now),
+        }
+
+    def update(self, **kwargs):
+        snapshots = snapshots_enabled()
+        if 'name' not in kwargs and not snapshots:
+            return super().update(**kwargs)
+        with transaction.atomic():
+            pks = list(self.values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            if 'name' in kwargs:
+                Article.objects.filter(product__category__in=pks).sync_denormalized()
+            if snapshots:
+                CategorySnapshot.objects.filter(category__in=pks).mark_stale()
+        return rows
 
 
 class Category(models.Model):
@@ -12,17 +79,88 @@ class Category(models.Model):
     description = models.TextField(blank=True)
     active = models.BooleanField(default=False)
 
+    objects = CategoryQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['active', 'id'], name='category_active_id_idx'),
+        ]
+        constraints = [
+            # Also serves the lookups by name
+            models.UniqueConstraint(fields=['name'], name='category_name_unique'),
+        ]
+
+    # Copied on the articles by ArticleQuerySet.sync_denormalized()
+    denormalized_fields = ('name',)
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._denormalized = denormalized_values(instance)
+        return instance
+
     @transaction.atomic
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if getattr(self, '_denormalized', None) not in (None, denormalized_values(self)):
+            Article.objects.filter(product__category=self).sync_denormalized()
+        self._denormalized = denormalized_values(self)
+
     def disable(self):
         if self.active:
             self.active = False
-            self.save()
-            self.products.update(active=False)
-            # for product in self.products:
-            #     product.articles.update(active=False)
+            return Category.objects.filter(pk=self.pk).disable()
+        return {}
+
+
+class ProductQuerySet(VersionedQuerySet):
+
+    def with_active_articles(self, articles=None):
+        """Prefetch active articles as ``active_articles``, from the ``articles`` queryset when given."""
+        articles = (Article.objects.all() if articles is None else articles).filter(active=True)
+        return self.prefetch_related(Prefetch('articles', queryset=articles, to_attr='active_articles'))
+
+    @transaction.atomic
+    def disable(self):
+        """
+        Disable the active products of the queryset with their articles, in two
+        UPDATE statements. Return the number of disabled rows per model.
+        """
+        now = timezone.now()
+        products = self.filter(active=True)
+        articles = Article.objects.filter(active=True, product__in=products)
+        return {
+            Article._meta.label: articles.update(active=False, date_updated=now),
+            Product._meta.label: products.update(active=False, date_updated=now),
+        }
+
+    def update(self, **kwargs):
+        denormalized = bool({'name', 'category', 'category_id'} & set(kwargs))
+        snapshots = snapshots_enabled() and bool(set(kwargs) - CategorySnapshot.ignored_product_fields)
+        if not denormalized and not snapshots:
+            return super().update(**kwargs)
+        with transaction.atomic():
+            pks = list(self.values_list('pk', flat=True))
+            if snapshots:
+                # Before the update, for the categories the products leave
+                CategorySnapshot.objects.filter(category__products__in=pks).mark_stale()
+            rows = super().update(**kwargs)
+            if denormalized:
+                Article.objects.filter(product__in=pks).sync_denormalized()
+            if snapshots and {'category', 'category_id'} & set(kwargs):
+                CategorySnapshot.objects.filter(category__products__in=pks).mark_stale()
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if rollup_enabled():
+            ProductRollup.objects.create_for(objs)
+        if snapshots_enabled():
+            CategorySnapshot.objects.filter(category__in={product.category_id for product in objs}).mark_stale()
+        return objs
 
 
 class Product(models.Model):
@@ -34,26 +172,140 @@ class Product(models.Model):
     description = models.TextField(blank=True)
     active = models.BooleanField(default=False)
 
-    category = models.ForeignKey('shop.Category', on_delete=models.CASCADE, related_name='products')
+    # Indexed by product_category_active_id_idx, which starts with category_id
+    category = models.ForeignKey('shop.Category', on_delete=models.CASCADE, related_name='products', db_index=False)
+
+    ecoscore_grade = models.CharField(max_length=8, null=True, blank=True, editable=False)
+    ecoscore_fetched_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['active', 'id'], name='product_active_id_idx'),
+            models.Index(fields=['category', 'active', 'id'], name='product_category_active_id_idx'),
+            # SQLite compiles filter(active=True) to a bare "active" term, which only partial indexes can match
+            models.Index(fields=['category', 'id'], condition=Q(active=True), name='product_active_category_idx'),
+        ]
+        constraints = [
+            # Also serves the lookups by name
+            models.UniqueConstraint(fields=['name'], name='product_name_unique'),
+        ]
+
+    # Copied on the articles by ArticleQuerySet.sync_denormalized()
+    denormalized_fields = ('name', 'category_id')
+    # Stored while rendering, their updates keep the cached responses, see shop.cache
+    cache_ignored_fields = {'ecoscore_grade', 'ecoscore_fetched_at'}
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._denormalized = denormalized_values(instance)
+        # The snapshot of the previous category is stale too when the product moves
+        instance._previous_category_id = instance.__dict__.get('category_id')
+        return instance
+
     @transaction.atomic
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if getattr(self, '_denormalized', None) not in (None, denormalized_values(self)):
+            Article.objects.filter(product=self).sync_denormalized()
+        self._denormalized = denormalized_values(self)
+        self._previous_category_id = self.category_id
+
     def disable(self):
         if self.active:
             self.active = False
-            self.save()
-            self.articles.update(active=False)
+            return Product.objects.filter(pk=self.pk).disable()
+        return {}
 
     def call_external_api(self, method, url):
-        return requests.request(method, url)
+        return upstream.request(method, url)
+
+    async def acall_external_api(self, method, url):
+        return await upstream.arequest(method, url)
 
     @property
     def ecoscore(self):
-        response = self.call_external_api('GET', 'https://world.openfoodfacts.org/api/v0/product/3229820787015.json')
-        if response.status_code == 200:
-            return response.json()['product']['ecoscore_grade']
+        return get_ecoscore(self)
+
+
+class ArticleQuerySet(VersionedQuerySet):
+
+    def disable(self):
+        """Disable the active articles of the queryset. Return the number of disabled rows."""
+        return {Article._meta.label: self.filter(active=True).update(active=False, date_updated=timezone.now())}
+
+    def sync_denormalized(self):
+        """
+        Copy the name and category of their product on the articles of the
+        queryset, in one UPDATE. Their ``date_updated`` moves too, so that the
+        validators of the denormalized reads need no join.
+        """
+        products = Product.objects.filter(pk=OuterRef('product_id'))
+        return self.update(
+            product_name=Subquery(products.values('name')[:1]),
+            category_id=Subquery(products.values('category_id')[:1]),
+            category_name=Subquery(products.values('category__name')[:1]),
+            date_updated=timezone.now(),
+        )
+
+    def inconsistent(self):
+        """Articles whose denormalized columns differ from their product and category."""
+        return self.filter(
+            Q(category__isnull=True)
+            | ~Q(product_name=models.F('product__name'))
+            | ~Q(category_id=models.F('product__category_id'))
+            | ~Q(category_name=models.F('product__category__name'))
+        )
+
+    def update(self, **kwargs):
+        moved = bool({'product', 'product_id'} & set(kwargs))
+        rollups = rollup_enabled() and bool(ProductRollup.article_fields & set(kwargs))
+        snapshots = snapshots_enabled() and bool(set(kwargs) - CategorySnapshot.ignored_article_fields)
+        if not moved and not rollups and not snapshots:
+            return super().update(**kwargs)
+        with transaction.atomic():
+            if rollups:
+                ProductRollup.objects.filter(product__in=self.values('product_id')).mark_stale()
+            if snapshots:
+                CategorySnapshot.objects.filter(category__products__in=self.values('product_id')).mark_stale()
+            if not moved:
+                return super().update(**kwargs)
+            pks = list(self.values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            articles = Article.objects.filter(pk__in=pks)
+            articles.sync_denormalized()
+            if rollups:
+                ProductRollup.objects.filter(product__in=articles.values('product_id')).mark_stale()
+            if snapshots:
+                CategorySnapshot.objects.filter(category__products__in=articles.values('product_id')).mark_stale()
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        # Reuse the products already loaded with their category, fetch the others at once
+        products = {article.product_id: article.product for article in objs
+                    if Article.product.is_cached(article) and Product.category.is_cached(article.product)}
+        missing = {article.product_id for article in objs} - set(products)
+        if missing:
+            products.update(Product.objects.select_related('category').in_bulk(missing))
+        for article in objs:
+            product = products.get(article.product_id)
+            if product is not None:
+                article.product_name = product.name
+                article.category_id = product.category_id
+                article.category_name = product.category.name
+        objs = super().bulk_create(objs, *args, **kwargs)
+        products = {article.product_id for article in objs}
+        if rollup_enabled():
+            ProductRollup.objects.filter(product__in=products).mark_stale()
+        if snapshots_enabled():
+            CategorySnapshot.objects.filter(category__products__in=products).mark_stale()
+        return objs
 
 
 class Article(models.Model):
@@ -66,7 +318,171 @@ class Article(models.Model):
     active = models.BooleanField(default=False)
     price = models.DecimalField(max_digits=4, decimal_places=2)
 
-    product = models.ForeignKey('shop.Product', on_delete=models.CASCADE, related_name='articles')
+    # Indexed by article_product_active_id_idx, which starts with product_id
+    product = models.ForeignKey('shop.Product', on_delete=models.CASCADE, related_name='articles', db_index=False)
+
+    # Read model copied from the product and its category, so that lists need no join.
+    # Deleted with the product, hence neither constraint nor cascade of its own.
+    product_name = models.CharField(max_length=255, blank=True, editable=False)
+    category = models.ForeignKey('shop.Category', on_delete=models.DO_NOTHING, related_name='+', null=True,
+                                 editable=False, db_index=False, db_constraint=False)
+    category_name = models.CharField(max_length=255, blank=True, editable=False)
+
+    objects = ArticleQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['active', 'id'], name='article_active_id_idx'),
+            models.Index(fields=['product', 'active', 'id'], name='article_product_active_id_idx'),
+            # SQLite compiles filter(active=True) to a bare "active" term, which only partial indexes can match
+            models.Index(fields=['product', 'id'], condition=Q(active=True), name='article_active_product_idx'),
+            # Price ranges and sorting of the public list
+            models.Index(fields=['price', 'id'], condition=Q(active=True), name='article_active_price_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The rollup and the snapshot of the previous product are stale too when the article moves
+        instance._previous_product_id = instance.__dict__.get('product_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Product.save() and Category.save() keep the copies in sync, only new and moved articles need them
+        if self._state.adding or self.product_id != getattr(self, '_previous_product_id', None):
+            if Article.product.is_cached(self) and Product.category.is_cached(self.product):
+                product = self.product
+            else:
+                product = Product.objects.select_related('category').get(pk=self.product_id)
+            self.product_name = product.name
+            self.category_id = product.category_id
+            self.category_name = product.category.name
+        super().save(*args, **kwargs)
+        self._previous_product_id = self.product_id
+
+
+class ProductRollupQuerySet(VersionedQuerySet):
+
+    def mark_stale(self):
+        """Flag the rollups of the queryset, recomputed by ``refresh_stale()`` on commit."""
+        self.filter(stale=False).update(stale=True)
+        transaction.on_commit(ProductRollup.objects.refresh_stale)
+
+    def refresh_stale(self):
+        """Recompute the stale rollups of the queryset with one UPDATE. Return the number of refreshed rows."""
+        articles = Article.objects.filter(product=OuterRef('product_id')).order_by().values('product')
+        active = articles.filter(active=True)
+
+        def aggregate(queryset, function):
+            return Subquery(queryset.annotate(value=function).values('value'))
+
+        return self.filter(stale=True).update(
+            articles=Coalesce(aggregate(articles, Count('pk')), 0),
+            active_articles=Coalesce(aggregate(active, Count('pk')), 0),
+            price_min=aggregate(active, Min('price')),
+            price_max=aggregate(active, Max('price')),
+            price_sum=Coalesce(aggregate(active, Sum('price')), 0, output_field=ProductRollup.price_sum.field),
+            stale=False,
+        )
+
+    def create_for(self, products):
+        """Create the empty rollups of freshly created ``products``."""
+        pks = [product.pk for product in products]
+        if None in pks:
+            # Primary keys not returned by the backend
+            return self.create_missing()
+        self.bulk_create([ProductRollup(product_id=pk) for pk in pks], ignore_conflicts=True)
+
+    def create_missing(self, batch_size=1000):
+        """Create the rollups of the products which have none, computed on commit. Return their number."""
+        pks = Product.objects.filter(rollup__isnull=True).values_list('pk', flat=True)
+        rollups = [ProductRollup(product_id=pk, stale=True) for pk in pks.iterator(chunk_size=batch_size)]
+        self.bulk_create(rollups, batch_size=batch_size, ignore_conflicts=True)
+        transaction.on_commit(ProductRollup.objects.refresh_stale)
+        return len(rollups)
+
+
+class ProductRollup(models.Model):
+    """
+    Article counts and active prices of a product, read by the summaries when
+    ``CATALOG_ROLLUP`` is enabled. Every write to the articles flags the
+    rollups of their products as stale, and those are recomputed on commit.
+    """
+
+    product = models.OneToOneField('shop.Product', on_delete=models.CASCADE, primary_key=True, related_name='rollup')
+
+    articles = models.PositiveIntegerField(default=0)
+    active_articles = models.PositiveIntegerField(default=0)
+    price_min = models.DecimalField(max_digits=4, decimal_places=2, null=True)
+    price_max = models.DecimalField(max_digits=4, decimal_places=2, null=True)
+    price_sum = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    stale = models.BooleanField(default=False)
+
+    objects = ProductRollupQuerySet.as_manager()
+
+    # Article fields the rollups are computed from
+    article_fields = {'active', 'price', 'product', 'product_id'}
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product'], condition=Q(stale=True), name='rollup_stale_idx'),
+        ]
+
+
+class CategorySnapshotQuerySet(models.QuerySet):
+
+    def mark_stale(self):
+        """Flag the snapshots of the queryset, rebuilt in the background once committed."""
+        # Bumping the version also voids a rebuild in progress, see publish()
+        self.update(stale=True, version=F('version') + 1)
+        transaction.on_commit(snapshot_queue.put)
+
+    def create_missing(self, categories=None):
+        """Create, stale, the missing snapshots of ``categories`` (by default of every category). Return their number."""
+        missing = Category.objects.filter(snapshot__isnull=True)
+        if categories is not None:
+            missing = missing.filter(pk__in=categories)
+        snapshots = [CategorySnapshot(category_id=pk) for pk in missing.values_list('pk', flat=True)]
+        self.bulk_create(snapshots, ignore_conflicts=True)
+        return len(snapshots)
+
+    def publish(self, category, version, document, etag, last_modified):
+        """Store a rebuilt snapshot, unless it went stale again since ``version`` was read. Return whether stored."""
+        return bool(self.filter(pk=category.pk, version=version).update(
+            document=document, etag=etag, last_modified=last_modified, active=category.active, stale=False,
+        ))
+
+
+class CategorySnapshot(models.Model):
+    """
+    Rendered JSON of a category detail, with its active products and articles,
+    served by ``CategoryViewSet.retrieve`` when ``CATEGORY_SNAPSHOTS`` is
+    enabled. Every write to the tree flags the snapshot of its category as
+    stale, and those are rebuilt by a background queue, see ``shop.snapshots``.
+    """
+
+    category = models.OneToOneField('shop.Category', on_delete=models.CASCADE, primary_key=True,
+                                    related_name='snapshot')
+
+    document = models.TextField(blank=True)
+    # Digest of the document and latest date_updated of the tree, for the conditional requests
+    etag = models.CharField(max_length=32, blank=True)
+    last_modified = models.DateTimeField(null=True)
+    # Copied from the category, so that reads need no join
+    active = models.BooleanField(default=False)
+    stale = models.BooleanField(default=True)
+    version = models.PositiveIntegerField(default=0)
+
+    objects = CategorySnapshotQuerySet.as_manager()
+
+    # Fields left out of the category detail
+    ignored_product_fields = {'ecoscore_grade', 'ecoscore_fetched_at'}
+    ignored_article_fields = {'product_name', 'category', 'category_id', 'category_name'}
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category'], condition=Q(stale=True), name='snapshot_stale_idx'),
+        ]
@@ -0,0 +1,16 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+def available(classes):
+    # Renderers and parsers of an optional dependency which is not installed are left out
+    return [instance for instance in classes if getattr(instance, 'available', True)]
+
+
+class ShopContentNegotiation(DefaultContentNegotiation):
+    """Negotiates the renderers and parsers whose dependencies are installed only."""
+
+    def select_parser(self, request, parsers):
+        return super().select_parser(request, available(parsers))
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return super().select_renderer(request, available(renderers), format_suffix)
@@ -0,0 +1,49 @@
+from rest_framework.pagination import LimitOffsetPagination, CursorPagination
+
+
+class ShopCursorPagination(CursorPagination):
+    # Keyset pagination on the primary key, backed by the (..., active, id) indexes
+    ordering = 'id'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class ShopPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination by default. Requests sending ``?pagination=cursor``,
+    or following a ``cursor`` link, are paginated by keyset instead, which
+    skips the ``COUNT(*)`` and the scan of the rows before the offset.
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    cursor_pagination_class = ShopCursorPagination
+
+    cursor_paginator = None
+    known_count = None
+
+    def use_cursor(self, request):
+        return (request.query_params.get(self.mode_query_param) == 'cursor'
+                or self.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        # Counted already by ConditionalGetMixin
+        self.known_count = getattr(view, 'conditional_count', None)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count(self, queryset):
+        if self.known_count is not None:
+            return self.known_count
+        return super().get_count(queryset)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.to_html()
+        return super().to_html()
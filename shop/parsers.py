@@ -0,0 +1,52 @@
+import codecs
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline delimited JSON lazily: returns a generator of the decoded
+    lines, so that a large import is consumed batch by batch. A line that is
+    not valid JSON is yielded as a ``ParseError`` instead of failing the whole
+    stream.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if stream is None:
+            return iter(())
+        return self.iter_lines(codecs.getreader(encoding)(stream))
+
+    @staticmethod
+    def iter_lines(lines):
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                yield ParseError(f'NDJSON parse error on line {number} - {exc}')
+
+
+class MessagePackParser(BaseParser):
+    """Parses MessagePack request bodies. Only offered when msgpack is installed, see ``shop.negotiation``."""
+    media_type = 'application/msgpack'
+    available = msgpack is not None
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            return None
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except ValueError as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
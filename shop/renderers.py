@@ -0,0 +1,110 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    ``JSONRenderer`` encoding with orjson when it is installed. The compact,
+    unindented output is the same bytes for the catalog representations,
+    which hold strings, integers, booleans and nulls but no floats (orjson
+    formats those differently).
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or not self.compact or self.ensure_ascii
+                or self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped by JSONRenderer for the sake of JavaScript
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack, for the clients sending ``Accept: application/msgpack``.
+    Decimals and datetimes are encoded as the strings of the JSON
+    representation. Only offered when msgpack is installed, see
+    ``shop.negotiation``.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    available = msgpack is not None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=JSONEncoder().default)
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Errors (e.g. permission denied) come as dicts
+        if not isinstance(data, str):
+            data = json.dumps(data)
+        return data.encode(self.charset)
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Exports stream their rows themselves, only errors are rendered here
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(ndjson_lines(rows)).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Exports stream their rows themselves, only errors are rendered here
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(csv_lines(rows)).encode(self.charset)
+
+
+class _Echo:
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    """Yield the CSV lines of an iterable of dicts, with a header line taken from the first one."""
+    writer = csv.writer(_Echo())
+    header = None
+    for row in rows:
+        if header is None:
+            header = list(row)
+            yield writer.writerow(header)
+        yield writer.writerow(row.values())
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
@@ -0,0 +1,135 @@
+"""
+Read replicas for the public read-only viewsets.
+
+``ReplicaReadMixin`` picks one of ``REPLICAS['ALIASES']`` for the whole of a
+safe request, round robin or least loaded (fewest requests in progress), so
+that the count, the page and the validators all come from the same copy;
+``ReplicaRouter`` sends the reads of that request there and every write to
+the primary. Without replicas, or outside those viewsets, everything stays
+on ``default``.
+
+Replicas lag behind: after a successful write request,
+``shop.middleware.ReplicaPinningMiddleware`` sets a cookie pinning the reads
+of that client to the primary for ``MAX_LAG`` seconds, so that it reads its
+own writes. For the same reason responses rendered from a replica are cached
+for ``MAX_LAG`` seconds at most, see ``shop.cache``.
+
+Locally, ``manage.py replicate`` copies the primary SQLite file over the
+replicas, with an artificial lag.
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+DEFAULTS = {
+    'ALIASES': [],
+    # 'round_robin' or 'least_loaded'
+    'STRATEGY': 'round_robin',
+    # Seconds a client reads from the primary after a write, longer than the replication lag
+    'MAX_LAG': 5,
+}
+
+PIN_COOKIE = 'shop_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Alias the reads of the current request go to, None for the primary
+_current = ContextVar('shop_replica', default=None)
+
+_turn = count()
+_in_flight = {}
+_lock = threading.Lock()
+
+
+def get_setting(name):
+    return getattr(settings, 'REPLICAS', {}).get(name, DEFAULTS[name])
+
+
+def current():
+    return _current.get()
+
+
+def is_pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def choose(request):
+    """Replica alias for the reads of ``request``, or ``None`` for the primary."""
+    aliases = get_setting('ALIASES')
+    if not aliases or request.method not in SAFE_METHODS or is_pinned(request):
+        return None
+    with _lock:
+        # Starting from the next in turn, so that round robin also breaks the ties of least loaded
+        start = next(_turn)
+        ordered = [aliases[(start + index) % len(aliases)] for index in range(len(aliases))]
+        if get_setting('STRATEGY') == 'least_loaded':
+            return min(ordered, key=lambda alias: _in_flight.get(alias, 0))
+        return ordered[0]
+
+
+@contextmanager
+def reading_from(alias):
+    with _lock:
+        _in_flight[alias] = _in_flight.get(alias, 0) + 1
+    token = _current.set(alias)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+        with _lock:
+            _in_flight[alias] -= 1
+
+
+def load():
+    """Requests in progress per replica."""
+    with _lock:
+        return dict(_in_flight)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return current()
+
+    def db_for_write(self, model, **hints):
+        # Even for instances read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaReadMixin:
+
+    def dispatch(self, request, *args, **kwargs):
+        alias = choose(request)
+        if alias is None:
+            return super().dispatch(request, *args, **kwargs)
+        with reading_from(alias):
+            return super().dispatch(request, *args, **kwargs)
+
+
+def replicate(alias, source=DEFAULT_DB_ALIAS, lag=0):
+    """
+    Copy the SQLite database ``source`` over the replica ``alias`` with the
+    backup API. With ``lag``, the copy is a snapshot taken ``lag`` seconds
+    before it is published, like a replica applying changes late.
+    """
+    connections[source].ensure_connection()
+    connections[alias].ensure_connection()
+    snapshot = sqlite3.connect(':memory:')
+    try:
+        connections[source].connection.backup(snapshot)
+        time.sleep(lag)
+        snapshot.backup(connections[alias].connection)
+    finally:
+        snapshot.close()
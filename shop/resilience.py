@@ -0,0 +1,155 @@
+"""
+Circuit breaker and bulkhead guarding the calls to third-party APIs.
+
+``CircuitBreaker`` counts consecutive failures: past ``failure_threshold`` it
+opens and calls fail immediately with ``CircuitOpenError`` instead of waiting
+on a sick upstream. After ``recovery_timeout`` seconds a single probe call is
+let through (half-open): its success closes the circuit, its failure opens it
+again for another period. Only the probe decides: a slow call which started
+before the circuit opened and succeeds meanwhile leaves it as it is.
+
+``Bulkhead`` caps the number of concurrent calls of the process, so that a
+slow upstream can not hold every worker: callers wait at most ``timeout``
+seconds for a slot, then fail with ``BulkheadFullError``.
+
+Both errors are ``requests.RequestException`` subclasses, which every caller
+already handles as an unreachable upstream.
+"""
+import asyncio
+import threading
+import time
+
+import requests
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class UpstreamUnavailable(requests.RequestException):
+    pass
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class BulkheadFullError(UpstreamUnavailable):
+    pass
+
+
+class CircuitBreaker:
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def before_call(self):
+        """
+        Raise ``CircuitOpenError`` unless the call may go through. Return whether
+        the call is the probe of a half-open circuit, to pass to ``record_*()``.
+        """
+        with self.lock:
+            if self.state == OPEN and self.clock() - self.opened_at >= self.recovery_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probing:
+                # This call is the probe, the others keep failing fast until it returns
+                self.probing = True
+                return True
+            if self.state != CLOSED:
+                self.rejected += 1
+                raise CircuitOpenError(f'Circuit {self.name} is {self.state}')
+            return False
+
+    def record_success(self, probe=False):
+        with self.lock:
+            self.successes += 1
+            if probe:
+                self.probing = False
+                self.state = CLOSED
+            if self.state == CLOSED:
+                self.consecutive_failures = 0
+
+    def record_failure(self, probe=False):
+        with self.lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if probe:
+                self.probing = False
+            if probe or (self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+                self.opened += 1
+                self.state = OPEN
+                self.opened_at = self.clock()
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'successes': self.successes,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'opened': self.opened,
+            }
+
+
+class Bulkhead:
+
+    def __init__(self, max_concurrent, timeout=0):
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.semaphore = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def acquired(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def full(self):
+        with self.lock:
+            self.rejected += 1
+        return BulkheadFullError(f'More than {self.max_concurrent} concurrent upstream calls')
+
+    def acquire(self):
+        acquired = self.semaphore.acquire(timeout=self.timeout) if self.timeout else self.semaphore.acquire(False)
+        if not acquired:
+            raise self.full()
+        self.acquired()
+
+    async def aacquire(self, poll_interval=0.005):
+        # The semaphore is shared with the threads, so poll it instead of blocking the event loop
+        deadline = time.monotonic() + self.timeout
+        while not self.semaphore.acquire(False):
+            if time.monotonic() >= deadline:
+                raise self.full()
+            await asyncio.sleep(poll_interval)
+        self.acquired()
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+        self.semaphore.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def as_dict(self):
+        with self.lock:
+            return {'max_concurrent': self.max_concurrent, 'in_flight': self.in_flight, 'rejected': self.rejected}
@@ -0,0 +1,58 @@
+"""
+Full-text search over articles and products.
+
+On SQLite builds with FTS5, migration 0006 creates one external content FTS5
+table per model, kept in sync by triggers: every write path (``save()``,
+``update()``, ``bulk_create()``, raw deletes) updates the index in the same
+statement, and searches are a single ``MATCH`` on it. Other backends, or
+SQLite builds without FTS5, fall back on ``icontains`` lookups.
+
+Every word of the query must match, as a prefix, one of the indexed columns;
+accents and case are ignored.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+# Model label: (FTS5 table, indexed columns)
+FTS_TABLES = {
+    'shop.Article': ('shop_article_fts', ('name', 'description', 'product_name', 'category_name')),
+    'shop.Product': ('shop_product_fts', ('name', 'description')),
+}
+
+_available = {}
+
+
+def fts_available(connection, table):
+    key = (connection.alias, connection.settings_dict['NAME'], table)
+    if key not in _available:
+        _available[key] = connection.vendor == 'sqlite' and table in connection.introspection.table_names()
+    return _available[key]
+
+
+def terms(text):
+    return re.findall(r'\w+', text)
+
+
+def match_expression(words):
+    # Quoted, so that user input can not inject FTS5 operators
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search(queryset, text):
+    """Filter ``queryset`` on the rows matching every word of ``text``."""
+    words = terms(text)
+    if not words:
+        return queryset.none()
+    table, columns = FTS_TABLES[queryset.model._meta.label]
+    if fts_available(connections[queryset.db], table):
+        return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {table} WHERE {table} MATCH %s',
+                                             [match_expression(words)]))
+    for word in words:
+        condition = Q()
+        for column in columns:
+            condition |= Q(**{f'{column}__icontains': word})
+        queryset = queryset.filter(condition)
+    return queryset
@@ -0,0 +1,94 @@
+"""
+Deterministic generation of large synthetic catalogs.
+
+Rows are generated lazily, category by category, and written with
+``bulk_create`` in chunks of ``chunk_size`` rows, each chunk in its own
+transaction, so memory use does not grow with the catalog size. Primary keys
+are assigned up front so that products and articles can reference their
+parents without reading them back.
+"""
+import random
+import time
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Max
+
+from shop.cache import bump_version
+from shop.models import Category, CategorySnapshot, Product, Article, ProductRollup
+
+ARTICLE_NAMES = ['Unité', 'Lot de 2', 'Lot de 3', 'Lot de 5', '100g', '300g', '500g', '1kg', '2kg', '5kg']
+
+
+def truncate_catalog():
+    """Delete every article, product rollup, product, category snapshot and category with plain DELETE statements."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in (Article, ProductRollup, Product, CategorySnapshot, Category):
+            cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+            bump_version(model)
+
+
+class CatalogSeeder:
+
+    def __init__(self, categories, products_per, articles_per, seed=0, chunk_size=5000,
+                 active_ratio=0.8):
+        self.categories = categories
+        self.products_per = products_per
+        self.articles_per = articles_per
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.active_ratio = active_ratio
+
+    @property
+    def total(self):
+        products = self.categories * self.products_per
+        return self.categories + products + products * self.articles_per
+
+    def next_ids(self):
+        return [(model.objects.aggregate(last=Max('id'))['last'] or 0) + 1 for model in (Category, Product, Article)]
+
+    def generate(self):
+        rng = random.Random(self.seed)
+        category_id, product_id, article_id = self.next_ids()
+        for _ in range(self.categories):
+            yield Category(id=category_id, name=f'Category {category_id}',
+                           description=f'Category {category_id} description',
+                           active=rng.random() < self.active_ratio)
+            for _ in range(self.products_per):
+                yield Product(id=product_id, name=f'Product {product_id}',
+                              description=f'Product {product_id} description',
+                              active=rng.random() < self.active_ratio, category_id=category_id)
+                for _ in range(self.articles_per):
+                    yield Article(id=article_id, name=rng.choice(ARTICLE_NAMES),
+                                  description=f'Article {article_id} description',
+                                  active=rng.random() < self.active_ratio,
+                                  price=Decimal(rng.randrange(100, 10000)) / 100, product_id=product_id)
+                    article_id += 1
+                product_id += 1
+            category_id += 1
+
+    def write(self, chunk):
+        with transaction.atomic():
+            # Parents first, so that the foreign keys hold inside the chunk
+            for model in (Category, Product, Article):
+                rows = [row for row in chunk if type(row) is model]
+                if rows:
+                    model.objects.bulk_create(rows)
+
+    def run(self, progress=None):
+        """Write the catalog and return ``(rows, seconds)``; ``progress(rows, seconds)`` is called after each chunk."""
+        start = time.perf_counter()
+        written = 0
+        chunk = []
+        for row in self.generate():
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                self.write(chunk)
+                written += len(chunk)
+                chunk = []
+                if progress:
+                    progress(written, time.perf_counter() - start)
+        if chunk:
+            self.write(chunk)
+            written += len(chunk)
+        return written, time.perf_counter() - start
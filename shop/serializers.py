@@ -1,9 +1,135 @@
-from rest_framework.serializers import ModelSerializer, SerializerMethodField, ValidationError, CharField, IntegerField
+from django.db import IntegrityError, models, transaction
+from rest_framework.serializers import ModelSerializer, ListSerializer, SerializerMethodField, ValidationError, CharField, IntegerField, PrimaryKeyRelatedField
 
+from shop import stats
+from shop.ecoscore import resolve_many
 from shop.models import Category, Product, Article
 
 
-class ArticleSerializer(ModelSerializer):
+class InstrumentedListSerializer(ListSerializer):
+
+    @property
+    def data(self):
+        with stats.serializer_timer():
+            return super().data
+
+
+class InstrumentedModelSerializer(ModelSerializer):
+
+    @property
+    def data(self):
+        with stats.serializer_timer():
+            return super().data
+
+
+class SelectedFieldsMixin:
+    """Render only the fields kept by the ``selection`` of the context, see ``shop.sparse``."""
+    # Fields rendering a nested serializer, kept when the selection expands them
+    nested_fields = ()
+    # Model fields read by the fields which are not a plain source
+    field_columns = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.context.get('selection')
+        if selection is None:
+            return fields
+        return {name: field for name, field in fields.items()
+                if (selection.nested(name) is not None if name in self.nested_fields else selection.includes(name))}
+
+    def nested_context(self, name):
+        selection = self.context.get('selection')
+        return {'selection': None if selection is None else selection.nested(name)}
+
+
+def unique_name_context(model, rows):
+    """
+    Serializer context validating the names of a whole payload: the names
+    already taken in the table, looked up with one query, and the names
+    claimed by the previous rows of the payload.
+    """
+    names = {row['name'].strip() for row in rows if isinstance(row, dict) and isinstance(row.get('name'), str)}
+    return {
+        'taken_names': set(model.objects.filter(name__in=names).values_list('name', flat=True)),
+        'claimed_names': set(),
+    }
+
+
+class UniqueNameListSerializer(InstrumentedListSerializer):
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.context.update(unique_name_context(self.child.Meta.model, data))
+        return super().to_internal_value(data)
+
+
+class UniqueNameMixin:
+    """
+    ``name`` unique in the table. The check runs one query per row on its own,
+    none when ``unique_name_context`` preloaded the names of the payload; the
+    unique constraint of the table catches the writers racing the check.
+    """
+    unique_name_message = 'Name already exists'
+
+    def validate_name(self, value):
+        if self.instance is not None and value == self.instance.name:
+            return value
+        taken = self.context.get('taken_names')
+        if taken is None:
+            exists = self.Meta.model.objects.filter(name=value).exists()
+        else:
+            exists = value in taken
+        if exists:
+            raise ValidationError(self.unique_name_message)
+        claimed = self.context.get('claimed_names')
+        if claimed is not None:
+            if value in claimed:
+                raise ValidationError('Duplicate name in the payload')
+            claimed.add(value)
+        return value
+
+    def unique_write(self, write, *args):
+        try:
+            # In a savepoint, the surrounding transaction stays usable
+            with transaction.atomic():
+                return write(*args)
+        except IntegrityError:
+            raise ValidationError({'name': [self.unique_name_message]})
+
+    def create(self, validated_data):
+        return self.unique_write(super().create, validated_data)
+
+    def update(self, instance, validated_data):
+        return self.unique_write(super().update, instance, validated_data)
+
+
+class PreloadedPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """
+    Look related objects up in the ``{pk: object}`` dict found under
+    ``context_key`` in the serializer context, when a bulk request preloaded
+    them, instead of running one query per row.
+    """
+
+    def __init__(self, context_key, **kwargs):
+        self.context_key = context_key
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get(self.context_key)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return preloaded[int(data)]
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+
+class ArticleSerializer(SelectedFieldsMixin, InstrumentedModelSerializer):
+    product = PreloadedPrimaryKeyRelatedField('products', queryset=Product.objects.all())
     product_name = CharField(read_only=True, source='product.name')
     category = IntegerField(read_only=True, source='product.category.id')
     category_name = CharField(read_only=True, source='product.category.name')
@@ -11,6 +137,7 @@ class ArticleSerializer(ModelSerializer):
     class Meta:
         model = Article
         fields = ['id', 'date_created', 'date_updated', 'name', 'price', 'product', 'product_name', 'category', 'category_name', 'description', 'active']
+        list_serializer_class = InstrumentedListSerializer
 
     def validate_price(self, value):
         if float(value) < 1:
@@ -23,57 +150,84 @@ class ArticleSerializer(ModelSerializer):
         return value
 
 
-class ProductListSerializer(ModelSerializer):
+class DenormalizedArticleSerializer(ArticleSerializer):
+    """Same representation as ``ArticleSerializer``, read from the columns copied on the article."""
+    product_name = CharField(read_only=True)
+    category = IntegerField(read_only=True, source='category_id')
+    category_name = CharField(read_only=True)
+
+
+class EcoscoreListSerializer(UniqueNameListSerializer):
+
+    def to_representation(self, data):
+        # Resolve the ecoscores of the whole page at once instead of one product at a time
+        products = list(data.all() if isinstance(data, models.Manager) else data)
+        if 'ecoscore' in self.child.fields:
+            resolve_many(products)
+        return super().to_representation(products)
+
+
+class ProductListSerializer(UniqueNameMixin, SelectedFieldsMixin, InstrumentedModelSerializer):
+    unique_name_message = 'Product already exists'
+    field_columns = {'ecoscore': ('ecoscore_grade', 'ecoscore_fetched_at')}
+
     class Meta:
         model = Product
         fields = ['id', 'date_created', 'date_updated', 'name', 'description', 'ecoscore', 'active']
-
-    def validate_name(self, value):
-        if Product.objects.filter(name=value).exists():
-            raise ValidationError('Product already exists')
-        return value
+        list_serializer_class = EcoscoreListSerializer
 
 
-class ProductDetailSerializer(ModelSerializer):
+class ProductDetailSerializer(SelectedFieldsMixin, InstrumentedModelSerializer):
     articles = SerializerMethodField()
     category_name = CharField(read_only=True, source='category.name')
+    nested_fields = ('articles',)
 
     class Meta:
         model = Product
         fields = ['id', 'date_created', 'date_updated', 'name', 'category', 'category_name', 'description', 'active', 'articles']
+        list_serializer_class = InstrumentedListSerializer
 
     def get_articles(self, instance):
-        queryset = instance.articles.filter(active=True)
-        serializer = ArticleSerializer(queryset, many=True)
+        # Use the articles prefetched by ProductQuerySet.with_active_articles() when available
+        queryset = getattr(instance, 'active_articles', None)
+        if queryset is None:
+            queryset = instance.articles.filter(active=True)
+        serializer = ArticleSerializer(queryset, many=True, context=self.nested_context('articles'))
 
         return serializer.data
 
 
-class CategoryListSerializer(ModelSerializer):
+class CategoryListSerializer(UniqueNameMixin, SelectedFieldsMixin, InstrumentedModelSerializer):
+    unique_name_message = 'Category already exists'
+
     class Meta:
         model = Category
         fields = ['id', 'date_created', 'date_updated', 'name', 'description', 'active']
-
-    def validate_name(self, value):
-        if Category.objects.filter(name=value).exists():
-            raise ValidationError('Category already exists')
-        return value
+        list_serializer_class = UniqueNameListSerializer
 
     def validate(self, data):
-        if data['name'] not in data['description']:
+        # Partial updates fall back on the current values
+        name = data.get('name', getattr(self.instance, 'name', ''))
+        description = data.get('description', getattr(self.instance, 'description', ''))
+        if name not in description:
             raise ValidationError('Name must be in description')
         return data
 
 
-class CategoryDetailSerializer(ModelSerializer):
+class CategoryDetailSerializer(SelectedFieldsMixin, InstrumentedModelSerializer):
     products = SerializerMethodField()
+    nested_fields = ('products',)
 
     class Meta:
         model = Category
         fields = ['id', 'date_created', 'date_updated', 'name', 'description', 'active', 'products']
+        list_serializer_class = InstrumentedListSerializer
 
     def get_products(self, instance):
-        queryset = instance.products.filter(active=True)
-        serializer = ProductDetailSerializer(queryset, many=True)
+        # Use the products prefetched by CategoryQuerySet.with_active_tree() when available
+        queryset = getattr(instance, 'active_products', None)
+        if queryset is None:
+            queryset = instance.products.filter(active=True)
+        serializer = ProductDetailSerializer(queryset, many=True, context=self.nested_context('products'))
 
         return serializer.data
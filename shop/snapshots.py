@@ -0,0 +1,137 @@
+"""
+Pre-rendered category details.
+
+With ``CATEGORY_SNAPSHOTS['ENABLED']``, ``CategoryViewSet.retrieve`` reads
+the JSON of a category, its active products and their active articles from
+``CategorySnapshot``, one lookup by primary key, instead of loading and
+serializing the tree. A missing or stale snapshot falls back to the live
+serialization.
+
+Every write to a category, product or article flags the snapshot of the
+affected categories as stale in the same transaction, then wakes the
+background queue of ``shop.workqueue``: it waits ``DELAY`` seconds so that
+a burst of writes is rebuilt once, then renders the stale snapshots
+``BATCH_SIZE`` categories at a time. A rebuild only publishes if no write
+flagged the snapshot again meanwhile. Without ``BACKGROUND``, the rebuild
+runs on commit in the writing thread. Snapshots are created on the first
+read of their category, or all at once by ``manage.py refresh_snapshots``.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from shop.models import Category, CategorySnapshot, snapshot_queue, snapshots_enabled
+from shop.renderers import FastJSONRenderer
+from shop.serializers import CategoryDetailSerializer
+
+DEFAULTS = {
+    'ENABLED': False,
+    'BACKGROUND': True,
+    # Seconds the queue waits for the rest of a burst of writes
+    'DELAY': 0.1,
+    'BATCH_SIZE': 100,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'CATEGORY_SNAPSHOTS', {}).get(name, DEFAULTS[name])
+
+
+def configure_queue(**kwargs):
+    snapshot_queue.handler = rebuild
+    snapshot_queue.background = get_setting('BACKGROUND')
+    snapshot_queue.delay = get_setting('DELAY')
+
+
+def render(category):
+    return FastJSONRenderer().render(CategoryDetailSerializer(category).data).decode()
+
+
+def rebuild(categories=()):
+    """
+    Create the missing snapshots of ``categories``, then rebuild every stale
+    snapshot. Return the number of published snapshots.
+    """
+    if categories:
+        CategorySnapshot.objects.create_missing(categories)
+    versions = dict(CategorySnapshot.objects.filter(stale=True).values_list('category_id', 'version'))
+    pks = sorted(versions)
+    published = 0
+    for start in range(0, len(pks), get_setting('BATCH_SIZE')):
+        batch = (Category.objects.filter(pk__in=pks[start:start + get_setting('BATCH_SIZE')]).with_active_tree()
+                 .annotate(products_updated=Max('products__date_updated'),
+                           articles_updated=Max('products__articles__date_updated')))
+        for category in batch:
+            document = render(category)
+            last_modified = max(date for date in (category.date_updated, category.products_updated,
+                                                  category.articles_updated) if date is not None)
+            published += CategorySnapshot.objects.publish(
+                category, versions[category.pk], document, hashlib.md5(document.encode()).hexdigest(),
+                last_modified,
+            )
+    return published
+
+
+def stale_category_snapshot(sender, instance, created, **kwargs):
+    if not snapshots_enabled():
+        return
+    if created:
+        pk = instance.pk
+        transaction.on_commit(lambda: snapshot_queue.put([pk]))
+    else:
+        CategorySnapshot.objects.filter(category=instance.pk).mark_stale()
+
+
+def stale_product_snapshots(sender, instance, **kwargs):
+    if snapshots_enabled():
+        categories = {instance.category_id, getattr(instance, '_previous_category_id', None)} - {None}
+        CategorySnapshot.objects.filter(category__in=categories).mark_stale()
+
+
+def stale_article_snapshots(sender, instance, **kwargs):
+    if snapshots_enabled():
+        products = {instance.product_id, getattr(instance, '_previous_product_id', None)} - {None}
+        CategorySnapshot.objects.filter(category__products__in=products).mark_stale()
+
+
+class CategorySnapshotMixin:
+
+    def retrieve(self, request, *args, **kwargs):
+        response = self.snapshot_response(request) if snapshots_enabled() else None
+        if response is None:
+            return super().retrieve(request, *args, **kwargs)
+        return response
+
+    def snapshot_response(self, request):
+        renderer = request.accepted_renderer
+        # Snapshots hold the whole compact JSON, not the browsable API, an indented or a sparse variant
+        if (not isinstance(renderer, FastJSONRenderer) or request.accepted_media_type != renderer.media_type
+                or self.selection is not None):
+            return None
+        try:
+            pk = int(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValueError:
+            return None
+        snapshot = CategorySnapshot.objects.filter(pk=pk).values('document', 'etag', 'last_modified', 'active',
+                                                                 'stale').first()
+        if snapshot is None:
+            snapshot_queue.put([pk])
+            return None
+        if snapshot['stale'] or (not snapshot['active'] and request.GET.get('show_inactive') != 'true'):
+            return None
+
+        key = repr((snapshot['etag'], request.get_full_path(), request.accepted_media_type))
+        etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+        last_modified = int(snapshot['last_modified'].timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = HttpResponse(snapshot['document'], content_type=renderer.media_type)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ['Accept'])
+        return response
@@ -0,0 +1,125 @@
+"""
+Sparse fieldsets of the public viewsets: ``?fields=``, ``?depth=`` and ``?expand=``.
+
+``fields`` lists the fields to render, comma separated, those of the nested
+objects by their dotted path: ``?fields=id,name,products.name,products.articles.price``.
+A relation listed without nested fields keeps all of them, and ``id`` is
+always rendered. ``depth`` caps the levels of nested objects (``0``: none,
+``1``: the products of a category without their articles...), ``expand``
+names the nested relations to render instead: ``?expand=products``. A
+relation listed in ``fields`` is rendered whatever ``depth`` and ``expand``.
+Without any of them, the representations are unchanged.
+
+The serializers drop the other fields (``SelectedFieldsMixin``), and the
+viewsets only read the columns the remaining fields need, with ``only()``,
+and only prefetch the relations which are rendered (``sparse()``).
+"""
+from rest_framework.exceptions import ValidationError
+
+PARAMS = ('fields', 'depth', 'expand')
+
+
+def parse_paths(paths):
+    """``['a', 'b.c', 'b.d']`` to ``{'a': [], 'b': ['c', 'd']}``, ``None`` when empty."""
+    fields = {}
+    for path in paths:
+        name, _, rest = path.strip().partition('.')
+        if name:
+            fields.setdefault(name, [])
+            if rest:
+                fields[name].append(rest)
+    return fields or None
+
+
+class Selection:
+    """Fields of one level of a representation, and of the relations it nests."""
+
+    def __init__(self, fields=None, depth=None, expand=None, path=''):
+        # None for every field, else {name: dotted paths of its nested fields}
+        self.fields = fields
+        self.depth = depth
+        self.expand = expand
+        self.path = path
+
+    @classmethod
+    def from_request(cls, request):
+        """The selection of the query parameters of ``request``, ``None`` without any."""
+        params = request.query_params
+        if not any(params.get(param) for param in PARAMS):
+            return None
+        depth = params.get('depth') or None
+        if depth is not None:
+            try:
+                depth = int(depth)
+            except ValueError:
+                depth = -1
+            if depth < 0:
+                raise ValidationError({'depth': ['A valid non-negative integer is required.']})
+        expand = {path.strip() for path in params.get('expand', '').split(',') if path.strip()} or None
+        return cls(parse_paths(params.get('fields', '').split(',')), depth, expand)
+
+    def includes(self, name):
+        return name == 'id' or self.fields is None or name in self.fields
+
+    def nested(self, name):
+        """Selection of the nested relation ``name``, or ``None`` when it is not rendered."""
+        path = f'{self.path}.{name}' if self.path else name
+        if self.fields is not None:
+            if name not in self.fields:
+                return None
+        elif self.expand is not None:
+            if not any(expanded == path or expanded.startswith(f'{path}.') for expanded in self.expand):
+                return None
+        elif self.depth is not None and self.depth < 1:
+            return None
+        fields = parse_paths(self.fields[name]) if self.fields is not None else None
+        depth = None if self.depth is None else max(self.depth - 1, 0)
+        return Selection(fields, depth, self.expand, path)
+
+
+def columns(serializer_class, selection):
+    """Model fields read by the fields of ``serializer_class`` kept by ``selection``, as ``only()`` arguments."""
+    serializer = serializer_class(context={'selection': selection})
+    names = []
+    for name, field in serializer.fields.items():
+        if name in serializer.nested_fields:
+            continue
+        if name in serializer.field_columns:
+            names.extend(serializer.field_columns[name])
+        elif field.source != '*':
+            names.append(field.source.replace('.', '__'))
+    return names
+
+
+def sparse(queryset, serializer_class, selection, keep=(), related=True):
+    """
+    Narrow ``queryset`` to the columns ``serializer_class`` renders under
+    ``selection``, plus ``keep``, joining only the relations they go through.
+    Without ``related`` the columns of related models are left out, for the
+    querysets prefetched under an object the rows already know.
+    """
+    names = [*columns(serializer_class, selection), *keep]
+    if not related:
+        names = [name for name in names if '__' not in name]
+    relations = set()
+    for name in names:
+        parts = name.split('__')
+        relations.update('__'.join(parts[:index]) for index in range(1, len(parts)))
+    queryset = queryset.select_related(None)
+    if relations:
+        queryset = queryset.select_related(*relations)
+    return queryset.only(*names, *relations)
+
+
+class SparseFieldsMixin:
+
+    @property
+    def selection(self):
+        if not hasattr(self, '_selection'):
+            self._selection = Selection.from_request(self.request)
+        return self._selection
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['selection'] = self.selection
+        return context
@@ -0,0 +1,202 @@
+"""
+In-process, per-route request statistics.
+
+``shop.middleware.StatsMiddleware`` records the latency, SQL query count,
+SQL time and serializer time of every request in ``registry``. Latencies go
+into fixed log-scale buckets so that recording is a couple of increments
+under a per-route lock, and percentiles are read from the buckets.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds of the latency buckets, in seconds: 0.5ms to ~33s
+BUCKETS = tuple(0.0005 * 2 ** index for index in range(17))
+
+# A context variable rather than a thread local: under ASGI a request runs on the
+# event loop and its queries in the threads of sync_to_async, which copy the context
+_current = ContextVar('shop_request_metrics', default=None)
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.sql_queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def sql_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_queries += 1
+            self.sql_time += time.perf_counter() - start
+
+
+def start_request():
+    metrics = RequestMetrics()
+    _current.set(metrics)
+    return metrics
+
+
+def end_request():
+    _current.set(None)
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics.sql_wrapper(execute, sql, params, many, context)
+
+
+def install_sql_wrapper(sender, connection, **kwargs):
+    """``connection_created`` receiver counting the queries of every connection, whatever its thread."""
+    if sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_wrapper)
+
+
+@contextmanager
+def serializer_timer():
+    """Add the time spent in the block to the current request, ignoring nested serializers."""
+    metrics = _current.get()
+    if metrics is None or metrics.serializer_depth:
+        yield
+        return
+    metrics.serializer_depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_time += time.perf_counter() - start
+        metrics.serializer_depth -= 1
+
+
+class RouteStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.latency_sum = 0.0
+        self.sql_queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+
+    def record(self, duration, metrics):
+        index = bisect_left(BUCKETS, duration)
+        with self.lock:
+            self.buckets[index] += 1
+            self.count += 1
+            self.latency_sum += duration
+            self.sql_queries += metrics.sql_queries
+            self.sql_time += metrics.sql_time
+            self.serializer_time += metrics.serializer_time
+
+    def percentile(self, quantile):
+        rank = quantile * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return BUCKETS[min(index, len(BUCKETS) - 1)]
+        return None
+
+    def as_dict(self):
+        with self.lock:
+            count = self.count or 1
+            return {
+                'count': self.count,
+                'latency': {
+                    'mean': self.latency_sum / count,
+                    'p50': self.percentile(0.50),
+                    'p95': self.percentile(0.95),
+                    'p99': self.percentile(0.99),
+                },
+                'sql_queries': self.sql_queries,
+                'sql_queries_per_request': self.sql_queries / count,
+                'sql_time': self.sql_time,
+                'serializer_time': self.serializer_time,
+            }
+
+
+class StatsRegistry:
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, duration, metrics):
+        stats = self._routes.get(route)
+        if stats is None:
+            with self._lock:
+                stats = self._routes.setdefault(route, RouteStats())
+        stats.record(duration, metrics)
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+
+    def as_dict(self):
+        return {route: stats.as_dict() for route, stats in sorted(self._routes.items())}
+
+    def as_prometheus(self):
+        lines = [
+            '# HELP shop_request_duration_seconds Request latency.',
+            '# TYPE shop_request_duration_seconds histogram',
+        ]
+        counters = []
+        for route, stats in sorted(self._routes.items()):
+            with stats.lock:
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), stats.buckets):
+                    cumulative += count
+                    lines.append(f'shop_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {cumulative}')
+                lines.append(f'shop_request_duration_seconds_sum{{route="{route}"}} {stats.latency_sum}')
+                lines.append(f'shop_request_duration_seconds_count{{route="{route}"}} {stats.count}')
+                counters.append((route, stats.sql_queries, stats.sql_time, stats.serializer_time))
+        for name, help_text, position in (('shop_sql_queries_total', 'SQL queries run.', 1),
+                                          ('shop_sql_duration_seconds_total', 'Time spent in SQL.', 2),
+                                          ('shop_serializer_duration_seconds_total', 'Time spent serializing.', 3)):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            lines.extend(f'{name}{{route="{values[0]}"}} {values[position]}' for values in counters)
+        return '\n'.join(lines) + '\n'
+
+
+# Gauge values of the circuit states
+CIRCUIT_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+def upstream_as_prometheus(values):
+    """Prometheus text of ``shop.upstream.resilience_stats()``."""
+    lines = [
+        '# HELP shop_upstream_circuit_state Circuit of the upstream host: 0 closed, 1 half open, 2 open.',
+        '# TYPE shop_upstream_circuit_state gauge',
+    ]
+    breakers = values['breakers'].items()
+    lines.extend(f'shop_upstream_circuit_state{{host="{host}"}} {CIRCUIT_STATES[breaker["state"]]}'
+                 for host, breaker in breakers)
+    lines.append('# HELP shop_upstream_calls_total Upstream calls per outcome.')
+    lines.append('# TYPE shop_upstream_calls_total counter')
+    for host, breaker in breakers:
+        for outcome in ('successes', 'failures', 'rejected'):
+            lines.append(f'shop_upstream_calls_total{{host="{host}",outcome="{outcome}"}} {breaker[outcome]}')
+    bulkhead = values['bulkhead']
+    if bulkhead is not None:
+        lines += [
+            '# HELP shop_upstream_in_flight Upstream calls in progress.',
+            '# TYPE shop_upstream_in_flight gauge',
+            f'shop_upstream_in_flight {bulkhead["in_flight"]}',
+            '# HELP shop_upstream_bulkhead_rejected_total Upstream calls rejected by the bulkhead.',
+            '# TYPE shop_upstream_bulkhead_rejected_total counter',
+            f'shop_upstream_bulkhead_rejected_total {bulkhead["rejected"]}',
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+registry = StatsRegistry()
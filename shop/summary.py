@@ -0,0 +1,106 @@
+"""
+Article counts, active ratio and active prices per product and per category.
+
+Each summary page is computed by the database, with one grouped query over
+the filtered products or categories: ``COUNT`` of the articles and of the
+active ones, ``MIN`` / ``MAX`` / ``SUM`` of the active prices, the average
+being derived from the sum. Nothing is loaded but the rows of the page.
+
+With ``CATALOG_ROLLUP`` enabled the aggregates are read from ``ProductRollup``
+instead, one precomputed row per product, so that the query no longer scans
+the articles: every write to the articles flags the rollups of their products
+as stale and those are recomputed, in a single UPDATE, on commit. Run
+``manage.py refresh_rollups --full`` after enabling it on an existing catalog.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, Max, Min, Q, Sum
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from shop.models import ProductRollup, rollup_enabled
+
+CENT = Decimal('0.01')
+PRICE_SUM = DecimalField(max_digits=14, decimal_places=2)
+
+
+def live_summary(queryset, articles):
+    """Annotate ``queryset`` with the aggregates of the articles reached through ``articles``."""
+    active = Q(**{f'{articles}__active': True})
+    return queryset.annotate(
+        total_articles=Count(articles),
+        active_articles=Count(articles, filter=active),
+        min_price=Min(f'{articles}__price', filter=active),
+        max_price=Max(f'{articles}__price', filter=active),
+        price_sum=Sum(f'{articles}__price', filter=active, output_field=PRICE_SUM),
+    )
+
+
+def rollup_summary(queryset, rollups):
+    """Same annotations as ``live_summary``, from the product rollups reached through ``rollups``."""
+    return queryset.annotate(
+        total_articles=Sum(f'{rollups}__articles'),
+        active_articles=Sum(f'{rollups}__active_articles'),
+        min_price=Min(f'{rollups}__price_min'),
+        max_price=Max(f'{rollups}__price_max'),
+        price_sum=Sum(f'{rollups}__price_sum', output_field=PRICE_SUM),
+    )
+
+
+def create_product_rollup(sender, instance, created, **kwargs):
+    if created and rollup_enabled():
+        ProductRollup.objects.create_for([instance])
+
+
+def stale_article_rollups(sender, instance, **kwargs):
+    if not rollup_enabled():
+        return
+    products = {instance.product_id, getattr(instance, '_previous_product_id', None)} - {None}
+    ProductRollup.objects.filter(product__in=products).mark_stale()
+
+
+def format_price(value):
+    return None if value is None else '{:f}'.format(Decimal(value).quantize(CENT))
+
+
+def summary_row(values):
+    articles = values['total_articles'] or 0
+    active = values['active_articles'] or 0
+    return {
+        'id': values['id'],
+        'name': values['name'],
+        'articles': articles,
+        'active_articles': active,
+        'active_ratio': round(active / articles, 4) if articles else None,
+        'min_price': format_price(values['min_price']),
+        'max_price': format_price(values['max_price']),
+        'avg_price': format_price(Decimal(values['price_sum']) / active) if active else None,
+    }
+
+
+class SummaryMixin:
+    # Paths from the viewset's model to its articles and to the product rollups
+    summary_articles = 'articles'
+    summary_rollups = 'rollup'
+
+    def get_summary_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if not queryset.ordered:
+            queryset = queryset.order_by('pk')
+        if rollup_enabled():
+            queryset = rollup_summary(queryset, self.summary_rollups)
+        else:
+            queryset = live_summary(queryset, self.summary_articles)
+        return queryset.values('id', 'name', 'total_articles', 'active_articles', 'min_price', 'max_price',
+                               'price_sum')
+
+    def summary_response(self, request, *args, **kwargs):
+        queryset = self.get_summary_queryset()
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response([summary_row(values) for values in page])
+        return Response([summary_row(values) for values in queryset])
+
+    @action(detail=False)
+    def summary(self, request):
+        return self.cached_response(self.summary_response, request)
@@ -1,14 +1,63 @@
+import asyncio
+import csv
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 from unittest import mock
 
-from django.urls import reverse_lazy
-from rest_framework.test import APITestCase
+import brotli
+import msgpack
+import requests
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.utils import load_backend
+from django.db.models import Value
+from django.db.models.functions import Concat
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase, APITransactionTestCase
+from rest_framework.viewsets import ReadOnlyModelViewSet
 
-from shop.models import Category, Product, Article
-from shop.mock import mock_openfoodfact_success, ECOSCORE_GRADE
+from shop import cache, compression, ecoscore, renderers, replicas, stats, upstream
+from shop.bench import FakeUpstream, Scenario, compare, measure
+from shop.compression import negotiate
+from shop.models import Category, CategorySnapshot, Product, Article, ProductRollup
+from shop.seeding import CatalogSeeder
+from shop.serializers import CategoryListSerializer, ProductListSerializer, ArticleSerializer
+from shop.pagination import ShopPagination
+from shop.parsers import MessagePackParser
+from shop.renderers import MessagePackRenderer
+from shop.resilience import BulkheadFullError, CircuitBreaker, CircuitOpenError
+from shop.rows import DENORMALIZED_ARTICLE_ROW, RowListMixin
+from shop.views import ArticleViewSet
+from shop.workqueue import CoalescingQueue
+from shop.mock import mock_openfoodfact_success, mock_openfoodfact_success_async, mock_openfoodfact_not_found, \
+    ECOSCORE_GRADE
 
 
 class ShopAPITestCase(APITestCase):
 
+    def setUp(self):
+        ecoscore.lru.clear()
+        cache.get_cache().clear()
+
     @staticmethod
     def format_datetime(value):
         return value.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
@@ -131,3 +180,1608 @@ class TestArticles(ShopAPITestCase):
         response = self.client.post(self.url, data={'name': 'Nouvel article', 'product': '1', 'price': '2.50'})
         self.assertEqual(response.status_code, 405)
         self.assertFalse(Article.objects.exists())
+
+
+@override_settings(ECOSCORE={'TTL': 3600, 'NEGATIVE_TTL': 60, 'STALE_TTL': 600, 'BACKGROUND_REFRESH': False})
+class TestEcoscoreCache(ShopAPITestCase):
+    url = reverse_lazy('product-list')
+
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Fruits', active=True)
+        self.products = [Product.objects.create(name=name, active=True, category=category)
+                         for name in ('Pomme', 'Poire', 'Kiwi')]
+
+    def age_cache(self, seconds):
+        ecoscore.lru.clear()
+        Product.objects.update(ecoscore_fetched_at=timezone.now() - timedelta(seconds=seconds))
+        # The cached responses, which ecoscore writes keep, expire well before the ecoscores
+        cache.get_cache().clear()
+
+    def test_list_is_served_from_cache(self):
+        with mock.patch.object(Product, 'call_external_api', autospec=True,
+                               side_effect=mock_openfoodfact_success) as api:
+            self.client.get(self.url)
+            self.assertEqual(api.call_count, len(self.products))
+            response = self.client.get(self.url)
+            self.assertEqual(api.call_count, len(self.products))
+        self.assertEqual([ECOSCORE_GRADE] * 3, [product['ecoscore'] for product in response.json()['results']])
+
+    def test_stored_grade_survives_lru_eviction(self):
+        with mock.patch.object(Product, 'call_external_api', autospec=True,
+                               side_effect=mock_openfoodfact_success) as api:
+            self.client.get(self.url)
+            ecoscore.lru.clear()
+            self.client.get(self.url)
+        self.assertEqual(api.call_count, len(self.products))
+        self.assertEqual(Product.objects.filter(ecoscore_grade=ECOSCORE_GRADE).count(), len(self.products))
+
+    def test_stale_value_is_served_while_revalidating(self):
+        Product.objects.update(ecoscore_grade='a')
+        self.age_cache(3600 + 10)
+        with mock.patch.object(Product, 'call_external_api', autospec=True,
+                               side_effect=mock_openfoodfact_success) as api:
+            response = self.client.get(self.url)
+        self.assertEqual(api.call_count, len(self.products))
+        self.assertEqual(['a'] * 3, [product['ecoscore'] for product in response.json()['results']])
+        self.assertEqual(Product.objects.filter(ecoscore_grade=ECOSCORE_GRADE).count(), len(self.products))
+
+    def test_expired_value_is_refetched(self):
+        Product.objects.update(ecoscore_grade='a')
+        self.age_cache(3600 + 600 + 10)
+        with mock.patch.object(Product, 'call_external_api', autospec=True,
+                               side_effect=mock_openfoodfact_success):
+            response = self.client.get(self.url)
+        self.assertEqual([ECOSCORE_GRADE] * 3, [product['ecoscore'] for product in response.json()['results']])
+
+    def test_not_found_is_cached(self):
+        with mock.patch.object(Product, 'call_external_api', autospec=True,
+                               side_effect=mock_openfoodfact_not_found) as api:
+            self.client.get(self.url)
+            response = self.client.get(self.url)
+            self.assertEqual(api.call_count, len(self.products))
+            self.assertEqual([None] * 3, [product['ecoscore'] for product in response.json()['results']])
+            self.age_cache(60 + 600 + 10)
+            self.client.get(self.url)
+            self.assertEqual(api.call_count, 2 * len(self.products))
+
+
+@override_settings(ECOSCORE={'BATCH_WORKERS': 6, 'BATCH_DEADLINE': 0.5, 'BACKGROUND_REFRESH': False})
+class TestEcoscoreBatch(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Fruits', active=True)
+        self.products = [Product.objects.create(name=f'Fruit {index}', active=True, category=category)
+                         for index in range(6)]
+
+    def upstream(self, barrier=None, release=None, fail_for=()):
+        """Mocked call_external_api recording the calls in flight, held by ``barrier`` and ``release``."""
+        self.in_flight = self.peak = 0
+        lock = threading.Lock()
+
+        def call_external_api(product, method, url):
+            if product.name in fail_for:
+                raise ConnectionError('upstream down')
+            with lock:
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+            try:
+                if barrier is not None:
+                    barrier.wait()
+                if release is not None:
+                    release.wait(5)
+                return mock_openfoodfact_success(product, method, url)
+            finally:
+                with lock:
+                    self.in_flight -= 1
+        return call_external_api
+
+    def test_page_misses_are_fetched_concurrently(self):
+        # Only answers once the 6 calls are in flight together, sequential calls break it and degrade to null
+        barrier = threading.Barrier(6, timeout=0.4)
+        with mock.patch('shop.models.Product.call_external_api', self.upstream(barrier=barrier)):
+            data = ProductListSerializer(self.products, many=True).data
+        self.assertEqual(self.peak, 6)
+        self.assertEqual([ECOSCORE_GRADE] * 6, [product['ecoscore'] for product in data])
+        self.assertEqual(Product.objects.filter(ecoscore_grade=ECOSCORE_GRADE).count(), 6)
+
+    def test_failures_and_late_answers_degrade_to_null(self):
+        Product.objects.filter(name='Fruit 1').update(name='Broken')
+        products = list(Product.objects.order_by('id'))
+        with mock.patch('shop.models.Product.call_external_api', self.upstream(fail_for=['Broken'])):
+            data = ProductListSerializer(products, many=True).data
+        self.assertEqual([ECOSCORE_GRADE, None] + [ECOSCORE_GRADE] * 4, [product['ecoscore'] for product in data])
+
+        ecoscore.lru.clear()
+        Product.objects.update(ecoscore_grade=None, ecoscore_fetched_at=None)
+        release = threading.Event()
+        try:
+            with mock.patch('shop.models.Product.call_external_api', self.upstream(release=release)):
+                data = ProductListSerializer(list(Product.objects.all()), many=True).data
+                # Rendered past the deadline while the calls are still waiting on the upstream
+                self.assertEqual(self.in_flight, 6)
+        finally:
+            release.set()
+        self.assertEqual([None] * 6, [product['ecoscore'] for product in data])
+
+
+class TestQueryCount(ShopAPITestCase):
+
+    def create_tree(self, products, articles_per_product):
+        # Names are unique, trees are created several times per test
+        category = Category.objects.create(name=f'Fruits {Category.objects.count()}', active=True)
+        for product_index in range(products):
+            product = Product.objects.create(name=f'{category} {product_index}', active=True, category=category)
+            Product.objects.create(name=f'Old {category} {product_index}', active=False, category=category)
+            for article_index in range(articles_per_product):
+                Article.objects.create(name=f'Lot {article_index}', active=True, product=product, price='2.50')
+                Article.objects.create(name=f'Old lot {article_index}', active=False, product=product, price='2.50')
+        return category
+
+    def test_category_detail(self):
+        for products, articles in ((1, 1), (3, 2), (6, 5)):
+            category = self.create_tree(products, articles)
+            # validators, category, its active products, their active articles
+            with self.assertNumQueries(4):
+                response = self.client.get(reverse('category-detail', kwargs={'pk': category.pk}))
+            self.assertEqual(len(response.json()['products']), products)
+            self.assertEqual(len(response.json()['products'][0]['articles']), articles)
+            self.assertEqual(response.json()['products'][0]['articles'][0]['category_name'], category.name)
+
+    def test_admin_category_detail(self):
+        for products, articles in ((1, 1), (4, 3)):
+            category = self.create_tree(products, articles)
+            with self.assertNumQueries(3):
+                self.client.get(reverse('admin-category-detail', kwargs={'pk': category.pk}))
+
+    def test_product_detail(self):
+        for articles in (1, 4, 8):
+            product = self.create_tree(1, articles).products.get(active=True)
+            # validators, product joined with its category, its active articles
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('product-detail', kwargs={'pk': product.pk}))
+            self.assertEqual(len(response.json()['articles']), articles)
+
+    def test_article_list(self):
+        for products in (1, 3):
+            self.create_tree(products, 2)
+            # validators with the count, page read from the denormalized columns
+            with self.assertNumQueries(2):
+                self.client.get(reverse('article-list'))
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class TestStats(ShopAPITestCase):
+    url = reverse_lazy('admin-stats-list')
+
+    def setUp(self):
+        super().setUp()
+        stats.registry.reset()
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@oc.drf', 'password')
+
+    def test_records_per_route_stats(self):
+        category = Category.objects.create(name='Fruits', active=True)
+        for _ in range(3):
+            self.client.get(reverse('category-list'))
+        self.client.get(reverse('category-detail', kwargs={'pk': category.pk}))
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        route = response.json()['category-list']
+        self.assertEqual(route['count'], 3)
+        self.assertEqual(route['sql_queries_per_request'], 2)
+        self.assertGreater(route['serializer_time'], 0)
+        self.assertLessEqual(route['latency']['p50'], route['latency']['p99'])
+        # validators, category and its active products, no article query for an empty category
+        self.assertEqual(response.json()['category-detail']['sql_queries'], 3)
+
+    def test_prometheus_export_and_reset(self):
+        Category.objects.create(name='Fruits', active=True)
+        self.client.get(reverse('category-list'))
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(self.url, {'format': 'prometheus'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('shop_request_duration_seconds_count{route="category-list"} 1', response.content.decode())
+        self.assertIn('shop_sql_queries_total{route="category-list"} 2', response.content.decode())
+        self.client.post(reverse('admin-stats-reset'))
+        self.assertNotIn('category-list', self.client.get(self.url).json())
+
+    def test_admin_only(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class TestCursorPagination(ShopAPITestCase):
+    url = reverse_lazy('article-list')
+
+    def walk(self, params):
+        ids = []
+        response = self.client.get(self.url, {'pagination': 'cursor', **params})
+        while True:
+            self.assertNotIn('count', response.json())
+            ids += [article['id'] for article in response.json()['results']]
+            if not response.json()['next']:
+                return ids
+            response = self.client.get(response.json()['next'])
+
+    def test_walks_filtered_articles_in_id_order(self):
+        category = Category.objects.create(name='Fruits', active=True)
+        apple = Product.objects.create(name='Pomme', active=True, category=category)
+        pear = Product.objects.create(name='Poire', active=True, category=category)
+        expected = []
+        for index in range(15):
+            expected.append(Article.objects.create(name=f'{index}kg', active=True, product=apple, price='2.50').pk)
+            Article.objects.create(name=f'{index}kg', active=False, product=apple, price='2.50')
+            Article.objects.create(name=f'{index}kg', active=True, product=pear, price='2.50')
+        self.assertEqual(self.walk({'product_id': apple.pk}), expected)
+        self.assertEqual(len(self.walk({'product_id': apple.pk, 'show_inactive': 'true'})), 30)
+        self.assertEqual(len(self.walk({'product_id': apple.pk, 'limit': 4})), 15)
+
+    def test_ties_broken_by_id(self):
+        category = Category.objects.create(name='Fruits', active=True)
+        product = Product.objects.create(name='Pomme', active=True, category=category)
+        for index in range(15):
+            Article.objects.create(name=f'{index}kg', active=True, product=product, price=('1.50', '2.50')[index % 2])
+        for ordering in ('price', '-price'):
+            expected = list(Article.objects.order_by(ordering, 'id').values_list('id', flat=True))
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.walk({'ordering': ordering, 'limit': 4}), expected)
+            self.assertIn('"price"' + (' ASC' if ordering == 'price' else ' DESC') + ', "shop_article"."id" ASC',
+                          queries[-1]['sql'])
+
+    def test_skips_count(self):
+        category = Category.objects.create(name='Fruits', active=True)
+        for index in range(10):
+            Product.objects.create(name=f'Fruit {index}', active=True, category=category)
+        Product.objects.update(ecoscore_grade=ECOSCORE_GRADE, ecoscore_fetched_at=timezone.now())
+        # The page only, no COUNT(*) for the pagination nor for validators
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('category-list'), {'pagination': 'cursor'})
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('COUNT(', queries[0]['sql'])
+        self.assertFalse(response.has_header('ETag'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product-list'), {'pagination': 'cursor', 'category_id': category.pk,
+                                                                 'limit': 5})
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('COUNT(', queries[0]['sql'])
+
+
+class TestSeeding(ShopAPITestCase):
+
+    def snapshot(self):
+        return [list(model.objects.order_by('id').values_list('id', 'name', 'active'))
+                for model in (Category, Product, Article)] + [list(Article.objects.values_list('price', 'product_id'))]
+
+    def test_synthetic_catalog_is_deterministic(self):
+        call_command('init_local_dev', categories=3, products_per=4, articles_per=5, seed=7, chunk_size=10,
+                     stdout=StringIO())
+        self.assertEqual((Category.objects.count(), Product.objects.count(), Article.objects.count()), (3, 12, 60))
+        self.assertEqual(Product.objects.filter(category__isnull=True).count(), 0)
+        first = self.snapshot()
+        call_command('init_local_dev', categories=3, products_per=4, articles_per=5, seed=7, chunk_size=25,
+                     stdout=StringIO())
+        self.assertEqual(first, self.snapshot())
+
+    def test_fixture(self):
+        call_command('init_local_dev', stdout=StringIO())
+        self.assertEqual((Category.objects.count(), Product.objects.count(), Article.objects.count()), (3, 5, 9))
+
+
+class TestDisable(ShopAPITestCase):
+
+    def create_tree(self, name, products=2, articles_per_product=2):
+        category = Category.objects.create(name=name, active=True)
+        for product_index in range(products):
+            product = Product.objects.create(name=f'{name} {product_index}', active=True, category=category)
+            for article_index in range(articles_per_product):
+                Article.objects.create(name=f'Lot {article_index}', active=True, product=product, price='2.50')
+        return category
+
+    def assertNumUpdates(self, queries, expected):
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), expected)
+
+    def test_category_cascades_to_articles(self):
+        category = self.create_tree('Fruits', products=3, articles_per_product=2)
+        other = self.create_tree('Légumes')
+        counts = category.disable()
+        self.assertEqual(counts, {'shop.Article': 6, 'shop.Product': 3, 'shop.Category': 1})
+        self.assertFalse(Article.objects.filter(product__category=category, active=True).exists())
+        self.assertEqual(Article.objects.filter(product__category=other, active=True).count(), 4)
+        self.assertEqual(category.disable(), {})
+
+    def test_constant_number_of_queries(self):
+        for products in (1, 10):
+            category = self.create_tree(f'Catégorie {products}', products=products, articles_per_product=3)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(reverse('category-disable', kwargs={'pk': category.pk}))
+            self.assertNumUpdates(queries, 3)
+            self.assertFalse(Article.objects.filter(product__category=category, active=True).exists())
+
+    def test_bulk_disable(self):
+        categories = [self.create_tree(name) for name in ('Fruits', 'Légumes', 'Épicerie')]
+        Category.objects.filter(pk=categories[2].pk).update(active=False)
+        with CaptureQueriesContext(connection) as queries:
+            counts = Category.objects.filter(pk__in=[category.pk for category in categories]).disable()
+        self.assertNumUpdates(queries, 3)
+        # The products of an inactive category are left untouched, as with Category.disable()
+        self.assertEqual(counts, {'shop.Article': 8, 'shop.Product': 4, 'shop.Category': 2})
+        self.assertEqual(Article.objects.filter(active=True).count(), 4)
+
+    def test_product_cascades_to_articles(self):
+        product = self.create_tree('Fruits').products.first()
+        self.assertEqual(product.disable(), {'shop.Article': 2, 'shop.Product': 1})
+        self.assertEqual(Article.objects.filter(active=True).count(), 2)
+
+
+class TestBulk(ShopAPITestCase):
+    url = reverse_lazy('admin-article-bulk')
+
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Fruits', active=True)
+        self.apple = Product.objects.create(name='Pomme', active=True, category=self.category)
+        self.pear = Product.objects.create(name='Poire', active=True, category=self.category)
+        self.old = Product.objects.create(name='Coing', active=False, category=self.category)
+
+    def test_create_articles_with_per_row_errors(self):
+        rows = [
+            {'name': '1kg', 'price': '2.50', 'product': self.apple.pk, 'active': True},
+            {'name': '2kg', 'price': '4.50', 'product': self.pear.pk},
+            {'name': '1kg', 'price': '2.50', 'product': self.old.pk},
+            {'name': '1kg', 'price': '0.50', 'product': self.apple.pk},
+            {'name': '1kg', 'price': '2.50', 'product': 9999},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, rows, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [2, 3, 4])
+        self.assertIn('product', response.json()['errors'][0]['errors'])
+        self.assertIn('price', response.json()['errors'][1]['errors'])
+        self.assertEqual(list(Article.objects.order_by('id').values_list('name', 'product_id')),
+                         [('1kg', self.apple.pk), ('2kg', self.pear.pk)])
+        # One query loads every referenced product
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SELECT')]), 1)
+
+    def test_create_from_ndjson_stream(self):
+        lines = [json.dumps({'name': f'{index}kg', 'price': '2.50', 'product': self.apple.pk}) for index in range(5)]
+        lines.insert(2, '{not json')
+        response = self.client.post(self.url, '\n'.join(lines) + '\n', content_type='application/x-ndjson')
+        self.assertEqual(response.json()['created'], 5)
+        self.assertEqual(response.json()['errors'][0]['index'], 2)
+
+    def test_all_rows_invalid(self):
+        response = self.client.post(self.url, [{'name': '1kg'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.url, {'name': '1kg'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_and_disable_articles(self):
+        first = Article.objects.create(name='1kg', active=True, product=self.apple, price='2.50')
+        second = Article.objects.create(name='2kg', active=True, product=self.apple, price='4.50')
+        response = self.client.patch(self.url, [{'id': first.pk, 'price': '3.00'},
+                                                {'id': second.pk, 'product': self.old.pk},
+                                                {'id': 9999, 'price': '3.00'}], format='json')
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2])
+        first.refresh_from_db()
+        self.assertEqual(str(first.price), '3.00')
+
+        response = self.client.post(reverse('admin-article-bulk-disable'), [first.pk, second.pk], format='json')
+        self.assertEqual(response.json()['disabled'], {'shop.Article': 2})
+
+    def test_ids_as_strings_and_invalid_ids(self):
+        first = Article.objects.create(name='1kg', active=True, product=self.apple, price='2.50')
+        second = Article.objects.create(name='2kg', active=True, product=self.apple, price='4.50')
+        response = self.client.patch(self.url, [{'id': str(first.pk), 'price': '3.00'}, {'id': 'abc'}, {}],
+                                     format='json')
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertEqual([(error['index'], list(error['errors'])) for error in response.json()['errors']],
+                         [(1, ['id']), (2, ['id'])])
+
+        url = reverse('admin-article-bulk-disable')
+        response = self.client.post(url, [str(first.pk), 'abc', None, True], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['disabled'], {'shop.Article': 1})
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2, 3])
+        response = self.client.post(url, f'{second.pk}\n{{oops\n', content_type='application/x-ndjson')
+        self.assertEqual(response.json(), {'disabled': {'shop.Article': 1}, 'errors': [
+            {'index': 1, 'errors': {'non_field_errors': [mock.ANY]}}]})
+        self.assertEqual(self.client.post(url, ['abc'], format='json').status_code, 400)
+
+        for payload in (5, 'abc', {'id': first.pk}):
+            self.assertEqual(self.client.post(url, payload, format='json').status_code, 400)
+            self.assertEqual(self.client.post(self.url, payload, format='json').status_code, 400)
+
+    def test_categories(self):
+        url = reverse('admin-category-bulk')
+        response = self.client.post(url, [{'name': 'Légumes', 'description': 'Légumes verts', 'active': True},
+                                          {'name': 'Épicerie', 'description': 'Sel'}], format='json')
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(response.json()['errors'][0]['index'], 1)
+        vegetables = Category.objects.get(name='Légumes')
+        response = self.client.patch(url, [{'id': vegetables.pk, 'description': 'Des Légumes'}], format='json')
+        self.assertEqual(response.json()['updated'], 1)
+        response = self.client.post(reverse('admin-category-bulk-disable'), [self.category.pk, vegetables.pk],
+                                    format='json')
+        self.assertEqual(response.json()['disabled'], {'shop.Article': 0, 'shop.Product': 2, 'shop.Category': 2})
+
+
+class TestExport(ShopAPITestCase):
+    url = reverse_lazy('article-export')
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_matches_serializer(self):
+        CatalogSeeder(2, 3, 4).run()
+        rows = [json.loads(line) for line in self.export(format='ndjson').splitlines()]
+        articles = Article.objects.filter(active=True).order_by('id')
+        self.assertEqual(rows, json.loads(json.dumps(ArticleSerializer(articles, many=True).data)))
+
+    def test_csv_and_filters(self):
+        CatalogSeeder(2, 3, 4).run()
+        product = Product.objects.first()
+        rows = list(csv.DictReader(self.export(format='csv', product_id=product.pk, show_inactive='true').splitlines()))
+        self.assertEqual(list(rows[0]), ArticleSerializer.Meta.fields)
+        self.assertEqual([int(row['id']) for row in rows], list(product.articles.order_by('id').values_list('id', flat=True)))
+
+    def measure_export(self, articles):
+        Article.objects.all().delete()
+        CatalogSeeder(1, 10, articles // 10, active_ratio=1).run()
+        tracemalloc.start()
+        try:
+            size = sum(len(chunk) for chunk in self.client.get(self.url, {'format': 'ndjson'}).streaming_content)
+            return size, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    @mock.patch.object(ArticleViewSet, 'export_chunk_size', 100)
+    def test_memory_stays_flat(self):
+        small_size, small_peak = self.measure_export(1000)
+        large_size, large_peak = self.measure_export(10000)
+        self.assertGreater(large_size, 9 * small_size)
+        # Holding every row at once would cost several megabytes
+        self.assertLess(large_peak - small_peak, 512 * 1024)
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class TestConditionalGet(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        CatalogSeeder(2, 2, 3, active_ratio=1).run()
+        self.category = Category.objects.first()
+
+    def get(self, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **headers)
+        response.selects = [query for query in queries if query['sql'].startswith('SELECT')]
+        return response
+
+    def test_list_not_modified(self):
+        url = reverse('article-list')
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        # Disabled or deleted rows would not move it
+        self.assertNotIn('Last-Modified', response)
+
+        response = self.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(response.selects), 1)
+
+    def test_list_ignores_if_modified_since(self):
+        url = reverse('article-list')
+        since = http_date(time.time() + 60)
+        Article.objects.filter(pk=Article.objects.last().pk).delete()
+        self.assertEqual(self.get(url, HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+        # Still on the details
+        article = Article.objects.filter(active=True).first()
+        response = self.get(reverse('article-detail', args=[article.pk]), HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_depends_on_query_string(self):
+        url = reverse('article-list')
+        etag = self.get(url)['ETag']
+        self.assertEqual(self.get(url + '?offset=2', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_changes(self):
+        url = reverse('article-list')
+        etag = self.get(url)['ETag']
+        # Articles show the name of their category
+        self.category.name = 'Renamed'
+        self.category.save()
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        Article.objects.filter(pk=Article.objects.last().pk).delete()
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_detail_covers_the_tree(self):
+        url = reverse('category-detail', kwargs={'pk': self.category.pk})
+        etag = self.get(url)['ETag']
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Article.objects.filter(pk=Article.objects.filter(product__category=self.category).first().pk).disable()
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_detail(self):
+        self.assertEqual(self.get(reverse('category-detail', kwargs={'pk': 0})).status_code, 404)
+        self.assertEqual(self.get(reverse('category-detail', kwargs={'pk': 'abc'})).status_code, 404)
+
+
+class TestResponseCache(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        CatalogSeeder(2, 2, 3, active_ratio=1).run()
+        self.category = Category.objects.first()
+        self.url = reverse('category-detail', kwargs={'pk': self.category.pk})
+
+    def assertCached(self, url, params=None):
+        with self.assertNumQueries(0):
+            return self.client.get(url, params)
+
+    def test_hit_and_conditional(self):
+        response = self.client.get(self.url)
+        cached = self.assertCached(self.url)
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_keyed_by_query_params(self):
+        url = reverse('article-list')
+        first = self.client.get(url, {'limit': 2}).json()
+        second = self.client.get(url, {'limit': 2, 'offset': 2}).json()
+        self.assertNotEqual(first['results'], second['results'])
+        self.assertEqual(self.assertCached(url, {'limit': 2, 'offset': 2}).json(), second)
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'shop.test'])
+    def test_keyed_by_host(self):
+        url = reverse('article-list')
+        self.client.get(url, {'limit': 2})
+        response = self.client.get(url, {'limit': 2}, HTTP_HOST='shop.test', secure=True)
+        self.assertTrue(response.json()['next'].startswith('https://shop.test/'))
+
+    @override_settings(ECOSCORE={'BACKGROUND_REFRESH': False})
+    @mock.patch('shop.models.Product.call_external_api', mock_openfoodfact_success)
+    def test_stored_after_fetching_ecoscores(self):
+        url = reverse('product-list')
+        response = self.client.get(url)
+        self.assertEqual(response.json()['results'][0]['ecoscore'], ECOSCORE_GRADE)
+        self.assertEqual(self.assertCached(url).content, response.content)
+
+    def test_save_invalidates(self):
+        self.client.get(self.url)
+        article = Article.objects.filter(product__category=self.category).first()
+        article.name = 'Renamed'
+        article.save()
+        self.assertContains(self.client.get(self.url), 'Renamed')
+
+    def test_update_and_disable_invalidate(self):
+        self.client.get(self.url)
+        # Names are unique
+        Product.objects.filter(category=self.category).update(name=Concat('name', Value(' renamed')))
+        self.assertContains(self.client.get(self.url), 'renamed')
+        self.category.disable()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_delete_invalidates(self):
+        url = reverse('article-list')
+        count = self.client.get(url).json()['count']
+        Article.objects.filter(pk=Article.objects.first().pk).delete()
+        self.assertEqual(self.client.get(url).json()['count'], count - 1)
+
+    def test_unrelated_writes_keep_the_entry(self):
+        url = reverse('category-list')
+        self.client.get(url)
+        Article.objects.update(name='Renamed')
+        self.assertCached(url)
+
+    def test_skips_browsable_api(self):
+        self.client.get(self.url, HTTP_ACCEPT='text/html')
+        with self.assertNumQueries(4):
+            self.client.get(self.url, HTTP_ACCEPT='text/html')
+
+
+class TestDenormalized(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        CatalogSeeder(2, 2, 3, active_ratio=1).run()
+        self.category, self.other = Category.objects.order_by('id')
+        self.product = self.category.products.first()
+
+    def assertConsistent(self):
+        self.assertFalse(Article.objects.inconsistent().exists())
+
+    def test_bulk_created_and_saved_articles(self):
+        self.assertConsistent()
+        article = self.product.articles.create(name='1kg', price='2.50', active=True)
+        self.assertEqual((article.product_name, article.category_id), (self.product.name, self.category.pk))
+        self.assertConsistent()
+
+    def test_renames_and_moves(self):
+        self.product.name = 'Renamed'
+        updated = self.product.articles.order_by('id').values_list('date_updated', flat=True)
+        before = list(updated)
+        with CaptureQueriesContext(connection) as queries:
+            self.product.save()
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "shop_article"')]), 1)
+        self.assertConsistent()
+        # Moves the Last-Modified of the denormalized reads
+        self.assertTrue(all(after > date for after, date in zip(updated.all(), before)))
+
+        self.category.name = 'Renamed'
+        self.category.save()
+        self.assertConsistent()
+
+        Product.objects.filter(pk=self.product.pk).update(category=self.other)
+        self.assertConsistent()
+        Category.objects.update(name=Concat('name', Value(' bio')))
+        self.assertConsistent()
+        Article.objects.filter(product=self.product).update(product=self.other.products.first())
+        self.assertConsistent()
+        self.assertEqual({name[-4:] for name in Article.objects.values_list('category_name', flat=True)}, {' bio'})
+
+    def test_saves_read_the_product_on_moves_only(self):
+        article = Article.objects.filter(product=self.product).first()
+        article.price = '3.00'
+        with CaptureQueriesContext(connection) as queries:
+            article.save()
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT "shop_product"')])
+        article.product_id = self.other.products.first().pk
+        with CaptureQueriesContext(connection) as queries:
+            article.save()
+        products = [query for query in queries if query['sql'].startswith('SELECT "shop_product"')]
+        self.assertEqual(len(products), 1)
+        self.assertIn('JOIN "shop_category"', products[0]['sql'])
+        self.assertConsistent()
+
+    def test_list_reads_without_joins(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('article-list'), {'limit': 100})
+        # Neither the validators nor the page
+        for query in queries:
+            self.assertNotIn('JOIN', query['sql'])
+        articles = Article.objects.filter(active=True).select_related('product__category').order_by('id')
+        self.assertEqual(response.json()['results'], json.loads(json.dumps(ArticleSerializer(articles, many=True).data)))
+
+    def test_check_command(self):
+        call_command('check_denormalized', stdout=StringIO())
+        Article.objects.filter(product=self.product).update(product_name='Stale')
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_denormalized', stdout=out)
+        self.assertIn('Stale', out.getvalue())
+        call_command('check_denormalized', '--fix', stdout=StringIO())
+        self.assertConsistent()
+
+
+async def failing_openfoodfact(self, method, url):
+    raise ConnectionError('upstream down')
+
+
+@override_settings(ECOSCORE={'BACKGROUND_REFRESH': False})
+@mock.patch('shop.models.Product.call_external_api', side_effect=AssertionError('blocking call'))
+class TestAsyncViews(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Fruits', active=True)
+        for index in range(6):
+            Product.objects.create(name=f'Fruit {index}', active=True, category=category)
+
+    @mock.patch('shop.models.Product.acall_external_api', mock_openfoodfact_success_async)
+    async def test_product_list(self, call_external_api):
+        response = await self.async_client.get('/api/async/product/')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([product['ecoscore'] for product in results], [ECOSCORE_GRADE] * 6)
+        # Same representation as the synchronous endpoint, which now reads the stored grades
+        response = await sync_to_async(self.client.get)('/api/product/')
+        self.assertEqual(response.json()['results'], results)
+
+    async def test_fetches_concurrently(self, call_external_api):
+        calls = {'in_flight': 0, 'peak': 0}
+
+        async def counting_openfoodfact(product, method, url):
+            calls['in_flight'] += 1
+            calls['peak'] = max(calls['peak'], calls['in_flight'])
+            await asyncio.sleep(0.05)
+            calls['in_flight'] -= 1
+            return mock_openfoodfact_success(product, method, url)
+
+        with mock.patch('shop.models.Product.acall_external_api', counting_openfoodfact):
+            response = await self.async_client.get('/api/async/product/?pagination=cursor')
+        self.assertEqual(len(response.json()['results']), 6)
+        self.assertEqual(calls['peak'], 6)
+
+    @mock.patch('shop.models.Product.acall_external_api', failing_openfoodfact)
+    async def test_upstream_failure(self, call_external_api):
+        response = await self.async_client.get('/api/async/product/')
+        self.assertEqual([product['ecoscore'] for product in response.json()['results']], [None] * 6)
+
+    @mock.patch('shop.models.Product.acall_external_api', mock_openfoodfact_success_async)
+    async def test_page_loaded_once(self, call_external_api):
+        with mock.patch.object(ShopPagination, 'paginate_queryset', autospec=True,
+                               side_effect=ShopPagination.paginate_queryset) as paginate:
+            response = await self.async_client.get('/api/async/product/?limit=2&offset=2')
+        self.assertEqual(paginate.call_count, 1)
+        data = response.json()
+        self.assertEqual([product['name'] for product in data['results']], ['Fruit 2', 'Fruit 3'])
+        self.assertIn('offset=4', data['next'])
+        self.assertEqual((await self.async_client.get('/api/async/product/?min_price=abc')).status_code, 400)
+
+    @mock.patch('shop.models.Product.acall_external_api', mock_openfoodfact_success_async)
+    async def test_short_circuits_skip_the_page(self, call_external_api):
+        response = await self.async_client.get('/api/async/product/')
+        with mock.patch.object(ShopPagination, 'paginate_queryset', side_effect=AssertionError), \
+                mock.patch('shop.models.Product.acall_external_api', side_effect=AssertionError):
+            self.assertEqual((await self.async_client.get('/api/async/product/')).content, response.content)
+            with self.settings(RESPONSE_CACHE={'ENABLED': False}):
+                not_modified = await self.async_client.get('/api/async/product/',
+                                                           **{'If-None-Match': response['ETag']})
+            self.assertEqual(not_modified.status_code, 304)
+
+    def test_clients_closed_with_their_loop(self, call_external_api):
+        async def get_client():
+            client = upstream.get_async_client()
+            self.assertIs(upstream.get_async_client(), client)
+            return client
+        client = asyncio.run(get_client())
+        self.assertTrue(client.is_closed)
+        self.assertEqual(len(upstream._async_clients), 0)
+
+    async def test_other_endpoints(self, call_external_api):
+        category = (await self.async_client.get('/api/async/category/')).json()['results'][0]
+        response = await self.async_client.get(f"/api/async/category/{category['id']}/")
+        self.assertEqual(len(response.json()['products']), 6)
+        self.assertEqual((await self.async_client.get('/api/async/category/0/')).status_code, 404)
+        self.assertEqual((await self.async_client.get('/api/async/article/')).json()['count'], 0)
+
+
+class TestSearch(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        vegetables = Category.objects.create(name='Légumes', active=True)
+        fruits = Category.objects.create(name='Fruits', active=True)
+        self.zucchini = Product.objects.create(name='Courgette', description='Verte', active=True, category=vegetables)
+        self.banana = Product.objects.create(name='Banane', active=True, category=fruits)
+        self.prices = {}
+        for product, prices in ((self.zucchini, ('1.00', '2.50')), (self.banana, ('2.50', '4.50', '9.00'))):
+            for index, price in enumerate(prices):
+                article = Article.objects.create(name=f'Lot de {index + 1}', price=price, active=True, product=product)
+                self.prices[article.pk] = Decimal(price)
+        Product.objects.filter(pk=self.banana.pk).update(ecoscore_grade=ECOSCORE_GRADE,
+                                                         ecoscore_fetched_at=timezone.now())
+        Product.objects.filter(pk=self.zucchini.pk).update(ecoscore_grade=ECOSCORE_GRADE,
+                                                           ecoscore_fetched_at=timezone.now())
+
+    def ids(self, name, **params):
+        response = self.client.get(reverse(f'{name}-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_price_range_and_ordering(self):
+        ids = self.ids('article', min_price='2.5', max_price='5', ordering='-price')
+        self.assertEqual([self.prices[pk] for pk in ids], [Decimal('4.50'), Decimal('2.50'), Decimal('2.50')])
+        self.assertLess(ids[1], ids[2])
+        ids = self.ids('article', ordering='price', pagination='cursor', limit=2)
+        self.assertEqual([self.prices[pk] for pk in ids], [Decimal('1.00'), Decimal('2.50')])
+        self.assertEqual(self.client.get(reverse('article-list'), {'min_price': 'cheap'}).status_code, 400)
+
+    def test_products_by_lowest_price(self):
+        self.assertEqual(self.ids('product', ordering='-price'), [self.banana.pk, self.zucchini.pk])
+        self.assertEqual(self.ids('product', min_price='2'), [self.banana.pk])
+
+    def test_search(self):
+        with CaptureQueriesContext(connection) as queries:
+            ids = self.ids('article', search='legum')
+        self.assertTrue(any('MATCH' in query['sql'] for query in queries))
+        self.assertEqual(set(ids), set(self.zucchini.articles.values_list('id', flat=True)))
+        self.assertEqual(len(self.ids('article', search='ban lot 3')), 1)
+        self.assertEqual(self.ids('product', search='VERTE'), [self.zucchini.pk])
+        self.assertEqual(self.ids('article', search='"* OR ('), [])
+
+    def test_index_follows_writes(self):
+        self.banana.name = 'Plantain'
+        self.banana.save()
+        self.assertEqual(self.ids('article', search='banane'), [])
+        self.assertEqual(len(self.ids('article', search='plantain')), 3)
+        self.banana.delete()
+        self.assertEqual(self.ids('article', search='plantain'), [])
+        self.assertEqual(self.ids('product', search='plantain'), [])
+
+    @mock.patch('shop.search.fts_available', return_value=False)
+    def test_fallback(self, fts_available):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.ids('article', search='ban lot 3')), 1)
+        self.assertFalse(any('MATCH' in query['sql'] for query in queries))
+        self.assertEqual(self.ids('product', search='verte'), [self.zucchini.pk])
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class TestFastList(ShopAPITestCase):
+    params = [
+        {},
+        {'limit': 4, 'offset': 3},
+        {'show_inactive': 'true', 'ordering': '-price'},
+        {'pagination': 'cursor', 'limit': 5, 'ordering': 'price'},
+        {'search': 'lot', 'min_price': '20'},
+    ]
+
+    def setUp(self):
+        super().setUp()
+        CatalogSeeder(3, 3, 4, seed=1).run()
+        Category.objects.filter(pk=Category.objects.first().pk).update(name='Épicerie fine "bio"',
+                                                                       description='Sel & poivre\u2028')
+
+    def responses(self, name, fast):
+        responses = []
+        with mock.patch('shop.renderers.orjson', renderers.orjson if fast else None):
+            for params in self.params:
+                if fast:
+                    response = self.client.get(reverse(f'{name}-list'), params)
+                else:
+                    with mock.patch.object(RowListMixin, 'list', ReadOnlyModelViewSet.list):
+                        response = self.client.get(reverse(f'{name}-list'), params)
+                self.assertEqual(response.status_code, 200)
+                responses.append(response.content)
+        return responses
+
+    def assertIdentical(self, name):
+        self.assertEqual(self.responses(name, fast=True), self.responses(name, fast=False))
+
+    def test_articles(self):
+        self.assertIdentical('article')
+        with override_settings(DENORMALIZED_ARTICLES=False):
+            self.assertIdentical('article')
+
+    def test_categories(self):
+        self.assertIdentical('category')
+
+    def test_null_values(self):
+        article = Article.objects.select_related('product__category').first()
+        values = Article.objects.filter(pk=article.pk).values(*DENORMALIZED_ARTICLE_ROW.columns).get()
+        article.price = article.description = values['price'] = values['description'] = None
+        self.assertEqual(DENORMALIZED_ARTICLE_ROW.from_dict(values), ArticleSerializer(article).data)
+
+    def test_skips_serializers(self):
+        with mock.patch.object(ArticleSerializer, 'to_representation') as to_representation:
+            self.client.get(reverse('article-list'))
+        to_representation.assert_not_called()
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class TestSummary(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Fruits', active=True)
+        self.product = Product.objects.create(name='Pomme', active=True, category=self.category)
+        self.empty = Product.objects.create(name='Poire', active=True, category=self.category)
+        for price, active in (('1.20', True), ('2.50', True), ('3.10', True), ('9.99', False)):
+            Article.objects.create(name='Lot', price=price, active=active, product=self.product)
+
+    def summary(self, name, **params):
+        response = self.client.get(reverse(f'{name}-summary'), {'show_inactive': 'true', 'limit': 100, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_product_summary(self):
+        with CaptureQueriesContext(connection) as queries:
+            products = self.summary('product')
+        # The count of the paginator, then the page itself
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(products, [
+            {'id': self.product.pk, 'name': 'Pomme', 'articles': 4, 'active_articles': 3, 'active_ratio': 0.75,
+             'min_price': '1.20', 'max_price': '3.10', 'avg_price': '2.27'},
+            {'id': self.empty.pk, 'name': 'Poire', 'articles': 0, 'active_articles': 0, 'active_ratio': None,
+             'min_price': None, 'max_price': None, 'avg_price': None},
+        ])
+        self.assertEqual([product['id'] for product in self.summary('product', search='poire')], [self.empty.pk])
+
+    def test_category_summary(self):
+        self.assertEqual(self.summary('category'), [
+            {'id': self.category.pk, 'name': 'Fruits', 'articles': 4, 'active_articles': 3, 'active_ratio': 0.75,
+             'min_price': '1.20', 'max_price': '3.10', 'avg_price': '2.27'},
+        ])
+
+    def assertRollupsMatch(self):
+        for name in ('product', 'category'):
+            live = self.summary(name)
+            with override_settings(CATALOG_ROLLUP=True):
+                self.assertEqual(self.summary(name), live)
+        self.assertFalse(ProductRollup.objects.filter(stale=True).exists())
+
+    @override_settings(CATALOG_ROLLUP=True)
+    def test_rollups_follow_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('refresh_rollups', stdout=StringIO())
+        self.assertRollupsMatch()
+
+        writes = [
+            lambda: CatalogSeeder(2, 3, 4, seed=2).run(),
+            lambda: Article.objects.create(name='Lot', price='0.50', active=True, product=self.empty),
+            lambda: Article.objects.filter(product=self.product, active=True).update(price='4.00'),
+            lambda: self.product.disable(),
+            lambda: Article.objects.filter(price='0.50').delete(),
+            lambda: Article.objects.filter(product=self.product).update(product=self.empty),
+            lambda: Article.objects.bulk_create([Article(name='Lot', price='7.00', active=True, product=self.product)]),
+            lambda: Category.objects.exclude(pk=self.category.pk).disable(),
+            lambda: Product.objects.filter(pk=self.empty.pk).delete(),
+        ]
+        for write in writes:
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+            self.assertRollupsMatch()
+
+        article = Article.objects.filter(product=self.product).first()
+        article.product = Product.objects.exclude(pk=self.product.pk).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            article.save()
+        self.assertRollupsMatch()
+
+    def test_refresh_command_recomputes_everything(self):
+        # Written while the rollups were disabled
+        with override_settings(CATALOG_ROLLUP=True), self.captureOnCommitCallbacks(execute=True):
+            call_command('refresh_rollups', stdout=StringIO())
+        Article.objects.filter(product=self.product).update(active=True)
+        with override_settings(CATALOG_ROLLUP=True):
+            self.assertEqual(self.summary('product')[0]['active_articles'], 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('refresh_rollups', '--full', stdout=StringIO())
+        self.assertRollupsMatch()
+
+
+class TestUniqueNames(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Fruits', active=True)
+        Product.objects.create(name='Pomme', active=True, category=self.category)
+
+    def test_many_validated_with_one_query(self):
+        rows = [{'name': f'Produit {index}'} for index in range(20)] + [{'name': 'Pomme'}, {'name': 'Produit 3'}]
+        serializer = ProductListSerializer(data=rows, many=True)
+        with self.assertNumQueries(1):
+            self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors[:20], [{}] * 20)
+        self.assertEqual(serializer.errors[20], {'name': ['Product already exists']})
+        self.assertEqual(serializer.errors[21], {'name': ['Duplicate name in the payload']})
+
+    def test_unchanged_name_on_update(self):
+        serializer = CategoryListSerializer(self.category, data={'name': 'Fruits', 'description': 'Fruits secs'})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+    def test_bulk_duplicates(self):
+        rows = [{'name': name, 'description': name} for name in ('Légumes', 'Fruits', 'Légumes', 'Épicerie')]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('admin-category-bulk'), rows, format='json')
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2])
+        # One query checks every name of the batch
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SELECT')]), 1)
+
+    def concurrent_create(self, name):
+        # Another writer commits the same name between the check and the insert
+        validate = CategoryListSerializer.validate
+
+        def racing_validate(serializer, data):
+            if not Category.objects.filter(name=name).exists():
+                Category.objects.create(name=name, description=name)
+            return validate(serializer, data)
+        return mock.patch.object(CategoryListSerializer, 'validate', racing_validate)
+
+    def test_concurrent_create(self):
+        serializer = CategoryListSerializer(data={'name': 'Légumes', 'description': 'Légumes verts'})
+        with self.concurrent_create('Légumes'):
+            self.assertTrue(serializer.is_valid())
+        with self.assertRaises(ValidationError) as raised:
+            serializer.save()
+        self.assertEqual(raised.exception.detail, {'name': ['Category already exists']})
+        self.assertEqual(Category.objects.filter(name='Légumes').count(), 1)
+
+    def test_concurrent_bulk_create(self):
+        rows = [{'name': name, 'description': name} for name in ('Légumes', 'Épicerie', 'Boissons')]
+        with self.concurrent_create('Épicerie'):
+            response = self.client.post(reverse('admin-category-bulk'), rows, format='json')
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1])
+        self.assertEqual(Category.objects.filter(name='Épicerie').count(), 1)
+
+
+@override_settings(UPSTREAM={'BREAKER_THRESHOLD': 3, 'BREAKER_RECOVERY': 0.2, 'MAX_CONCURRENT': 2,
+                             'BULKHEAD_TIMEOUT': 0, 'READ_TIMEOUT': 0.2},
+                   ECOSCORE={'BACKGROUND_REFRESH': False})
+class TestResilience(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        upstream.reset_resilience()
+        self.addCleanup(upstream.reset_resilience)
+        self.server = FakeUpstream(latency=0)
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        self.host = self.server.url.split('/')[2]
+
+    def breaker(self):
+        return upstream.resilience_stats()['breakers'][self.host]
+
+    def open_circuit(self):
+        self.server.status = 500
+        for _ in range(3):
+            self.assertEqual(upstream.request('GET', self.server.url).status_code, 500)
+        self.assertEqual(self.breaker()['state'], 'open')
+
+    def test_opens_then_probes_for_recovery(self):
+        self.open_circuit()
+        with self.assertRaises(CircuitOpenError):
+            upstream.request('GET', self.server.url)
+        self.assertEqual(self.server.calls, 3)
+
+        time.sleep(0.25)
+        self.server.status = 200
+        self.assertEqual(upstream.request('GET', self.server.url).status_code, 200)
+        self.assertEqual(self.breaker(), {'state': 'closed', 'consecutive_failures': 0, 'successes': 1,
+                                          'failures': 3, 'rejected': 1, 'opened': 1})
+
+    def test_failed_probe_opens_again(self):
+        self.open_circuit()
+        time.sleep(0.25)
+        upstream.request('GET', self.server.url)
+        self.assertEqual(self.breaker()['state'], 'open')
+        with self.assertRaises(CircuitOpenError):
+            upstream.request('GET', self.server.url)
+        self.assertEqual(self.server.calls, 4)
+
+    def test_stragglers_do_not_close_the_circuit(self):
+        now = [0]
+        breaker = CircuitBreaker('upstream', failure_threshold=2, recovery_timeout=10, clock=lambda: now[0])
+        # Three calls started while the circuit was closed, the slowest succeeds once it opened
+        probes = [breaker.before_call() for _ in range(3)]
+        self.assertEqual(probes, [False, False, False])
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'open')
+
+        now[0] = 10
+        self.assertTrue(breaker.before_call())
+        # Neither while the probe is in flight
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'half_open')
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success(probe=True)
+        self.assertEqual(breaker.as_dict(), {'state': 'closed', 'consecutive_failures': 0, 'successes': 3,
+                                             'failures': 3, 'rejected': 1, 'opened': 1})
+
+    def test_timeouts_are_failures(self):
+        self.server.latency = 0.5
+        with self.assertRaises(requests.Timeout):
+            upstream.request('GET', self.server.url)
+        self.assertEqual(self.breaker()['failures'], 1)
+
+    def test_bulkhead_caps_concurrent_calls(self):
+        self.server.latency = 0.15
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(upstream.request, 'GET', self.server.url) for _ in range(4)]
+        errors = [future.exception() for future in futures]
+        self.assertEqual(len([error for error in errors if isinstance(error, BulkheadFullError)]), 2)
+        self.assertEqual(self.server.calls, 2)
+        self.assertEqual(upstream.resilience_stats()['bulkhead'], {'max_concurrent': 2, 'in_flight': 0, 'rejected': 2})
+
+    def test_async_calls_fail_fast(self):
+        self.open_circuit()
+        with self.assertRaises(CircuitOpenError):
+            asyncio.run(upstream.arequest('GET', self.server.url))
+
+    def test_ecoscore_does_not_wait_on_an_open_circuit(self):
+        self.open_circuit()
+        product = Product.objects.create(name='Pomme', active=True,
+                                         category=Category.objects.create(name='Fruits', active=True))
+        with self.settings(ECOSCORE={'BACKGROUND_REFRESH': False, 'URL': self.server.url}):
+            self.assertIsNone(product.ecoscore)
+        # Rejected by the breaker without reaching the upstream
+        self.assertEqual(self.breaker()['rejected'], 1)
+        self.assertEqual(self.server.calls, 3)
+
+    def test_exposed_to_admins(self):
+        self.open_circuit()
+        self.client.force_authenticate(get_user_model().objects.create_superuser('admin', 'admin@oc.drf', 'password'))
+        self.assertEqual(self.client.get(reverse('admin-stats-upstream')).json()['breakers'][self.host]['state'],
+                         'open')
+        metrics = self.client.get(reverse('admin-stats-list'), {'format': 'prometheus'}).content.decode()
+        self.assertIn(f'shop_upstream_circuit_state{{host="{self.host}"}} 2', metrics)
+        self.assertIn(f'shop_upstream_calls_total{{host="{self.host}",outcome="failures"}} 3', metrics)
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class TestBenchmark(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        CatalogSeeder(2, 2, 3, active_ratio=1).run()
+
+    def test_measure(self):
+        product = Product.objects.first()
+        result = measure(self.client, Scenario('product-detail', 'get', reverse('product-detail', args=[product.pk])), 5)
+        self.assertEqual(result['requests'], 5)
+        # validators, product joined with its category, its active articles
+        self.assertEqual(result['queries'], 3)
+        self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+        self.assertGreater(result['peak_memory_kib'], 0)
+
+        rows = Scenario('bulk', 'post', reverse('admin-category-bulk'),
+                        lambda index: [{'name': f'Bench {index}', 'description': f'Bench {index}'}])
+        self.assertEqual(measure(self.client, rows, 3)['requests'], 3)
+        self.assertEqual(Category.objects.filter(name__startswith='Bench').count(), 5)
+
+        with self.assertRaises(ValueError):
+            measure(self.client, Scenario('missing', 'get', reverse('product-detail', args=[0])), 1)
+
+        # Every request is checked, not only the first one
+        disable = Scenario('disable', 'post', reverse('product-disable', args=[product.pk]))
+        with self.assertRaisesRegex(ValueError, 'HTTP 404 on request 1'):
+            measure(self.client, disable, 3)
+        disable.setup = lambda index: Product.objects.filter(pk=product.pk).update(active=True)
+        self.assertEqual(measure(self.client, disable, 3)['requests'], 3)
+
+    def test_compare(self):
+        def result(p95, queries):
+            return {'latency_ms': {'p95': p95}, 'throughput': 100 / p95, 'queries': queries}
+        changes = compare({'fast': result(10, 2), 'slow': result(10, 2), 'gone': result(1, 1)},
+                          {'fast': result(11, 2), 'slow': result(13, 2), 'new': result(1, 1)}, threshold=0.2)
+        self.assertEqual(set(changes), {'fast', 'slow'})
+        self.assertFalse(changes['fast'][3])
+        self.assertTrue(changes['slow'][3])
+        self.assertTrue(compare({'fast': result(10, 2)}, {'fast': result(10, 3)}, threshold=0.2)['fast'][3])
+
+
+class TestUniqueNamesMigration(APITransactionTestCase):
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([target])
+        return executor.loader.project_state(target).apps
+
+    def test_renames_duplicates(self):
+        apps = self.migrate(('shop', '0007_product_rollup'))
+        self.addCleanup(self.migrate, MigrationExecutor(connection).loader.graph.leaf_nodes('shop')[0])
+        Category, Product, Article = (apps.get_model('shop', name) for name in ('Category', 'Product', 'Article'))
+        fruits = [Category.objects.create(name='Fruits') for _ in range(2)]
+        apples = [Product.objects.create(name='Pomme', category=fruits[index]) for index in (0, 1, 1)]
+        # Taken already by another product
+        Product.objects.create(name=f'Pomme ({apples[1].pk})', category=fruits[0])
+        article = Article.objects.create(name='Lot', price='1.20', product=apples[2], product_name='Pomme',
+                                         category_id=fruits[1].pk, category_name='Fruits')
+
+        self.migrate(('shop', '0008_unique_names'))
+        self.assertEqual(list(Category.objects.order_by('pk').values_list('name', flat=True)),
+                         ['Fruits', f'Fruits ({fruits[1].pk})'])
+        self.assertEqual(list(Product.objects.order_by('pk').values_list('name', flat=True)),
+                         ['Pomme', f'Pomme ({apples[1].pk}-2)', f'Pomme ({apples[2].pk})', f'Pomme ({apples[1].pk})'])
+        article.refresh_from_db()
+        self.assertEqual((article.product_name, article.category_name),
+                         (f'Pomme ({apples[2].pk})', f'Fruits ({fruits[1].pk})'))
+
+
+@override_settings(REPLICAS={'ALIASES': ['replica'], 'MAX_LAG': 1}, RESPONSE_CACHE={'ENABLED': False})
+class TestReplicas(APITransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        ecoscore.lru.clear()
+        cache.get_cache().clear()
+        self.category = Category.objects.create(name='Fruits', active=True)
+        replicas.replicate('replica')
+
+    def names(self, client=None):
+        response = (client or self.client).get(reverse('category-list'))
+        return [category['name'] for category in response.json()['results']]
+
+    def test_reads_lag_until_replicated(self):
+        Category.objects.create(name='Légumes', active=True)
+        self.assertEqual(self.names(), ['Fruits'])
+        call_command('replicate', stdout=StringIO())
+        self.assertEqual(self.names(), ['Fruits', 'Légumes'])
+
+    def test_reads_own_writes(self):
+        response = self.client.post(reverse('category-disable', args=[self.category.pk]))
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+        self.assertEqual(self.names(), [])
+        # Other clients keep reading the replica
+        self.assertEqual(self.names(APIClient()), ['Fruits'])
+        with mock.patch('shop.replicas.time.time', return_value=time.time() + 2):
+            self.assertEqual(self.names(), ['Fruits'])
+
+    def test_writes_go_to_the_primary(self):
+        category = Category.objects.using('replica').get()
+        category.name = 'Fruits secs'
+        category.save()
+        self.assertEqual(Category.objects.get().name, 'Fruits secs')
+        self.assertEqual(Category.objects.using('replica').get().name, 'Fruits')
+
+    @mock.patch('shop.models.Product.acall_external_api', mock_openfoodfact_success_async)
+    async def test_async_preload_reads_the_replica(self):
+        await sync_to_async(Product.objects.create)(name='Pomme', active=True, category=self.category)
+        with mock.patch('shop.ecoscore.aresolve_many', wraps=ecoscore.aresolve_many) as resolve:
+            response = await self.async_client.get('/api/async/product/')
+        # Not replicated yet
+        self.assertEqual(response.json()['results'], [])
+        resolve.assert_not_called()
+
+    def test_cache_bypassed_when_pinned(self):
+        with self.settings(RESPONSE_CACHE={'ENABLED': True}):
+            self.assertEqual(self.names(), ['Fruits'])
+            self.client.post(reverse('category-disable', args=[self.category.pk]))
+            Category.objects.create(name='Légumes', active=True)
+            self.assertEqual(self.names(), ['Légumes'])
+
+    def test_selection(self):
+        request = APIRequestFactory().get('/')
+        with self.settings(REPLICAS={'ALIASES': ['first', 'second']}):
+            chosen = [replicas.choose(request) for _ in range(4)]
+            self.assertEqual(set(chosen), {'first', 'second'})
+            self.assertNotEqual(chosen[0], chosen[1])
+            self.assertIsNone(replicas.choose(APIRequestFactory().post('/')))
+        with self.settings(REPLICAS={'ALIASES': ['first', 'second'], 'STRATEGY': 'least_loaded'}):
+            with replicas.reading_from('first'):
+                self.assertEqual({replicas.choose(request) for _ in range(4)}, {'second'})
+            self.assertEqual(replicas.load()['first'], 0)
+
+
+class TestSQLiteProfile(ShopAPITestCase):
+
+    def open(self, directory, **options):
+        settings_dict = {**connection.settings_dict, 'NAME': os.path.join(directory, 'profile.sqlite3'),
+                         'OPTIONS': options}
+        wrapper = load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, 'profile')
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        return wrapper.connection.execute(f'PRAGMA {name}').fetchone()[0]
+
+    def test_pragmas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = self.open(directory)
+            self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+            # NORMAL
+            self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)
+            self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 5000)
+            self.assertEqual(self.pragma(wrapper, 'cache_size'), -64000)
+            wrapper.close()
+            with self.settings(SQLITE_PRAGMAS={'journal_mode': 'delete', 'busy_timeout': 100, 'mmap_size': None}):
+                wrapper = self.open(directory)
+                self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'delete')
+                self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 100)
+                self.assertEqual(self.pragma(wrapper, 'mmap_size'), 0)
+
+    def test_immediate_transactions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = self.open(directory, transaction_mode='IMMEDIATE')
+            wrapper.connection.execute('CREATE TABLE row (id INTEGER PRIMARY KEY)')
+            wrapper.set_autocommit(False)
+            wrapper._start_transaction_under_autocommit()
+            other = sqlite3.connect(wrapper.settings_dict['NAME'], timeout=0)
+            self.addCleanup(other.close)
+            # The write lock is taken at BEGIN, before any write...
+            with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+                other.execute('BEGIN IMMEDIATE')
+            # ...and readers go on
+            wrapper.connection.execute('INSERT INTO row VALUES (1)')
+            self.assertEqual(other.execute('SELECT COUNT(*) FROM row').fetchone()[0], 0)
+            wrapper.connection.commit()
+            self.assertEqual(other.execute('SELECT COUNT(*) FROM row').fetchone()[0], 1)
+
+    def test_invalid_transaction_mode(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = self.open(directory, transaction_mode='LAZY')
+            with self.assertRaises(ImproperlyConfigured):
+                wrapper._start_transaction_under_autocommit()
+
+
+@override_settings(CATEGORY_SNAPSHOTS={'ENABLED': True, 'BACKGROUND': False})
+class TestSnapshots(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Fruits', active=True)
+        self.other = Category.objects.create(name='Légumes', active=True)
+        self.product = Product.objects.create(name='Pomme', active=True, category=self.category)
+        self.leek = Product.objects.create(name='Poireau', active=True, category=self.other)
+        self.article = Article.objects.create(name='Lot', price='1.20', active=True, product=self.product)
+        Article.objects.create(name='Botte', price='2.50', active=True, product=self.leek)
+        call_command('refresh_snapshots', stdout=StringIO())
+
+    def detail(self, category, **headers):
+        return self.client.get(reverse('category-detail', args=[category.pk]), **headers)
+
+    def live(self, category):
+        with override_settings(CATEGORY_SNAPSHOTS={'ENABLED': False}):
+            return self.detail(category).content
+
+    def test_single_lookup(self):
+        with self.settings(RESPONSE_CACHE={'ENABLED': False}):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.detail(self.category)
+            self.assertEqual(len(queries), 1)
+            self.assertEqual(response.content, self.live(self.category))
+            self.assertEqual(self.detail(self.category, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_rebuilt_on_write(self):
+        versions = dict(CategorySnapshot.objects.values_list('pk', 'version'))
+        writes = [
+            lambda: Article.objects.filter(pk=self.article.pk).update(price='3.10'),
+            lambda: Article.objects.create(name='Caisse', price='9.00', active=True, product=self.product),
+            lambda: self.product.disable(),
+            lambda: Product.objects.filter(pk=self.product.pk).update(active=True),
+            lambda: Category.objects.filter(pk=self.category.pk).update(description='Fruits de saison'),
+        ]
+        for write in writes:
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+            self.assertFalse(CategorySnapshot.objects.filter(stale=True).exists())
+            self.assertEqual(self.detail(self.category).content, self.live(self.category))
+        # Only the snapshot of the category written to was rebuilt
+        self.assertEqual(CategorySnapshot.objects.get(pk=self.other.pk).version, versions[self.other.pk])
+
+    def test_moves_stale_both_categories(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            self.product.category = self.other
+            self.product.save()
+        self.assertEqual(CategorySnapshot.objects.filter(stale=True).count(), 2)
+        for category in (self.category, self.other):
+            # Stale: served live
+            self.assertEqual(self.detail(category).content, self.live(category))
+        call_command('refresh_snapshots', stdout=StringIO())
+        self.assertFalse(CategorySnapshot.objects.filter(stale=True).exists())
+        self.assertEqual(self.detail(self.other).content, self.live(self.other))
+
+    def test_ecoscore_refresh_keeps_snapshot(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ecoscore.store(self.product, ECOSCORE_GRADE)
+        self.assertFalse(CategorySnapshot.objects.filter(stale=True).exists())
+
+    def test_missing_snapshot(self):
+        category = Category.objects.create(name='Épices', active=True)
+        CategorySnapshot.objects.filter(pk=category.pk).delete()
+        self.assertEqual(self.detail(category).status_code, 200)
+        # Built on the first read
+        self.assertFalse(CategorySnapshot.objects.get(pk=category.pk).stale)
+        self.assertEqual(self.detail(category).content, self.live(category))
+
+    def test_inactive(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.disable()
+        self.assertEqual(self.detail(self.other).status_code, 404)
+        response = self.client.get(reverse('category-detail', args=[self.other.pk]), {'show_inactive': 'true'})
+        self.assertEqual(response.json()['active'], False)
+
+    def test_rebuild_voided_by_write(self):
+        snapshot = CategorySnapshot.objects.get(pk=self.category.pk)
+        CategorySnapshot.objects.filter(pk=self.category.pk).mark_stale()
+        self.assertFalse(CategorySnapshot.objects.publish(self.category, snapshot.version, '{}', '', timezone.now()))
+        self.assertTrue(CategorySnapshot.objects.get(pk=self.category.pk).stale)
+
+    def test_queue_coalesces(self):
+        batches = []
+        queue = CoalescingQueue('test', handler=batches.append, delay=0.05)
+        for keys in ([1], [2], [1], []):
+            queue.put(keys)
+        deadline = time.monotonic() + 5
+        while not batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(batches, [{1, 2}])
+        self.assertEqual(queue.as_dict(), {'pending': 0, 'requests': 4, 'batches': 1})
+
+
+class TestSparseFields(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Fruits', description='Fruits de saison', active=True)
+        self.product = Product.objects.create(name='Pomme', active=True, category=self.category)
+        self.article = Article.objects.create(name='Lot', price='1.20', active=True, product=self.product)
+        Article.objects.create(name='Caisse', price='9.50', active=True, product=self.product)
+        self.cache = self.settings(RESPONSE_CACHE={'ENABLED': False})
+        self.cache.enable()
+        self.addCleanup(self.cache.disable)
+
+    def get(self, name, pk=None, **params):
+        url = reverse(f'{name}-detail', args=[pk]) if pk else reverse(f'{name}-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), queries
+
+    def test_nested_fields(self):
+        data, queries = self.get('category', self.category.pk,
+                                 fields='name,products.name,products.articles.price')
+        self.assertEqual(data, {
+            'id': self.category.pk, 'name': 'Fruits',
+            'products': [{'id': self.product.pk, 'name': 'Pomme',
+                          'articles': [{'id': self.article.pk, 'price': '1.20'}, {'id': mock.ANY, 'price': '9.50'}]}],
+        })
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('description', sql)
+        self.assertNotIn('date_created', sql)
+
+    def test_depth_and_expand(self):
+        full, full_queries = self.get('category', self.category.pk)
+        data, queries = self.get('category', self.category.pk, depth=0)
+        self.assertEqual(data, {key: value for key, value in full.items() if key != 'products'})
+        # The products and articles are not prefetched
+        self.assertEqual(len(queries), len(full_queries) - 2)
+
+        data, queries = self.get('category', self.category.pk, expand='products')
+        self.assertEqual(data['products'], [{key: value for key, value in product.items() if key != 'articles'}
+                                            for product in full['products']])
+        self.assertEqual(len(queries), len(full_queries) - 1)
+        data, _ = self.get('category', self.category.pk, depth=1, fields='products')
+        self.assertEqual(list(data), ['id', 'products'])
+        self.assertNotIn('articles', data['products'][0])
+        self.assertEqual(self.get('category', self.category.pk, depth=2)[0], full)
+
+        data, _ = self.get('product', self.product.pk, fields='name,category_name,articles.category_name')
+        self.assertEqual(data, {'id': self.product.pk, 'name': 'Pomme', 'category_name': 'Fruits', 'articles': [
+            {'id': article.pk, 'category_name': 'Fruits'} for article in self.product.articles.order_by('pk')]})
+
+    def test_lists(self):
+        with mock.patch('shop.models.Product.call_external_api', side_effect=AssertionError):
+            data, _ = self.get('product', fields='id,name')
+        # Not rendered, the ecoscore is not looked up
+        self.assertEqual(data['results'], [{'id': self.product.pk, 'name': 'Pomme'}])
+
+        data, _ = self.get('category', fields='name')
+        self.assertEqual(data['results'], [{'id': self.category.pk, 'name': 'Fruits'}])
+
+        data, queries = self.get('article', fields='price', pagination='cursor', ordering='-price', limit=1)
+        self.assertEqual(data['results'], [{'id': mock.ANY, 'price': '9.50'}])
+        self.assertNotIn('"name"', queries[-1]['sql'])
+        response = self.client.get(data['next'])
+        self.assertEqual(response.json()['results'], [{'id': self.article.pk, 'price': '1.20'}])
+
+        for denormalized in (True, False):
+            with self.settings(DENORMALIZED_ARTICLES=denormalized):
+                data, _ = self.get('article', self.article.pk, fields='name,category_name')
+                self.assertEqual(data, {'id': self.article.pk, 'name': 'Lot', 'category_name': 'Fruits'})
+
+    @override_settings(CATEGORY_SNAPSHOTS={'ENABLED': True, 'BACKGROUND': False})
+    def test_snapshot_not_used(self):
+        call_command('refresh_snapshots', stdout=StringIO())
+        data, _ = self.get('category', self.category.pk, fields='name')
+        self.assertEqual(data, {'id': self.category.pk, 'name': 'Fruits'})
+
+    def test_invalid_depth(self):
+        response = self.client.get(reverse('category-detail', args=[self.category.pk]), {'depth': '-1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('depth', response.json())
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class TestCompression(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        CatalogSeeder(1, 5, 10, active_ratio=1).run()
+        self.category = Category.objects.get()
+
+    @staticmethod
+    def gunzip(content):
+        return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+
+    def test_gzip(self):
+        url = reverse('category-detail', args=[self.category.pk])
+        plain = self.client.get(url)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertLess(len(response.content), len(plain.content))
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(self.gunzip(response.content), plain.content)
+        self.assertEqual(response['ETag'], f"W/{plain['ETag']}")
+        # The weak ETag still validates
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+    def test_small_and_disabled(self):
+        response = self.client.get(reverse('category-list'), {'fields': 'name'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        with self.settings(COMPRESSION={'ENABLED': False}):
+            response = self.client.get(reverse('category-detail', args=[self.category.pk]),
+                                       HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streaming(self):
+        url = reverse('article-export')
+        plain = b''.join(self.client.get(url, {'format': 'csv'}).streaming_content)
+        response = self.client.get(url, {'format': 'csv'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(self.gunzip(b''.join(response.streaming_content)), plain)
+
+    def test_brotli(self):
+        url = reverse('category-detail', args=[self.category.pk])
+        plain = self.client.get(url)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+
+        url = reverse('article-export')
+        plain = b''.join(self.client.get(url, {'format': 'ndjson'}).streaming_content)
+        response = self.client.get(url, {'format': 'ndjson'}, HTTP_ACCEPT_ENCODING='br')
+        self.assertEqual(brotli.decompress(b''.join(response.streaming_content)), plain)
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate('gzip'), 'gzip')
+        self.assertEqual(negotiate('gzip, br'), 'br')
+        self.assertEqual(negotiate('gzip, br;q=0.5'), 'gzip')
+        self.assertEqual(negotiate('*'), 'br')
+        self.assertIsNone(negotiate(''))
+        self.assertIsNone(negotiate('deflate, gzip;q=0'))
+        self.assertIsNone(negotiate('*;q=0'))
+        with mock.patch.object(compression, 'brotli', None):
+            self.assertEqual(negotiate('*'), 'gzip')
+            self.assertIsNone(negotiate('br'))
+
+
+class TestMessagePack(ShopAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        CatalogSeeder(1, 2, 3, active_ratio=1).run()
+
+    @mock.patch.object(MessagePackRenderer, 'available', False)
+    @mock.patch.object(MessagePackParser, 'available', False)
+    def test_unavailable(self):
+        url = reverse('category-detail', args=[Category.objects.get().pk])
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/msgpack').status_code, 406)
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack, application/json;q=0.5')
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+        user = get_user_model().objects.create_superuser('admin', 'admin@oc.drf', 'password')
+        self.client.force_authenticate(user)
+        response = self.client.post(reverse('admin-article-bulk'), b'\x90', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 415)
+
+    @override_settings(ECOSCORE={'BACKGROUND_REFRESH': False})
+    @mock.patch('shop.models.Product.call_external_api', mock_openfoodfact_success)
+    def test_renders_lists(self):
+        for name in ('category-list', 'product-list', 'article-list'):
+            url = reverse(name)
+            response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+            self.assertEqual(msgpack.unpackb(response.content), self.client.get(url).json())
+
+    def test_parses_bulk_rows(self):
+        product = Product.objects.first()
+        rows = [{'name': 'Caisse', 'price': '9.50', 'product': product.pk}, {'name': 'Lot'}, 'oops']
+        response = self.client.post(reverse('admin-article-bulk'), msgpack.packb(rows),
+                                    content_type='application/msgpack')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2])
+        self.assertTrue(Article.objects.filter(name='Caisse', product=product).exists())
+
+        response = self.client.post(reverse('admin-article-bulk'), b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,169 @@
+"""
+Shared HTTP access to third-party APIs.
+
+Calls go through a single pooled ``requests.Session`` so that concurrent
+lookups reuse keep-alive connections, and every call gets connect / read
+timeouts. Settings can be overridden through the ``UPSTREAM`` dict in the
+project settings.
+
+Async callers use ``arequest``, backed by one pooled ``httpx.AsyncClient``
+per event loop when httpx is installed, closed when its loop shuts down.
+Without it, the blocking session runs in a worker thread instead.
+
+Both go through the process-wide bulkhead and the circuit breaker of the
+upstream host, see ``shop.resilience``: errors, timeouts and 5xx answers
+count as failures, and ``resilience_stats()`` exposes their state.
+"""
+import asyncio
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from shop.resilience import Bulkhead, CircuitBreaker
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+DEFAULTS = {
+    'POOL_SIZE': 16,
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 5,
+    # Concurrent calls per process, and how long a call may wait for a slot
+    'MAX_CONCURRENT': 32,
+    'BULKHEAD_TIMEOUT': 0.25,
+    # Consecutive failures opening the circuit of a host, and seconds before probing it again
+    'BREAKER_THRESHOLD': 5,
+    'BREAKER_RECOVERY': 30,
+}
+
+_session = None
+_session_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+# The loops only keep weak references to their tasks
+_closing_tasks = set()
+_breakers = {}
+_bulkhead = None
+_resilience_lock = threading.Lock()
+
+
+def get_setting(name):
+    return getattr(settings, 'UPSTREAM', {}).get(name, DEFAULTS[name])
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=get_setting('POOL_SIZE'))
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def get_bulkhead():
+    global _bulkhead
+    with _resilience_lock:
+        if _bulkhead is None:
+            _bulkhead = Bulkhead(get_setting('MAX_CONCURRENT'), get_setting('BULKHEAD_TIMEOUT'))
+        return _bulkhead
+
+
+def get_breaker(url):
+    host = urlsplit(url).netloc
+    with _resilience_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host, get_setting('BREAKER_THRESHOLD'),
+                                                       get_setting('BREAKER_RECOVERY'))
+        return breaker
+
+
+def reset_resilience():
+    """Forget the breakers and the bulkhead, rebuilt from the current settings on the next call."""
+    global _bulkhead
+    with _resilience_lock:
+        _breakers.clear()
+        _bulkhead = None
+
+
+def resilience_stats():
+    with _resilience_lock:
+        breakers, bulkhead = dict(_breakers), _bulkhead
+    return {
+        'bulkhead': bulkhead.as_dict() if bulkhead else None,
+        'breakers': {host: breaker.as_dict() for host, breaker in sorted(breakers.items())},
+    }
+
+
+def record(breaker, response, probe):
+    if response.status_code >= 500:
+        breaker.record_failure(probe)
+    else:
+        breaker.record_success(probe)
+    return response
+
+
+def request(method, url):
+    timeout = (get_setting('CONNECT_TIMEOUT'), get_setting('READ_TIMEOUT'))
+    breaker = get_breaker(url)
+    with get_bulkhead():
+        probe = breaker.before_call()
+        try:
+            response = get_session().request(method, url, timeout=timeout)
+        except Exception:
+            breaker.record_failure(probe)
+            raise
+    return record(breaker, response, probe)
+
+
+def get_async_client():
+    # httpx clients are bound to the event loop they were first used on
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(get_setting('READ_TIMEOUT'), connect=get_setting('CONNECT_TIMEOUT')),
+            # Like the non blocking pool of requests: keep POOL_SIZE connections alive, open more on bursts
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=get_setting('POOL_SIZE')),
+        )
+        _async_clients[loop] = client
+        task = loop.create_task(close_on_shutdown(loop, client))
+        _closing_tasks.add(task)
+        task.add_done_callback(_closing_tasks.discard)
+    return client
+
+
+async def close_on_shutdown(loop, client):
+    """Close ``client`` once its loop shuts down, which cancels the pending tasks."""
+    try:
+        await loop.create_future()
+    finally:
+        _async_clients.pop(loop, None)
+        await client.aclose()
+
+
+async def arequest(method, url):
+    if httpx is None:
+        return await sync_to_async(request, thread_sensitive=False)(method, url)
+    breaker, bulkhead = get_breaker(url), get_bulkhead()
+    await bulkhead.aacquire()
+    try:
+        probe = breaker.before_call()
+        try:
+            response = await get_async_client().request(method, url)
+        except BaseException:
+            # Cancelled past the batch deadline counts as a failure too
+            breaker.record_failure(probe)
+            raise
+    finally:
+        bulkhead.release()
+    return record(breaker, response, probe)
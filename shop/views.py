@@ -1,51 +1,129 @@
-from rest_framework.viewsets import ReadOnlyModelViewSet, ModelViewSet
+from itertools import islice
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.viewsets import ReadOnlyModelViewSet, ModelViewSet, ViewSet
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
 
-from shop.models import Category, Product, Article
-from shop.serializers import CategoryListSerializer, CategoryDetailSerializer, ProductListSerializer, ProductDetailSerializer, ArticleSerializer
+from shop import stats, upstream
+from shop.bulk import BulkModelMixin
+from shop.cache import ResponseCacheMixin
+from shop.conditional import ConditionalGetMixin
+from shop.filters import PriceRangeFilter, LowestPriceFilter, TextSearchFilter, ShopOrderingFilter
+from shop.models import Category, Product, Article, ProductRollup
+from shop.renderers import PrometheusRenderer, NDJSONRenderer, CSVRenderer, csv_lines, ndjson_lines
+from shop.replicas import ReplicaReadMixin
+from shop.rows import ARTICLE_ROW, CATEGORY_ROW, DENORMALIZED_ARTICLE_ROW, RowListMixin
+from shop.serializers import CategoryListSerializer, CategoryDetailSerializer, ProductListSerializer, ProductDetailSerializer, ArticleSerializer, \
+    DenormalizedArticleSerializer, unique_name_context
+from shop.snapshots import CategorySnapshotMixin
+from shop.sparse import SparseFieldsMixin, sparse
+from shop.summary import SummaryMixin
 
 
-class AdminCategoryViewSet(ModelViewSet):
+class AdminCategoryViewSet(BulkModelMixin, ModelViewSet):
     serializer_class = CategoryListSerializer
     detail_serializer_class = CategoryDetailSerializer
     queryset = Category.objects.all()
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'retrieve':
+            queryset = queryset.with_active_tree()
+        return queryset
+
     def get_serializer_class(self):
         if self.action == 'retrieve' and self.detail_serializer_class:
             return self.detail_serializer_class
         return super().get_serializer_class()
 
+    def get_bulk_context(self, rows):
+        # Every name of the batch is checked with a single query
+        context = super().get_bulk_context(rows)
+        context.update(unique_name_context(Category, rows))
+        return context
+
     @action(detail=True, methods=['post'])
     def disable(self, request, pk):
         self.get_object().disable()
         return Response()
 
 
-class CategoryViewSet(ReadOnlyModelViewSet):
+class CategoryViewSet(ReplicaReadMixin, SparseFieldsMixin, CategorySnapshotMixin, ResponseCacheMixin, ConditionalGetMixin, SummaryMixin, RowListMixin, ReadOnlyModelViewSet):
     serializer_class = CategoryListSerializer
     detail_serializer_class = CategoryDetailSerializer
+    last_modified_fields = {
+        'retrieve': ('date_updated', 'products__date_updated', 'products__articles__date_updated'),
+    }
+    count_fields = {
+        'retrieve': ('products', 'products__articles'),
+    }
+    cache_dependencies = {
+        'list': (Category,),
+        'retrieve': (Category, Product, Article),
+        'summary': (Category, Product, Article, ProductRollup),
+    }
+    summary_articles = 'products__articles'
+    summary_rollups = 'products__rollup'
 
     def get_queryset(self):
         queryset = Category.objects.all()
         if self.request.GET.get('show_inactive') != 'true':
             queryset = queryset.filter(active=True)
+        if self.action == 'retrieve':
+            queryset = queryset.with_active_tree() if self.selection is None else self.sparse_tree(queryset)
         return queryset
 
+    def sparse_tree(self, queryset):
+        queryset = sparse(queryset, self.detail_serializer_class, self.selection)
+        products = self.selection.nested('products')
+        if products is None:
+            return queryset
+        # The prefetched rows know their category and product, only their foreign keys are read
+        product_queryset = sparse(Product.objects.all(), ProductDetailSerializer, products, keep=('category',),
+                                  related=False)
+        articles = products.nested('articles')
+        if articles is not None:
+            product_queryset = product_queryset.with_active_articles(
+                sparse(Article.objects.all(), ArticleSerializer, articles, keep=('product',), related=False))
+        return queryset.with_active_products(product_queryset)
+
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return self.detail_serializer_class
         return super().get_serializer_class()
 
+    def get_row_mapper(self):
+        return CATEGORY_ROW.select(self.selection)
+
     @action(detail=True, methods=['post'])
     def disable(self, request, pk):
         self.get_object().disable()
         return Response()
 
 
-class ProductViewSet(ReadOnlyModelViewSet):
+class ProductViewSet(ReplicaReadMixin, SparseFieldsMixin, ResponseCacheMixin, ConditionalGetMixin, SummaryMixin, ReadOnlyModelViewSet):
     serializer_class = ProductListSerializer
     detail_serializer_class = ProductDetailSerializer
+    filter_backends = [LowestPriceFilter, TextSearchFilter, ShopOrderingFilter]
+    ordering_fields = ['id', 'name', 'price']
+    ordering = ['id']
+    last_modified_fields = {
+        # The ecoscore cache is refreshed without touching date_updated
+        'list': ('date_updated', 'ecoscore_fetched_at'),
+        'retrieve': ('date_updated', 'category__date_updated', 'articles__date_updated'),
+    }
+    count_fields = {
+        'retrieve': ('articles',),
+    }
+    cache_dependencies = {
+        'list': (Product,),
+        'retrieve': (Category, Product, Article),
+        'summary': (Product, Article, ProductRollup),
+    }
 
     def get_queryset(self):
         queryset = Product.objects.all()
@@ -54,6 +132,18 @@ class ProductViewSet(ReadOnlyModelViewSet):
         category_id = self.request.GET.get('category_id')
         if category_id:
             queryset = queryset.filter(category_id=category_id)
+        if self.action == 'retrieve':
+            if self.selection is None:
+                return queryset.select_related('category').with_active_articles()
+            articles = self.selection.nested('articles')
+            if articles is None:
+                return sparse(queryset, self.detail_serializer_class, self.selection)
+            # The articles render the category of the product
+            queryset = sparse(queryset, self.detail_serializer_class, self.selection, keep=('category__name',))
+            return queryset.with_active_articles(
+                sparse(Article.objects.all(), ArticleSerializer, articles, keep=('product',), related=False))
+        if self.action == 'list' and self.selection is not None:
+            queryset = sparse(queryset, self.serializer_class, self.selection)
         return queryset
 
     def get_serializer_class(self):
@@ -67,21 +157,104 @@ class ProductViewSet(ReadOnlyModelViewSet):
         return Response()
 
 
-class AdminArticleViewSet(ModelViewSet):
+class AdminArticleViewSet(BulkModelMixin, ModelViewSet):
     serializer_class = ArticleSerializer
-    queryset = Article.objects.all()
+    queryset = Article.objects.select_related('product__category')
+
+    def get_bulk_context(self, rows):
+        # Load every product referenced by the batch with a single query
+        ids = set()
+        for row in rows:
+            if isinstance(row, dict):
+                try:
+                    ids.add(int(row['product']))
+                except (KeyError, TypeError, ValueError):
+                    pass
+        context = super().get_bulk_context(rows)
+        # With their category, copied on the created articles
+        context['products'] = Product.objects.select_related('category').in_bulk(ids)
+        return context
 
 
-class ArticleViewSet(ReadOnlyModelViewSet):
+class ArticleViewSet(ReplicaReadMixin, SparseFieldsMixin, ResponseCacheMixin, ConditionalGetMixin, RowListMixin, ReadOnlyModelViewSet):
     serializer_class = ArticleSerializer
+    filter_backends = [PriceRangeFilter, TextSearchFilter, ShopOrderingFilter]
+    ordering_fields = ['id', 'name', 'price']
+    ordering = ['id']
+    joined_last_modified_fields = {
+        'list': ('date_updated', 'product__date_updated', 'product__category__date_updated'),
+        'retrieve': ('date_updated', 'product__date_updated', 'product__category__date_updated'),
+    }
+    cache_dependencies = {
+        'list': (Category, Product, Article),
+        'retrieve': (Category, Product, Article),
+    }
+    export_chunk_size = 1000
+
+    @property
+    def denormalized(self):
+        return getattr(settings, 'DENORMALIZED_ARTICLES', False)
+
+    @property
+    def last_modified_fields(self):
+        # sync_denormalized() bumps the date_updated of the articles, no join is needed
+        return {} if self.denormalized else self.joined_last_modified_fields
 
     def get_queryset(self):
-        queryset = Article.objects.all()
+        # The denormalized columns spare the joins on products and categories
+        queryset = Article.objects.all() if self.denormalized else Article.objects.select_related('product__category')
         if self.request.GET.get('show_inactive') != 'true':
             queryset = queryset.filter(active=True)
         product_id = self.request.GET.get('product_id')
         if product_id:
             queryset = queryset.filter(product_id=product_id)
+        if self.action == 'retrieve' and self.selection is not None:
+            queryset = sparse(queryset, self.get_serializer_class(), self.selection)
         return queryset
 
+    def get_serializer_class(self):
+        if self.denormalized:
+            return DenormalizedArticleSerializer
+        return super().get_serializer_class()
+
+    def get_row_mapper(self):
+        return (DENORMALIZED_ARTICLE_ROW if self.denormalized else ARTICLE_ROW).select(self.selection)
+
+    @action(detail=False, renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        # Rows are read with a server side iterator and mapped without serializers,
+        # so memory stays constant whatever the size of the catalog
+        row = self.get_row_mapper()
+        queryset = self.filter_queryset(self.get_queryset()).order_by('id').values_list(*row.columns)
+        rows = map(row, queryset.iterator(chunk_size=self.export_chunk_size))
+        renderer = request.accepted_renderer
+        lines = csv_lines(rows) if renderer.format == 'csv' else ndjson_lines(rows)
+        response = StreamingHttpResponse(self.join_lines(lines), content_type=f'{renderer.media_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="articles.{renderer.format}"'
+        return response
+
+    def join_lines(self, lines):
+        while True:
+            chunk = ''.join(islice(lines, self.export_chunk_size))
+            if not chunk:
+                return
+            yield chunk
 
+
+class AdminStatsViewSet(ViewSet):
+    permission_classes = [IsAdminUser]
+    renderer_classes = [JSONRenderer, BrowsableAPIRenderer, PrometheusRenderer]
+
+    def list(self, request):
+        if request.accepted_renderer.format == 'prometheus':
+            return Response(stats.registry.as_prometheus() + stats.upstream_as_prometheus(upstream.resilience_stats()))
+        return Response(stats.registry.as_dict())
+
+    @action(detail=False)
+    def upstream(self, request):
+        return Response(upstream.resilience_stats())
+
+    @action(detail=False, methods=['post'])
+    def reset(self, request):
+        stats.registry.reset()
+        return Response()
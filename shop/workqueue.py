@@ -0,0 +1,77 @@
+"""
+Background queue coalescing bursts of work into batches.
+
+``put(keys)`` adds keys to a pending set and wakes a single worker thread,
+which waits ``delay`` seconds for the rest of the burst before handing the
+whole set to ``handler``: a key put again in the meantime is handled once.
+Without ``background`` the handler runs right away in the calling thread,
+which the tests and the management commands rely on.
+"""
+import logging
+import threading
+import time
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingQueue:
+
+    def __init__(self, name, handler=None, background=True, delay=0):
+        self.name = name
+        # Set by its owner, the queue drops the work until then
+        self.handler = handler
+        self.background = background
+        self.delay = delay
+        self.condition = threading.Condition()
+        self.pending = set()
+        self.woken = False
+        self.thread = None
+        self.requests = 0
+        self.batches = 0
+
+    def put(self, keys=()):
+        if self.handler is None:
+            return
+        if not self.background:
+            self.run(set(keys))
+            return
+        with self.condition:
+            self.requests += 1
+            self.pending.update(keys)
+            self.woken = True
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.work, name=self.name, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.woken:
+                    self.condition.wait()
+            # Let the rest of the burst pile up
+            time.sleep(self.delay)
+            try:
+                self.drain()
+            finally:
+                connections.close_all()
+
+    def drain(self):
+        """Handle the pending keys now, in the calling thread."""
+        with self.condition:
+            keys, self.pending, self.woken = self.pending, set(), False
+        self.run(keys)
+
+    def run(self, keys):
+        self.batches += 1
+        try:
+            self.handler(keys)
+        except Exception:
+            # The work is picked up again by the next batch
+            logger.exception('%s batch failed', self.name)
+
+    def as_dict(self):
+        with self.condition:
+            return {'pending': len(self.pending), 'requests': self.requests, 'batches': self.batches}